@@ -1,94 +1,44 @@
 import json
 import hashlib
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from uuid import uuid4
-from urllib.parse import urlparse
 from flask import Flask, jsonify, request
 import logging
 import requests
 import random
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import account_manager
+import chain_sync
+import db
+import hashing
+import mining
+import peers
+import reorg
+import validation
+import wire
+from chain_store import ChainWindow, DEFAULT_BLOCK_CACHE_SIZE
 
-# Initialize the SQLite database
-conn = sqlite3.connect('p2p_energy_trading.db', check_same_thread=False)
-cursor = conn.cursor()
+# The chain loader logs its progress every this many blocks
+LOAD_REPORT_INTERVAL = 10000
 
-# Create tables for blocks, transactions, and blockchain logs
-create_tables = '''
-CREATE TABLE IF NOT EXISTS Blockchain (
-    block_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    block_index INTEGER,
-    timestamp TEXT,
-    proof INTEGER,
-    previous_hash TEXT,
-    block_hash TEXT
-);
-'''
+# Peers queried at once during conflict resolution
+MAX_PEER_REQUESTS = 16
 
-create_transactions_table = '''
-CREATE TABLE IF NOT EXISTS Transactions (
-    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    block_id INTEGER,
-    Seller TEXT,
-    Buyer TEXT,
-    Power REAL,
-    Price REAL,
-    transaction_timestamp TEXT
-);
-'''
+# (connect, read) timeout in seconds for each peer request
+PEER_TIMEOUT = (3.05, 30)
 
-create_logs_table = '''
-CREATE TABLE IF NOT EXISTS BlockchainLogs (
-    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TEXT,
-    operation_type TEXT,
-    details TEXT
-);
-'''
-
-cursor.execute(create_tables)
-cursor.execute(create_transactions_table)
-cursor.execute(create_logs_table)
-conn.commit()
-
-def migrate_transactions_table():
-    try:
-        # Check if transaction_timestamp column exists
-        cursor.execute("PRAGMA table_info(Transactions)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'transaction_timestamp' not in columns:
-            # Add transaction_timestamp column
-            cursor.execute("ALTER TABLE Transactions ADD COLUMN transaction_timestamp TEXT")
-            # Update existing records with current timestamp
-            cursor.execute("UPDATE Transactions SET transaction_timestamp = ? WHERE transaction_timestamp IS NULL", 
-                         (str(datetime.now()),))
-            conn.commit()
-            print("Added transaction_timestamp column to Transactions table")
-    except sqlite3.Error as e:
-        print(f"Error migrating transactions table: {e}")
-
-# Run migration
-migrate_transactions_table()
-
-# Now that tables are created, we can add the block_hash column if needed
-def add_block_hash_column():
-    cursor.execute("PRAGMA table_info(Blockchain);")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'block_hash' not in columns:
-        cursor.execute("ALTER TABLE Blockchain ADD COLUMN block_hash TEXT;")
-        conn.commit()
-        print("Added 'block_hash' column to the Blockchain table.")
-
-add_block_hash_column()
+# Blocks read at a time while looking for the first recorded difficulty
+ACTIVATION_SCAN_BATCH = 1000
 
 # Helper function to log changes in the BlockchainLogs table
 def log_change(operation_type, details):
     try:
-        with sqlite3.connect('p2p_energy_trading.db', timeout=10, check_same_thread=False) as conn:
-            cursor = conn.cursor()
+        with db.transaction() as cursor:
             timestamp = str(datetime.now())
             
             print(f"DEBUG: Processing details for logging: {details}")
@@ -133,7 +83,6 @@ def log_change(operation_type, details):
             cursor.execute('''INSERT INTO BlockchainLogs (timestamp, operation_type, details) 
                             VALUES (?, ?, ?)''', 
                         (timestamp, operation_type, details_json))
-            conn.commit()
             print(f"[{timestamp}] {operation_type}: {processed_details}")
     except Exception as e:
         print(f"ERROR in log_change: {str(e)}")
@@ -145,12 +94,11 @@ def log_change(operation_type, details):
 
 # Function to insert a block and associated transactions into the database
 def insert_block_to_db(block, transactions):
-    with sqlite3.connect('p2p_energy_trading.db', timeout=10, check_same_thread=False) as conn:
-        cursor = conn.cursor()
+    # Block and transactions are committed together
+    with db.transaction() as cursor:
         cursor.execute('''INSERT INTO Blockchain (block_index, timestamp, proof, previous_hash, block_hash) 
                           VALUES (?, ?, ?, ?, ?)''', 
                        (block['index'], block['timestamp'], block['proof'], block['previous_hash'], block['block_hash']))
-        conn.commit()
         block_id = cursor.lastrowid
         
         for tx in transactions:
@@ -162,19 +110,52 @@ def insert_block_to_db(block, transactions):
                             float(tx['Power']), 
                             float(tx['Price']),
                             tx.get('transaction_timestamp', str(datetime.now()))))
-        conn.commit()
         return block_id
 
 class Blockchain:
-    def __init__(self, reset_chain=False):
+    def __init__(self, reset_chain=False, mining_workers=1,
+                 target_block_interval=None, retarget_window=mining.DEFAULT_RETARGET_WINDOW,
+                 max_resident_blocks=None, block_cache_size=DEFAULT_BLOCK_CACHE_SIZE):
+        # With max_resident_blocks set, only the newest blocks stay in memory and
+        # self.chain is a ChainWindow reading older ones from the database
+        self.max_resident_blocks = max_resident_blocks
+        self.block_cache_size = block_cache_size
         self.chain = []
         self.current_transactions = []
-        self.nodes = set()
+        self.load_stats = None
+        
+        # Number of processes used by proof_of_work; 1 keeps the search in-process
+        self.mining_workers = mining_workers
+        self._miner = None
+        # The pool's shared counters serve one search at a time
+        self._miner_lock = threading.Lock()
         
-        # Connect to database
-        self.conn = sqlite3.connect('p2p_energy_trading.db', check_same_thread=False)
+        # Guards appends to and replacement of the chain
+        self.lock = threading.RLock()
+        
+        # Pooled HTTP session for talking to peers, created on first use
+        self.peer_timeout = PEER_TIMEOUT
+        self.peer_accept = wire.ACCEPT
+        self._http = None
+        self._session_lock = threading.Lock()
+        
+        # Announces new blocks and transactions to peers when set, see gossip.py
+        self.gossip = None
+        
+        # Seconds between blocks that difficulty retargeting aims for; None keeps
+        # every block at the default difficulty
+        self.target_block_interval = target_block_interval
+        self.retarget_window = retarget_window
+        # (height, block hash) of the first block that recorded its difficulty
+        self._activation = None
+        
+        # Connect to database; the schema is checked when the first connection opens
+        self.conn = db.connect()
         self.cursor = self.conn.cursor()
         
+        # Known peers with their latency, last tip and backoff, kept across restarts
+        self.nodes = peers.PeerTable()
+        
         if reset_chain:
             self._reset_blockchain()
         else:
@@ -189,117 +170,188 @@ class Blockchain:
         self.cursor.execute("DELETE FROM Blockchain")
         self.cursor.execute("DELETE FROM Transactions")
         self.cursor.execute("DELETE FROM BlockchainLogs")
+        self.cursor.execute("DELETE FROM ValidationCheckpoint")
         self.conn.commit()
-        self.chain = []
+        self.chain = self._chain_view(0, [])
         self.current_transactions = []
 
+    @staticmethod
+    def _row_to_transaction(row):
+        """Build a transaction dict from (Seller, Buyer, Power, Price, transaction_timestamp, tx_hash)"""
+        # Handle both old and new transaction records
+        transaction = {
+            'Seller': str(row[0]),
+            'Buyer': str(row[1]),
+            'Power': float(row[2]) if row[2] is not None else 0.0,
+            'Price': float(row[3]) if row[3] is not None else 0.0
+        }
+        
+        # Add timestamp if it exists in the record
+        if row[4] is not None:
+            transaction['transaction_timestamp'] = str(row[4])
+        else:
+            transaction['transaction_timestamp'] = str(datetime.now())
+        
+        transaction['tx_hash'] = row[5] or hashing.hash_transaction(transaction)
+        return transaction
+
+    def _iter_blocks(self, where='', params=()):
+        """
+        Stream blocks with their transactions from one ordered join.
+        
+        Rows arrive ordered by block, so each block is yielded as soon as its
+        last transaction row has been read. `where` filters the Blockchain rows
+        (alias b).
+        """
+        rows = self.conn.execute(f"""SELECT b.block_id, b.block_index, b.timestamp, b.proof, b.previous_hash,
+                                            b.block_hash, b.difficulty, b.merkle_root, t.transaction_id,
+                                            t.Seller, t.Buyer, t.Power, t.Price, t.transaction_timestamp, t.tx_hash
+                                     FROM Blockchain b
+                                     LEFT JOIN Transactions t ON t.block_id = b.block_id
+                                     {where}
+                                     ORDER BY b.block_index, b.block_id, t.transaction_id""", params)
+        block_data = None
+        block_id = None
+        for row in rows:
+            if row[0] != block_id:
+                if block_data is not None:
+                    yield block_data
+                block_id = row[0]
+                block_data = {
+                    'index': row[1],
+                    'timestamp': row[2],
+                    'proof': row[3],
+                    'previous_hash': row[4],
+                    'block_hash': row[5],
+                    'transactions': []
+                }
+                # Older blocks were hashed without these fields
+                if row[6] is not None:
+                    block_data['difficulty'] = row[6]
+                if row[7] is not None:
+                    block_data['merkle_root'] = row[7]
+            
+            if row[8] is not None:
+                block_data['transactions'].append(self._row_to_transaction(row[9:]))
+        
+        if block_data is not None:
+            yield block_data
+
+    def _fetch_blocks(self, start, stop):
+        """Stored blocks at chain positions [start, stop)"""
+        return list(self._iter_blocks("WHERE b.block_index > ? AND b.block_index <= ?", (start, stop)))
+
+    def _chain_view(self, length, blocks):
+        """The chain container: a list, or a ChainWindow in bounded-memory mode"""
+        if not self.max_resident_blocks:
+            return list(blocks)
+        return ChainWindow(self._fetch_blocks, length, blocks,
+                           self.max_resident_blocks, self.block_cache_size)
+
     def _load_blockchain(self):
         """Load blockchain from database"""
         try:
-            # Load blocks
-            self.cursor.execute("SELECT * FROM Blockchain ORDER BY block_index")
-            blocks = self.cursor.fetchall()
+            # In bounded-memory mode only the newest blocks are loaded
+            where, params, height = '', (), None
+            if self.max_resident_blocks:
+                self.cursor.execute("SELECT COALESCE(MAX(block_index), 0) FROM Blockchain")
+                height = self.cursor.fetchone()[0]
+                where, params = "WHERE b.block_index > ?", (height - self.max_resident_blocks,)
             
-            for block in blocks:
-                block_data = {
-                    'index': block[1],
-                    'timestamp': block[2],
-                    'proof': block[3],
-                    'previous_hash': block[4],
-                    'block_hash': block[5],
-                    'transactions': []
-                }
-                
-                # Load transactions for this block
-                self.cursor.execute("SELECT * FROM Transactions WHERE block_id = ?", (block[0],))
-                transactions = self.cursor.fetchall()
-                
-                for tx in transactions:
-                    # Handle both old and new transaction records
-                    transaction = {
-                        'Seller': str(tx[2]),
-                        'Buyer': str(tx[3]),
-                        'Power': float(tx[4]) if tx[4] is not None else 0.0,
-                        'Price': float(tx[5]) if tx[5] is not None else 0.0
-                    }
-                    
-                    # Add timestamp if it exists in the record
-                    if len(tx) > 6 and tx[6] is not None:
-                        transaction['transaction_timestamp'] = str(tx[6])
-                    else:
-                        transaction['transaction_timestamp'] = str(datetime.now())
-                    
-                    block_data['transactions'].append(transaction)
-                
-                self.chain.append(block_data)
+            # Load blocks, reporting progress every LOAD_REPORT_INTERVAL blocks
+            blocks = []
+            started = batch_started = time.perf_counter()
+            for block_data in self._iter_blocks(where, params):
+                blocks.append(block_data)
+                if len(blocks) % LOAD_REPORT_INTERVAL == 0:
+                    now = time.perf_counter()
+                    logging.info(f"Loaded {len(blocks)} blocks "
+                                 f"({now - batch_started:.2f}s for the last {LOAD_REPORT_INTERVAL})")
+                    batch_started = now
+            self.chain = self._chain_view(len(blocks) if height is None else height, blocks)
+            
+            elapsed = time.perf_counter() - started
+            self.load_stats = {
+                'blocks': len(blocks),
+                'seconds': elapsed,
+                'seconds_per_10k_blocks': elapsed * 10000 / len(blocks) if blocks else 0.0,
+            }
+            logging.info(f"Loaded {len(blocks)} blocks in {elapsed:.2f}s "
+                         f"({self.load_stats['seconds_per_10k_blocks']:.2f}s per 10k blocks)")
             
             # Load pending transactions
-            self.cursor.execute("SELECT * FROM Transactions WHERE block_id IS NULL")
-            pending_txs = self.cursor.fetchall()
-            for tx in pending_txs:
-                transaction = {
-                    'Seller': str(tx[2]),
-                    'Buyer': str(tx[3]),
-                    'Power': float(tx[4]) if tx[4] is not None else 0.0,
-                    'Price': float(tx[5]) if tx[5] is not None else 0.0
-                }
-                
-                # Add timestamp if it exists in the record
-                if len(tx) > 6 and tx[6] is not None:
-                    transaction['transaction_timestamp'] = str(tx[6])
-                else:
-                    transaction['transaction_timestamp'] = str(datetime.now())
-                
-                self.current_transactions.append(transaction)
+            self.cursor.execute("""SELECT Seller, Buyer, Power, Price, transaction_timestamp, tx_hash
+                                   FROM Transactions WHERE block_id IS NULL
+                                   ORDER BY transaction_id""")
+            for tx in self.cursor.fetchall():
+                self.current_transactions.append(self._row_to_transaction(tx))
                 
         except sqlite3.Error as e:
             logging.error(f"Error loading blockchain: {e}")
             # If tables don't exist yet, just start with empty chain
-            self.chain = []
+            self.chain = self._chain_view(0, [])
             self.current_transactions = []
 
-    def new_block(self, proof, previous_hash=None):
-        if previous_hash is None:
-            previous_hash = self.hash(self.last_block) if self.chain else '1'
-        
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': str(datetime.now()),
-            'transactions': self.current_transactions,
-            'proof': proof,
-            'previous_hash': previous_hash,
-        }
-        
-        block_hash = self.hash(block)
-        block['block_hash'] = block_hash
-        
-        # Insert block into database
-        self.cursor.execute('''INSERT INTO Blockchain 
-                              (block_index, timestamp, proof, previous_hash, block_hash) 
-                              VALUES (?, ?, ?, ?, ?)''',
-                          (block['index'], block['timestamp'], block['proof'], 
-                           block['previous_hash'], block_hash))
-        block_id = self.cursor.lastrowid
-        
-        # Insert transactions
-        for tx in self.current_transactions:
-            self.cursor.execute('''INSERT INTO Transactions 
-                                  (block_id, Seller, Buyer, Power, Price, transaction_timestamp) 
-                                  VALUES (?, ?, ?, ?, ?, ?)''',
-                              (block_id, 
-                               str(tx['Seller']), 
-                               str(tx['Buyer']), 
-                               float(tx['Power']), 
-                               float(tx['Price']),
-                               tx.get('transaction_timestamp', str(datetime.now()))))
-        
-        self.conn.commit()
-        
-        # Reset current transactions
-        self.current_transactions = []
-        self.chain.append(block)
+    def new_block(self, proof, previous_hash=None, difficulty=None):
+        with self.lock:
+            if previous_hash is None:
+                previous_hash = self.last_block['block_hash'] if self.chain else '1'
+            if difficulty is None:
+                difficulty = self.next_difficulty()
+            
+            # The block keeps its own list: the mempool is replaced, never shared
+            transactions = list(self.current_transactions)
+            for tx in transactions:
+                if 'tx_hash' not in tx:
+                    tx['tx_hash'] = hashing.hash_transaction(tx)
+            
+            block = {
+                'index': len(self.chain) + 1,
+                'timestamp': str(datetime.now()),
+                'transactions': transactions,
+                'proof': proof,
+                'previous_hash': previous_hash,
+                'difficulty': difficulty,
+                'merkle_root': hashing.merkle_root([tx['tx_hash'] for tx in transactions]),
+            }
+            
+            block_hash = self.hash(block)
+            block['block_hash'] = block_hash
+            
+            # Insert block and its transactions into database
+            self._insert_block(self.cursor, block)
+            self.conn.commit()
+            
+            # Drop the mined transactions; any queued meanwhile stay for the next block
+            self.current_transactions = self.current_transactions[len(transactions):]
+            self.chain.append(block)
+            
+            if self.gossip is not None:
+                self.gossip.announce_block(block)
+            return block
+
+    @staticmethod
+    def _insert_block(cursor, block):
+        """Store a block and its transactions; the caller commits"""
+        cursor.execute('''INSERT INTO Blockchain 
+                          (block_index, timestamp, proof, previous_hash, block_hash, difficulty, merkle_root) 
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (block['index'], block['timestamp'], block['proof'], block['previous_hash'],
+                        block['block_hash'], block.get('difficulty'), block.get('merkle_root')))
+        block_id = cursor.lastrowid
         
-        return block
+        for tx in block['transactions']:
+            cursor.execute('''INSERT INTO Transactions 
+                              (block_id, Seller, Buyer, Power, Price, transaction_timestamp, tx_hash) 
+                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                           (block_id, 
+                            str(tx['Seller']), 
+                            str(tx['Buyer']), 
+                            float(tx['Power']), 
+                            float(tx['Price']),
+                            tx.get('transaction_timestamp', str(datetime.now())),
+                            tx.get('tx_hash') or hashing.hash_transaction(tx)))
+        return block_id
 
     def new_transaction_seller(self, Seller, Buyer, Power, Price):
         try:
@@ -327,11 +379,16 @@ class Blockchain:
                 'Price': price,
                 'transaction_timestamp': str(datetime.now())
             }
+            # Cache the hash now so blocks only combine hashes into a Merkle root
+            transaction['tx_hash'] = hashing.hash_transaction(transaction)
             print(f"DEBUG: Created transaction object: {transaction}")
             
-            # Add transaction to current transactions
-            self.current_transactions.append(transaction)
+            # Add transaction to current transactions; waits for a block being stored
+            with self.lock:
+                self.current_transactions.append(transaction)
             print(f"DEBUG: Added transaction to current_transactions")
+            if self.gossip is not None:
+                self.gossip.announce_transactions([transaction])
             
             # Log the transaction with proper type handling
             try:
@@ -357,21 +414,238 @@ class Blockchain:
             print(f"ERROR traceback: {traceback.format_exc()}")
             raise
     
-    def validate_chain(self):
-        # Validate the blockchain by checking hash links between blocks
-        for i in range(1, len(self.chain)):
-            previous_block = self.chain[i - 1]
-            current_block = self.chain[i]
-            #current_block['previous_hash'] = previous_block['block_hash']
-            if current_block['previous_hash'] != previous_block['block_hash']:
-                print(f"Validation failed: {current_block['previous_hash']} != {previous_block['block_hash']}")
+    def new_transactions(self, trades):
+        """
+        Queue already-settled (Seller, Buyer, Power, Price) trades for the next
+        block, in order, with one log entry for all of them. Returns the
+        transactions.
+        """
+        transactions = []
+        previous = None
+        for seller, buyer, power, price in trades:
+            # Strictly increasing timestamps keep identical trades' hashes distinct
+            timestamp = datetime.now()
+            if previous is not None and timestamp <= previous:
+                timestamp = previous + timedelta(microseconds=1)
+            previous = timestamp
+            
+            transaction = {
+                'Seller': str(seller),
+                'Buyer': str(buyer),
+                'Power': float(power),
+                'Price': float(price),
+                'transaction_timestamp': str(timestamp)
+            }
+            transaction['tx_hash'] = hashing.hash_transaction(transaction)
+            transactions.append(transaction)
+        
+        with self.lock:
+            self.current_transactions.extend(transactions)
+        if transactions:
+            if self.gossip is not None:
+                self.gossip.announce_transactions(transactions)
+            log_change("New Transactions", {"count": len(transactions)})
+        return transactions
+    
+    def pending_transactions(self, tx_hashes):
+        """The mempool transactions with the given hashes"""
+        wanted = set(tx_hashes)
+        with self.lock:
+            return [tx for tx in self.current_transactions if tx.get('tx_hash') in wanted]
+    
+    def receive_transactions(self, transactions):
+        """
+        Add transactions relayed by a peer to the mempool, skipping any we
+        already have, already mined, or whose tx_hash does not match. Each is
+        settled like a local trade: one whose seller or buyer has no account
+        here, or lacks the power or ETH, is left out. Returns the transactions
+        added.
+        """
+        with self.lock:
+            known = {tx.get('tx_hash') for tx in self.current_transactions}
+            fresh = []
+            for tx in transactions:
+                if not isinstance(tx, dict) or not all(key in tx for key in ('Seller', 'Buyer', 'Power', 'Price')):
+                    continue
+                transaction = {key: tx[key] for key in hashing.TRANSACTION_FIELDS if key in tx}
+                try:
+                    transaction['Power'] = float(transaction['Power'])
+                    transaction['Price'] = float(transaction['Price'])
+                except (TypeError, ValueError):
+                    continue
+                transaction['tx_hash'] = hashing.hash_transaction(transaction)
+                if transaction['tx_hash'] != tx.get('tx_hash') or transaction['tx_hash'] in known:
+                    continue
+                known.add(transaction['tx_hash'])
+                fresh.append(transaction)
+            if not fresh:
+                return []
+            
+            self.cursor.execute(f"""SELECT tx_hash FROM Transactions
+                                    WHERE tx_hash IN ({', '.join('?' * len(fresh))})""",
+                                [tx['tx_hash'] for tx in fresh])
+            mined = {row[0] for row in self.cursor.fetchall()}
+            fresh = [tx for tx in fresh if tx['tx_hash'] not in mined]
+            
+            trades = [(str(tx['Seller']), str(tx['Buyer']), tx['Power'], tx['Power'] * tx['Price'])
+                      for tx in fresh]
+            try:
+                with account_manager.account_cache.writing(), self.conn:
+                    self.cursor.execute("BEGIN IMMEDIATE")
+                    results = account_manager.settle_each(self.cursor, trades)
+            except sqlite3.Error:
+                account_manager.invalidate_cached({name for trade in trades for name in trade[:2]})
+                raise
+            added = []
+            for tx, result in zip(fresh, results):
+                if 'error' in result:
+                    logging.info(f"Relayed transaction {tx['tx_hash']} rejected: {result['error']}")
+                else:
+                    added.append(tx)
+            self.current_transactions.extend(added)
+        return added
+    
+    def validate_chain(self, full=False, workers=None):
+        """
+        Recompute and check every block's hash, Merkle root, difficulty, proof
+        and link to its parent.
+        
+        Blocks up to the stored checkpoint were verified before and are
+        skipped, as long as the checkpointed block is still in the chain. With
+        full=True every block is re-verified, split into segments checked in
+        parallel across `workers` processes. A successful run moves the
+        checkpoint to the tip.
+        """
+        with self.lock:
+            chain = self.chain
+            length = len(chain)
+            
+            if full:
+                failure = validation.validate_chain_parallel(
+                    chain[:length], self.target_block_interval, self.retarget_window, workers,
+                    activation=self._difficulty_activation(chain, length))
+            else:
+                # Only the unverified blocks and the retarget window before them are read
+                start = self._checkpoint_height(chain)
+                context = max(0, start - max(self.retarget_window, 1))
+                failure = validation.validate_range(
+                    chain[context:length], start - context, length - context,
+                    self.target_block_interval, self.retarget_window, offset=context,
+                    activation=self._difficulty_activation(chain, length))
+            
+            if failure:
+                position, reason = failure
+                print(reason)
                 return False
             
-            if not self.valid_proof(previous_block['proof'], current_block['proof']):
-                print(f"Proof of work validation failed for block {current_block['index']}")
+            if length:
+                self._save_checkpoint(length, chain[length - 1]['block_hash'])
+            return True
+    
+    def _checkpoint_height(self, chain):
+        """Number of leading blocks of chain already verified"""
+        self.cursor.execute("SELECT height, block_hash FROM ValidationCheckpoint WHERE id = 1")
+        row = self.cursor.fetchone()
+        if row is None:
+            return 0
+        height, block_hash = row
+        # A replaced chain invalidates the checkpoint
+        if not 0 < height <= len(chain) or chain[height - 1]['block_hash'] != block_hash:
+            return 0
+        return height
+    
+    def _save_checkpoint(self, height, block_hash):
+        self.cursor.execute('''INSERT OR REPLACE INTO ValidationCheckpoint (id, height, block_hash, verified_at)
+                               VALUES (1, ?, ?, ?)''', (height, block_hash, str(datetime.now())))
+        self.conn.commit()
+    
+    def cache_stats(self):
+        """Block cache counters in bounded-memory mode, else None"""
+        if isinstance(self.chain, ChainWindow):
+            return self.chain.stats()
+        return None
+    
+    def expected_difficulty(self, chain, position):
+        """Difficulty the retarget rule assigns to chain[position] (0-based)"""
+        return validation.expected_difficulty(chain, position, self.target_block_interval,
+                                              self.retarget_window,
+                                              activation=self._difficulty_activation(chain, position))
+    
+    def _difficulty_activation(self, chain, stop):
+        """
+        Height of the first of chain[:stop] to record its difficulty, or None.
+        Remembered by block hash, so only chains without one are scanned again.
+        """
+        if self._activation is not None:
+            height, block_hash = self._activation
+            if height <= stop and chain[height - 1]['block_hash'] == block_hash:
+                return height
+        for start in range(0, stop, ACTIVATION_SCAN_BATCH):
+            blocks = chain[start:min(start + ACTIVATION_SCAN_BATCH, stop)]
+            height = validation.difficulty_activation(blocks, offset=start)
+            if height is not None:
+                self._activation = (height, chain[height - 1]['block_hash'])
+                return height
+        return None
+    
+    def next_difficulty(self):
+        """Difficulty the next block must be mined at"""
+        with self.lock:
+            return self.expected_difficulty(self.chain, len(self.chain))
+    
+    def get_inclusion_proof(self, tx_hash):
+        """
+        Proof that a mined transaction is in a block: the block header and the
+        sibling hashes from the transaction up to the header's Merkle root.
+        
+        Returns None if the transaction is not in a mined block, and raises
+        ValueError if its block predates Merkle roots.
+        """
+        with self.lock:
+            self.cursor.execute("""SELECT b.block_index FROM Transactions t
+                                   JOIN Blockchain b ON b.block_id = t.block_id
+                                   WHERE t.tx_hash = ?""", (tx_hash,))
+            row = self.cursor.fetchone()
+            if row is None or not 0 < row[0] <= len(self.chain):
+                return None
+            block = self.chain[row[0] - 1]
+        
+        tx_hashes = hashing.transaction_hashes(block['transactions'])
+        if tx_hash not in tx_hashes:
+            return None
+        if 'merkle_root' not in block:
+            raise ValueError(f"Block {block['index']} was mined before Merkle roots and has no inclusion proofs")
+        
+        position = tx_hashes.index(tx_hash)
+        header = hashing.block_header(block)
+        header['block_hash'] = block['block_hash']
+        return {
+            'tx_hash': tx_hash,
+            'transaction': block['transactions'][position],
+            'position': position,
+            'header': header,
+            'siblings': hashing.merkle_proof(tx_hashes, position),
+        }
+    
+    @staticmethod
+    def verify_inclusion_proof(proof):
+        """
+        Check a proof from get_inclusion_proof: the header hashes to its
+        block_hash, the transaction (if included) hashes to tx_hash, and the
+        siblings lead from tx_hash to the header's Merkle root. Whether that
+        block is on the best chain is for the caller to check against the
+        headers it trusts.
+        """
+        try:
+            header = proof['header']
+            tx_hash = proof['tx_hash']
+            if hashing.hash_block(header) != header['block_hash']:
                 return False
-
-        return True
+            if 'transaction' in proof and hashing.hash_transaction(proof['transaction']) != tx_hash:
+                return False
+            return hashing.verify_merkle_proof(tx_hash, proof['siblings'], header['merkle_root'])
+        except (KeyError, TypeError, AttributeError):
+            return False
     
     @property
     def last_block(self):
@@ -379,55 +653,220 @@ class Blockchain:
         return self.chain[-1]
     @staticmethod
     def hash(block):
-        # Create a copy of the block without the block_hash field
-        block_copy = block.copy()
-        if 'block_hash' in block_copy:
-            del block_copy['block_hash']
-        # Hash a block to generate a unique identifier
-        block_string = json.dumps(block_copy, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        # Hash the block header (or the whole body of pre-Merkle blocks)
+        return hashing.hash_block(block)
    
     @staticmethod
-    def valid_proof(last_proof, proof):
+    def valid_proof(last_proof, proof, difficulty=mining.DEFAULT_DIFFICULTY):
         # Check if the proof of work is valid
-        this_proof = f'{proof}{last_proof}'.encode()
-        this_proof_hash = hashlib.sha256(this_proof).hexdigest()
-        return this_proof_hash[:4] == '0000'
+        return mining.valid_proof(last_proof, proof, difficulty)
 
-    def proof_of_work(self, last_proof):
-        # Proof of work algorithm
-        proof = 0
-        while not self.valid_proof(last_proof, proof):
-            proof += 1
-        return proof
+    def proof_of_work(self, last_proof, should_stop=None, difficulty=None):
+        # Proof of work algorithm, spread over a process pool when configured.
+        # Returns None if should_stop() becomes true before a proof is found.
+        if difficulty is None:
+            difficulty = self.next_difficulty()
+        if self.mining_workers is not None and self.mining_workers <= 1:
+            return mining.proof_of_work(last_proof, should_stop, difficulty)
+        
+        try:
+            with self._miner_lock:
+                if self._miner is None:
+                    self._miner = mining.ParallelMiner(self.mining_workers)
+                return self._miner.search(last_proof, should_stop, difficulty)
+        except OSError as e:
+            logging.error(f"Parallel mining unavailable, falling back to a single process: {e}")
+            self.mining_workers = 1
+            return mining.proof_of_work(last_proof, should_stop, difficulty)
     
     def register_node(self, address):
-        parsed_url = urlparse(address)
-        self.nodes.add(parsed_url.netloc)
+        """Add a peer by URL or host:port; raises ValueError for an address without a host"""
+        return self.nodes.add(address)
+    
+    def _session(self):
+        # One pooled HTTP session shared by all peer requests
+        with self._session_lock:
+            if self._http is None:
+                self._http = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_PEER_REQUESTS,
+                                                        pool_maxsize=MAX_PEER_REQUESTS)
+                self._http.mount('http://', adapter)
+                self._http.mount('https://', adapter)
+            return self._http
+    
+    def _peer_get(self, node, params, path='/chain'):
+        # Peers answer in the binary wire format if they support it, else JSON.
+        # Every outcome goes into the peer table
+        started = time.perf_counter()
+        try:
+            response = self._session().get(f'http://{node}{path}', params=params, timeout=self.peer_timeout,
+                                           headers={'Accept': self.peer_accept})
+            response.raise_for_status()
+            if response.headers.get('Content-Type') == wire.CONTENT_TYPE:
+                data = wire.decode(response.content)
+            else:
+                data = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            self.nodes.record_failure(node)
+            raise
+        height = data.get('length') if path == '/chain' and isinstance(data, dict) else None
+        self.nodes.record_success(node, time.perf_counter() - started, height)
+        return data
+    
+    def _peer(self, node):
+        return chain_sync.PeerChain(partial(self._peer_get, node))
+    
+    def valid_chain(self, chain):
+        """Check a whole chain received from a peer"""
+        failure = validation.validate_range(chain, 0, len(chain), self.target_block_interval,
+                                            self.retarget_window)
+        if failure:
+            print(failure[1])
+            return False
+        return True
+    
+    def _validate_branch(self, chain, fork, blocks):
+        """Reason blocks are invalid on top of chain[:fork], or None"""
+        if blocks and blocks[0].get('index') != fork + 1:
+            return f"Block {blocks[0].get('index')} does not follow block {fork}"
+        # The retarget window before the fork comes from our copy of the shared blocks
+        context = max(0, fork - max(self.retarget_window, 1))
+        branch = list(chain[context:fork]) + blocks
+        activation = self._difficulty_activation(chain, fork) or validation.difficulty_activation(blocks, fork)
+        failure = validation.validate_range(branch, fork - context, len(branch),
+                                            self.target_block_interval, self.retarget_window,
+                                            offset=context, activation=activation)
+        return failure[1] if failure else None
+    
+    def sync_from(self, node, peer_height=None):
+        """
+        Adopt a peer's chain if it is longer and valid, transferring only what
+        differs: headers are compared to find the fork point, then only the
+        blocks after it are fetched, validated and written to the database.
+        
+        Returns the number of our blocks that were replaced (0 when the peer
+        only extended our chain), or None if nothing was adopted.
+        """
+        peer = self._peer(node)
+        if peer_height is None:
+            peer_height = peer.height()
+        with self.lock:
+            chain = self.chain
+            height = len(chain)
+        if peer_height <= height:
+            return None
+        
+        fork = chain_sync.find_fork_point(lambda h: chain[h - 1]['block_hash'], height, peer, peer_height)
+        blocks = peer.blocks(fork + 1, peer_height)
+        if fork + len(blocks) <= height:
+            return None
+        reason = self._validate_branch(chain, fork, blocks)
+        if reason:
+            print(reason)
+            return None
+        
+        plan = self._adopt_branch(chain, fork, blocks)
+        if plan is None:
+            return None
+        log_change("Chain Replaced", {"new_length": fork + len(blocks), "fork_height": fork,
+                                      "replaced_blocks": height - fork, "peer": node,
+                                      "blocks_received": peer.blocks_received,
+                                      "applied_transactions": len(plan.applied),
+                                      "returned_transactions": len(plan.returned),
+                                      "dropped_transactions": len(plan.dropped)})
+        return height - fork
+    
+    def _adopt_branch(self, chain, fork, blocks):
+        """
+        Reorganize onto blocks after the fork: our blocks after it are orphaned,
+        balances are moved by the net effect of the switch, and orphaned
+        transactions go back to the mempool (see reorg.py). The rows, balances
+        and mempool change together, unless our chain changed underneath or
+        the branch would overdraw a local account. Returns the reorg plan, or
+        None if nothing was adopted.
+        """
+        with self.lock:
+            current = self.chain
+            if len(current) >= fork + len(blocks):
+                return None
+            if fork and (len(current) < fork
+                         or current[fork - 1]['block_hash'] != chain[fork - 1]['block_hash']):
+                return None
+            orphaned = current[fork:]
+            
+            # Orphaned blocks, the new branch and the balance changes are
+            # written in one transaction, so a restart never sees half of them
+            plan = None
+            try:
+                with account_manager.account_cache.writing(), self.conn:
+                    self.cursor.execute("BEGIN IMMEDIATE")
+                    plan = reorg.plan_reorg(orphaned, blocks, self.current_transactions,
+                                            partial(account_manager.get_balances, self.cursor))
+                    self.cursor.execute("""DELETE FROM Transactions WHERE block_id IN
+                                           (SELECT block_id FROM Blockchain WHERE block_index > ?)""", (fork,))
+                    self.cursor.execute("DELETE FROM Blockchain WHERE block_index > ?", (fork,))
+                    for block in blocks:
+                        self._insert_block(self.cursor, block)
+                    account_manager.apply_balance_deltas(self.cursor, plan.deltas)
+            except reorg.Overdraft as e:
+                # Nothing was written: the plan is checked before any update
+                print(f"Branch after block {fork} rejected: {e}")
+                return None
+            except sqlite3.Error:
+                # Cached balances may have been updated before the rollback
+                account_manager.invalidate_cached(plan.deltas if plan else ())
+                raise
+            
+            length = fork + len(blocks)
+            if isinstance(current, ChainWindow):
+                resident = blocks[-self.max_resident_blocks:]
+                if len(resident) < self.max_resident_blocks:
+                    kept = self.max_resident_blocks - len(resident)
+                    resident = list(current[max(0, fork - kept):fork]) + resident
+                self.chain = self._chain_view(length, resident)
+            else:
+                self.chain = current[:fork] + blocks
+            self.current_transactions = plan.mempool
+            return plan
     
     def resolve_conflicts(self):
-        neighbours = self.nodes.copy()
-        max_length = len(self.chain)
-        new_chain = None
+        """
+        Sync with the longest valid chain among our peers.
+        
+        All peers that are not backed off are asked for their height at once,
+        each with its own timeout, then the tallest are synced from in turn,
+        fastest first among equals, until one yields a valid longer chain.
+        """
+        neighbours = self.nodes.available()
+        if not neighbours:
+            return False
+        heights = {}
+        
+        with ThreadPoolExecutor(max_workers=min(len(neighbours), MAX_PEER_REQUESTS)) as executor:
+            futures = {executor.submit(lambda node: self._peer(node).height(), node): node
+                       for node in neighbours}
+            for future in as_completed(futures):
+                node = futures[future]
+                try:
+                    heights[node] = future.result()
+                except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                    print(f"Error connecting to node {node}: {e}")
         
-        for node in neighbours:
+        for node in sorted(heights, key=lambda node: (-heights[node], self.nodes.latency(node))):
+            if heights[node] <= len(self.chain):
+                break
             try:
-                response = requests.get(f'http://{node}/chain').json()
-                length = response['length']
-                chain = response['chain']
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
-            except requests.exceptions.RequestException as e:
-                print(f"Error connecting to node {node}: {e}")
-
-        if new_chain:
-            self.chain = new_chain
-            log_change("Chain Replaced", {"new_length": len(self.chain)})
-            return True
+                if self.sync_from(node, heights[node]) is not None:
+                    return True
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                print(f"Error syncing from node {node}: {e}")
         return False
-
+    
     def __del__(self):
-        """Cleanup database connection"""
+        """Cleanup database connection and mining pool"""
+        if getattr(self, '_miner', None) is not None:
+            self._miner.close()
+        if getattr(self, '_http', None) is not None:
+            self._http.close()
         if hasattr(self, 'conn'):
             self.conn.close()
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+In-process cache of account rows.
+
+Keeps the accounts most recently read by get_account, keyed by database file
+and account name. Balance writes go through the cache as well as the
+database, so cached balances never lag behind committed ones.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_ACCOUNT_CACHE_SIZE = 10000
+
+
+class AccountCache:
+    def __init__(self, max_size=DEFAULT_ACCOUNT_CACHE_SIZE):
+        self.max_size = max_size
+        self._accounts = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped around every write, and writes in flight are counted, so a
+        # read that raced a write never caches the row it read
+        self._version = 0
+        self._writers = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """A copy of the cached account, or None"""
+        with self._lock:
+            account = self._accounts.get(key)
+            if account is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accounts.move_to_end(key)
+            return dict(account)
+
+    @property
+    def version(self):
+        return self._version
+
+    def fill(self, key, account, version):
+        """
+        Cache an account read from the database, unless a write started since
+        `version` was taken before that read or is still in flight.
+        """
+        with self._lock:
+            if version != self._version or self._writers or self.max_size <= 0:
+                return
+            self._accounts[key] = dict(account)
+            self._accounts.move_to_end(key)
+            self._evict()
+
+    @contextmanager
+    def writing(self):
+        """
+        Wrap a database write transaction. Call update() inside it, while the
+        write lock is held, so cached values change in commit order.
+        """
+        with self._lock:
+            self._writers += 1
+            self._version += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._writers -= 1
+                self._version += 1
+
+    def update(self, key, **fields):
+        """Write field values through to a cached account"""
+        with self._lock:
+            self._version += 1
+            account = self._accounts.get(key)
+            if account is not None:
+                account.update(fields)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._version += 1
+            if self._accounts.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached account, e.g. after the database was reset"""
+        with self._lock:
+            self._version += 1
+            self.invalidations += len(self._accounts)
+            self._accounts.clear()
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def _evict(self):
+        while len(self._accounts) > max(self.max_size, 0):
+            self._accounts.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'cached_accounts': len(self._accounts),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,83 +1,150 @@
 import sqlite3
 import uuid
 import logging
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+import db
+from account_cache import AccountCache
+from key_pool import KeyPool, generate_key_pair, generate_key_pairs
+
+# Accounts read by get_account; balance writes below keep it current
+account_cache = AccountCache()
+
+# Accounts inserted per transaction by create_accounts
+BULK_INSERT_BATCH_SIZE = 500
+
+# Background pool of pre-generated RSA key pairs, see start_key_pool
+key_pool = None
+
+def start_key_pool(low_water, workers=None):
+    global key_pool
+    if key_pool is not None:
+        key_pool.close()
+    key_pool = KeyPool(low_water, workers).start() if low_water > 0 else None
+    return key_pool
+
+def key_pool_stats():
+    return key_pool.stats() if key_pool is not None else None
+
+def _cache_key(name):
+    # Scoped to the database file, which is relative to the working directory
+    return (db.db_path(), name)
 
 def create_account(name):
     try:
-        # Connect to SQLite database (or create it if it doesn't exist)
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
-
-        # Create the accounts table if it doesn't exist
-        cursor.execute('''CREATE TABLE IF NOT EXISTS accounts (
-                        id TEXT PRIMARY KEY,
-                        name TEXT UNIQUE,
-                        public_key TEXT,
-                        private_key TEXT,
-                        balance REAL DEFAULT 0.0,
-                        power_balance REAL DEFAULT 0.0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )''')
-        conn.commit()
-
         # Check if account name already exists
-        cursor.execute("SELECT id FROM accounts WHERE name = ?", (name,))
-        if cursor.fetchone():
+        conn = db.get_connection()
+        if conn.execute("SELECT id FROM accounts WHERE name = ?", (name,)).fetchone():
             raise ValueError(f"Account with name '{name}' already exists")
 
         # Generate a random ID
         account_id = str(uuid.uuid4())
 
-        # Generate a pair of RSA keys
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        public_key = private_key.public_key()
-
-        # Serialize keys to store them as strings in the database
-        private_key_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption()
-        ).decode('utf-8')
-
-        public_key_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        ).decode('utf-8')
+        # Take a pre-generated key pair, generating one inline if none is ready
+        keys = key_pool.take() if key_pool is not None else None
+        private_key_pem, public_key_pem = keys or generate_key_pair()
 
         # Insert the new account into the database
-        cursor.execute("INSERT INTO accounts (id, name, public_key, private_key, balance, power_balance) VALUES (?, ?, ?, ?, ?, ?)",
-                       (account_id, name, public_key_pem, private_key_pem, 0.0, 0.0))
-        conn.commit()
+        with db.transaction() as cursor:
+            cursor.execute("INSERT INTO accounts (id, name, public_key, private_key, balance, power_balance) VALUES (?, ?, ?, ?, ?, ?)",
+                           (account_id, name, public_key_pem, private_key_pem, 0.0, 0.0))
 
         return {"id": account_id, "name": name, "public_key": public_key_pem, "balance": 0.0, "power_balance": 0.0}
     
+    except sqlite3.IntegrityError:
+        # Created by another request after the check above
+        raise ValueError(f"Account with name '{name}' already exists")
     except sqlite3.Error as e:
         logging.error(f"Database error in create_account: {e}")
         raise ValueError("Failed to create account")
-    finally:
-        # Close the database connection
-        conn.close()
 
-def get_account(name):
+def create_accounts(names, workers=None, batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Create many accounts at once, with the same rules as create_account.
+
+    Key pairs come from the key pool first, the rest are generated across
+    `workers` processes. Accounts are inserted `batch_size` per transaction.
+    A bad or duplicate name fails on its own without affecting the others.
+    Returns one result per input name, in order: {"name", "status": "created",
+    "id", "public_key"} or {"name", "status": "failed", "error"}.
+    """
+    results = []
+    pending = {}
+    for raw_name in names:
+        name = raw_name.strip() if isinstance(raw_name, str) else raw_name
+        if not isinstance(name, str) or not name:
+            results.append({"name": raw_name, "status": "failed", "error": "Name must be a non-empty string"})
+        elif name in pending:
+            results.append({"name": name, "status": "failed", "error": f"Duplicate name '{name}' in request"})
+        else:
+            result = {"name": name}
+            pending[name] = result
+            results.append(result)
+
     try:
-        # Connect to SQLite database
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
+        # Names that already exist, checked in chunks to stay under SQLite's parameter limit
+        conn = db.get_connection()
+        candidates = list(pending)
+        for start in range(0, len(candidates), batch_size):
+            chunk = candidates[start:start + batch_size]
+            rows = conn.execute(f"SELECT name FROM accounts WHERE name IN ({','.join('?' * len(chunk))})",
+                                chunk).fetchall()
+            for (name,) in rows:
+                pending.pop(name).update(status="failed", error=f"Account with name '{name}' already exists")
+
+        # Pooled key pairs first, then generate the rest in parallel
+        keys = []
+        while key_pool is not None and len(keys) < len(pending):
+            pair = key_pool.take()
+            if pair is None:
+                break
+            keys.append(pair)
+        try:
+            keys.extend(generate_key_pairs(len(pending) - len(keys), workers))
+        except Exception as e:
+            # Names that got a pooled key are still created; the rest fail on their own
+            logging.error(f"Key generation failed in create_accounts: {e!r}")
+
+        to_insert = list(zip(pending.items(), keys))
+        for name, result in list(pending.items())[len(keys):]:
+            result.update(status="failed", error="Failed to generate a key pair")
+        for start in range(0, len(to_insert), batch_size):
+            inserted = []
+            with db.transaction() as cursor:
+                for (name, result), (private_key_pem, public_key_pem) in to_insert[start:start + batch_size]:
+                    account_id = str(uuid.uuid4())
+                    # Another request may have taken the name since the check above
+                    cursor.execute("""INSERT OR IGNORE INTO accounts (id, name, public_key, private_key, balance, power_balance)
+                                      VALUES (?, ?, ?, ?, ?, ?)""",
+                                   (account_id, name, public_key_pem, private_key_pem, 0.0, 0.0))
+                    inserted.append((result, account_id if cursor.rowcount else None, public_key_pem))
+            
+            # Only reported once the batch has committed
+            for result, account_id, public_key_pem in inserted:
+                if account_id:
+                    result.update(status="created", id=account_id, public_key=public_key_pem)
+                else:
+                    result.update(status="failed", error=f"Account with name '{result['name']}' already exists")
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error in create_accounts: {e}")
+        for result in results:
+            if "status" not in result:
+                result.update(status="failed", error="Failed to create account")
 
-        # First, let's check the table structure
-        cursor.execute("PRAGMA table_info(accounts)")
-        columns = [column[1] for column in cursor.fetchall()]
-        print(f"DEBUG: Account table columns: {columns}")
+    return results
 
-        cursor.execute("SELECT * FROM accounts WHERE name = ?", (name,))
-        account = cursor.fetchone()
+def get_account(name):
+    key = _cache_key(name)
+    cached = account_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        # A write that commits while we read makes this row too old to cache
+        version = account_cache.version
+        # Named columns, so the result does not depend on the table's column order
+        account = db.get_connection().execute(
+            "SELECT id, name, public_key, balance, power_balance, created_at FROM accounts WHERE name = ?",
+            (name,)).fetchone()
         if account:
             print(f"DEBUG: Raw account data: {account}")
             # Create account dictionary with proper type conversion
@@ -85,11 +152,12 @@ def get_account(name):
                 "id": account[0],
                 "name": account[1],
                 "public_key": account[2],
-                "balance": float(account[4]) if account[4] is not None else 0.0,
-                "power_balance": float(account[5]) if account[5] is not None else 0.0,
-                "created_at": account[6]
+                "balance": float(account[3]) if account[3] is not None else 0.0,
+                "power_balance": float(account[4]) if account[4] is not None else 0.0,
+                "created_at": account[5]
             }
             print(f"DEBUG: Processed account data: {account_dict}")
+            account_cache.fill(key, account_dict, version)
             return account_dict
         else:
             return None
@@ -103,110 +171,267 @@ def get_account(name):
         import traceback
         print(f"ERROR traceback: {traceback.format_exc()}")
         return None
-    finally:
-        # Close the database connection
-        conn.close()
 
 def update_balance(name, amount):
     try:
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
-        
-        # Get current balance
-        cursor.execute("SELECT balance FROM accounts WHERE name = ?", (name,))
-        result = cursor.fetchone()
-        if not result:
-            raise ValueError(f"Account {name} not found")
+        # Read and write under one write lock so concurrent updates are not lost
+        with account_cache.writing(), db.transaction(immediate=True) as cursor:
+            # Get current balance
+            cursor.execute("SELECT balance FROM accounts WHERE name = ?", (name,))
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"Account {name} not found")
+                
+            current_balance = float(result[0]) if result[0] is not None else 0.0
+            new_balance = current_balance + float(amount)
             
-        current_balance = float(result[0]) if result[0] is not None else 0.0
-        new_balance = current_balance + float(amount)
-        
-        if new_balance < 0:
-            raise ValueError(f"Insufficient balance for account {name}")
-            
-        # Update balance
-        cursor.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_balance, name))
-        conn.commit()
+            if new_balance < 0:
+                raise ValueError(f"Insufficient balance for account {name}")
+                
+            # Update balance
+            cursor.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_balance, name))
+            account_cache.update(_cache_key(name), balance=new_balance)
         
         return new_balance
         
     except sqlite3.Error as e:
+        account_cache.invalidate(_cache_key(name))
         logging.error(f"Database error in update_balance: {e}")
         raise ValueError("Failed to update balance")
-    finally:
-        conn.close()
 
 def update_power_balance(name, amount):
     try:
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
-        
-        # Get current power balance
-        cursor.execute("SELECT power_balance FROM accounts WHERE name = ?", (name,))
-        result = cursor.fetchone()
-        if not result:
-            raise ValueError(f"Account {name} not found")
+        # Read and write under one write lock so concurrent updates are not lost
+        with account_cache.writing(), db.transaction(immediate=True) as cursor:
+            # Get current power balance
+            cursor.execute("SELECT power_balance FROM accounts WHERE name = ?", (name,))
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"Account {name} not found")
+                
+            current_power_balance = float(result[0]) if result[0] is not None else 0.0
+            new_power_balance = current_power_balance + float(amount)
             
-        current_power_balance = float(result[0]) if result[0] is not None else 0.0
-        new_power_balance = current_power_balance + float(amount)
-        
-        if new_power_balance < 0:
-            raise ValueError(f"Insufficient power balance for account {name}")
-            
-        # Update power balance
-        cursor.execute("UPDATE accounts SET power_balance = ? WHERE name = ?", (new_power_balance, name))
-        conn.commit()
+            if new_power_balance < 0:
+                raise ValueError(f"Insufficient power balance for account {name}")
+                
+            # Update power balance
+            cursor.execute("UPDATE accounts SET power_balance = ? WHERE name = ?", (new_power_balance, name))
+            account_cache.update(_cache_key(name), power_balance=new_power_balance)
         
         return new_power_balance
         
     except sqlite3.Error as e:
+        account_cache.invalidate(_cache_key(name))
         logging.error(f"Database error in update_power_balance: {e}")
         raise ValueError("Failed to update power balance")
-    finally:
-        conn.close()
+
+# Trades settled per call of settle_trades
+MAX_TRADE_BATCH = 1000
+
+def _settle(cursor, seller, buyer, power, cost):
+    """
+    Apply one trade inside the caller's transaction and return its balances.
+    On ValueError the seller's side may already be applied; the caller rolls
+    it back.
+    """
+    if power < 0 or cost < 0:
+        raise ValueError("Power and price must not be negative")
+
+    cursor.execute("SELECT name, balance, power_balance FROM accounts WHERE name IN (?, ?)",
+                   (seller, buyer))
+    before = {row[0]: {"balance": float(row[1] or 0.0), "power_balance": float(row[2] or 0.0)}
+              for row in cursor.fetchall()}
+    for role, name in (("Seller", seller), ("Buyer", buyer)):
+        if name not in before:
+            raise ValueError(f"{role} account '{name}' does not exist")
+
+    # Seller: receives ETH, gives power it must have
+    cursor.execute("""UPDATE accounts SET balance = balance + ?, power_balance = power_balance - ?
+                      WHERE name = ? AND power_balance >= ?
+                      RETURNING balance, power_balance""", (cost, power, seller, power))
+    seller_after = cursor.fetchone()
+    if seller_after is None:
+        raise ValueError(f"Insufficient power balance for seller {seller}")
+
+    # Buyer: pays ETH it must have, receives power
+    cursor.execute("""UPDATE accounts SET balance = balance - ?, power_balance = power_balance + ?
+                      WHERE name = ? AND balance >= ?
+                      RETURNING balance, power_balance""", (cost, power, buyer, cost))
+    buyer_after = cursor.fetchone()
+    if buyer_after is None:
+        raise ValueError(f"Insufficient ETH balance for buyer {buyer}")
+
+    seller_after = {"balance": float(seller_after[0]), "power_balance": float(seller_after[1])}
+    buyer_after = {"balance": float(buyer_after[0]), "power_balance": float(buyer_after[1])}
+    account_cache.update(_cache_key(seller), **seller_after)
+    account_cache.update(_cache_key(buyer), **buyer_after)
+    return {
+        "seller": {"name": seller, "before": before[seller], "after": seller_after},
+        "buyer": {"name": buyer, "before": before[buyer], "after": buyer_after},
+    }
+
+def settle_trade(seller, buyer, power, cost):
+    """
+    Move `cost` ETH from buyer to seller and `power` kWh from seller to buyer
+    in one database transaction.
+
+    Each side is a single conditional update, so a balance can never go
+    negative even under concurrent trades. Returns
+    {"seller": {...}, "buyer": {...}}, each with the account name and its
+    balances "before" and "after". Raises ValueError, with nothing changed, if
+    an account is missing or short of ETH or power.
+    """
+    try:
+        with account_cache.writing(), db.transaction(immediate=True) as cursor:
+            return _settle(cursor, seller, buyer, float(power), float(cost))
+
+    except sqlite3.Error as e:
+        account_cache.invalidate(_cache_key(seller))
+        account_cache.invalidate(_cache_key(buyer))
+        logging.error(f"Database error in settle_trade: {e}")
+        raise ValueError("Failed to settle trade")
+
+def settle_trades(trades):
+    """
+    Settle a list of (seller, buyer, power, cost) trades in one database
+    transaction.
+
+    Trades are applied in list order, each against the balances the earlier
+    ones left. A trade that fails is rolled back to a savepoint on its own and
+    the rest still settle. Returns one result per trade, in order: the
+    settle_trade result, or {"error": reason}. Raises ValueError, with
+    nothing settled, if the transaction itself fails.
+    """
+    if len(trades) > MAX_TRADE_BATCH:
+        raise ValueError(f"At most {MAX_TRADE_BATCH} trades per batch")
+    try:
+        with account_cache.writing(), db.transaction(immediate=True) as cursor:
+            return settle_each(cursor, trades)
+
+    except sqlite3.Error as e:
+        for seller, buyer, _, _ in trades:
+            account_cache.invalidate(_cache_key(seller))
+            account_cache.invalidate(_cache_key(buyer))
+        logging.error(f"Database error in settle_trades: {e}")
+        raise ValueError("Failed to settle trades")
+
+def settle_each(cursor, trades):
+    """
+    Settle (seller, buyer, power, cost) trades inside the caller's
+    transaction, which must be wrapped in account_cache.writing(). A trade
+    that fails is rolled back to a savepoint on its own. Returns one result
+    per trade, as settle_trades does.
+    """
+    results = []
+    for seller, buyer, power, cost in trades:
+        cursor.execute("SAVEPOINT trade")
+        try:
+            results.append(_settle(cursor, seller, buyer, float(power), float(cost)))
+        except ValueError as e:
+            cursor.execute("ROLLBACK TO trade")
+            results.append({"error": str(e)})
+        cursor.execute("RELEASE trade")
+    return results
+
+def get_balances(cursor, names):
+    """{name: (balance, power_balance)} for those of `names` that have accounts"""
+    names = list(names)
+    balances = {}
+    for start in range(0, len(names), BULK_INSERT_BATCH_SIZE):
+        batch = names[start:start + BULK_INSERT_BATCH_SIZE]
+        cursor.execute(f"""SELECT name, balance, power_balance FROM accounts
+                           WHERE name IN ({', '.join('?' * len(batch))})""", batch)
+        for name, balance, power_balance in cursor.fetchall():
+            balances[name] = (float(balance or 0.0), float(power_balance or 0.0))
+    return balances
+
+def apply_balance_deltas(cursor, deltas):
+    """
+    Add {name: (balance_delta, power_delta)} to accounts inside the caller's
+    transaction, which must be wrapped in account_cache.writing(). Unlike
+    trades, these are not checked against zero: they replay what the chain
+    already settled.
+    """
+    for name, (balance, power) in deltas.items():
+        cursor.execute("""UPDATE accounts SET balance = balance + ?, power_balance = power_balance + ?
+                          WHERE name = ? RETURNING balance, power_balance""", (balance, power, name))
+        row = cursor.fetchone()
+        if row is not None:
+            account_cache.update(_cache_key(name), balance=float(row[0]), power_balance=float(row[1]))
+
+def invalidate_cached(names):
+    """Drop accounts from the cache, e.g. after a rolled-back write"""
+    for name in names:
+        account_cache.invalidate(_cache_key(name))
 
 def migrate_database():
+    """Create or upgrade the schema; a no-op once it has been checked in this process"""
     try:
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
-        
-        # Check if power_balance column exists
-        cursor.execute("PRAGMA table_info(accounts)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'power_balance' not in columns:
-            # Add power_balance column
-            cursor.execute("ALTER TABLE accounts ADD COLUMN power_balance REAL DEFAULT 0.0")
-            conn.commit()
-            logging.info("Added power_balance column to accounts table")
-            
-        conn.close()
+        db.get_connection()
         return True
     except sqlite3.Error as e:
         logging.error(f"Database migration error: {e}")
         return False
 
+# Fields /accounts may return; private keys are never listed
+ACCOUNT_FIELDS = ('id', 'name', 'balance', 'power_balance', 'created_at', 'public_key')
+LIST_FIELDS = ('id', 'name', 'balance', 'power_balance', 'created_at')
+
+# Columns accounts can be paged by; both are unique and indexed
+ORDER_KEYS = ('name', 'id')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def _account_row_to_dict(fields, row):
+    account = dict(zip(fields, row))
+    for field in ('balance', 'power_balance'):
+        if field in account:
+            account[field] = float(account[field]) if account[field] is not None else 0.0
+    return account
+
+def get_accounts_page(order_by='name', after=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+    """
+    One page of accounts ordered by `order_by`, starting after the key `after`.
+
+    Returns (accounts, next_cursor); next_cursor is the key to pass as `after`
+    for the following page, or None on the last page. Raises ValueError for an
+    unknown order key or field.
+    """
+    if order_by not in ORDER_KEYS:
+        raise ValueError(f"Accounts can only be ordered by {', '.join(ORDER_KEYS)}")
+    fields = tuple(fields or LIST_FIELDS)
+    unknown = [field for field in fields if field not in ACCOUNT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown account fields: {', '.join(unknown)}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    # The order key is always read, to build the cursor, and dropped if not asked for
+    columns = fields + (order_by,)
+    where, params = "", ()
+    if after is not None:
+        where, params = f"WHERE {order_by} > ?", (after,)
+    # One extra row tells whether there is a next page
+    rows = db.get_connection().execute(
+        f"SELECT {', '.join(columns)} FROM accounts {where} ORDER BY {order_by} LIMIT ?",
+        params + (limit + 1,)).fetchall()
+
+    next_cursor = rows[limit - 1][-1] if len(rows) > limit else None
+    return [_account_row_to_dict(fields, row[:-1]) for row in rows[:limit]], next_cursor
+
+def iter_accounts(order_by='name', after=None, fields=None, batch_size=MAX_PAGE_SIZE):
+    """Every account after `after`, read page by page so memory stays flat"""
+    while True:
+        accounts, after = get_accounts_page(order_by, after, batch_size, fields)
+        yield from accounts
+        if after is None:
+            return
+
 def get_all_accounts():
     try:
-        # Ensure database is migrated
-        migrate_database()
-        
-        conn = sqlite3.connect('p2p_energy_trading.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, name, balance, power_balance, created_at FROM accounts")
-        accounts = cursor.fetchall()
-        
-        return [{
-            "id": account[0],
-            "name": account[1],
-            "balance": float(account[2]) if account[2] is not None else 0.0,
-            "power_balance": float(account[3]) if account[3] is not None else 0.0,
-            "created_at": account[4]
-        } for account in accounts]
-        
+        # The schema is checked when the pooled connection is first opened
+        return list(iter_accounts())
     except sqlite3.Error as e:
         logging.error(f"Database error in get_all_accounts: {e}")
         return []
-    finally:
-        conn.close()
\ No newline at end of file
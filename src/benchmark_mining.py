@@ -0,0 +1,53 @@
+"""
+Micro-benchmark for the proof-of-work inner loop.
+
+Compares the original hex-digest loop against mining.search_range and prints
+hashes per second for each.
+
+Usage: python benchmark_mining.py [--proofs N]
+"""
+import argparse
+import hashlib
+import time
+
+import mining
+
+
+def legacy_valid_proof(last_proof, proof):
+    # The loop Blockchain.valid_proof used before the byte-level kernel
+    this_proof = f'{proof}{last_proof}'.encode()
+    this_proof_hash = hashlib.sha256(this_proof).hexdigest()
+    return this_proof_hash[:4] == '0000'
+
+
+def legacy_proof_of_work(last_proof):
+    proof = 0
+    while not legacy_valid_proof(last_proof, proof):
+        proof += 1
+    return proof
+
+
+def run(name, search, last_proofs):
+    hashes = 0
+    start = time.perf_counter()
+    for last_proof in last_proofs:
+        # proof + 1 hashes are computed to find the smallest valid proof
+        hashes += search(last_proof) + 1
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {hashes:>10} hashes  {elapsed:8.3f} s  {hashes / elapsed:>12,.0f} hashes/sec")
+    return hashes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proofs', type=int, default=20, help='Number of proofs to search for')
+    args = parser.parse_args()
+
+    last_proofs = range(1000, 1000 + args.proofs)
+    legacy = run('legacy', legacy_proof_of_work, last_proofs)
+    kernel = run('kernel', mining.proof_of_work, last_proofs)
+    print(f"speedup: {kernel / legacy:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
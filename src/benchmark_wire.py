@@ -0,0 +1,78 @@
+"""
+Size and speed of the binary wire format against JSON.
+
+Builds a synthetic chain of hash-linked blocks (no proof of work), then
+encodes and decodes it as a /chain body both ways and prints bytes and
+milliseconds per round.
+
+Usage: python benchmark_wire.py [--blocks N] [--transactions N] [--accounts N] [--rounds N]
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import chain_responses
+import hashing
+import wire
+
+
+def synthetic_chain(blocks, transactions, accounts):
+    names = [f'meter-{i:05d}' for i in range(accounts)]
+    start = datetime(2024, 1, 1)
+    chain = []
+    previous_hash = '1'
+    for index in range(1, blocks + 1):
+        txs = []
+        for i in range(transactions):
+            seller, buyer = random.sample(names, 2)
+            tx = {'Seller': seller, 'Buyer': buyer,
+                  'Power': round(random.uniform(0.1, 50.0), 3), 'Price': round(random.uniform(0.0005, 0.01), 6),
+                  'transaction_timestamp': str(start + timedelta(seconds=index * 60, microseconds=i * 7 + 1))}
+            tx['tx_hash'] = hashing.hash_transaction(tx)
+            txs.append(tx)
+        block = {'index': index, 'timestamp': str(start + timedelta(seconds=index * 60, microseconds=1)),
+                 'transactions': txs, 'proof': random.randrange(1 << 20), 'previous_hash': previous_hash,
+                 'difficulty': 16, 'merkle_root': hashing.merkle_root([tx['tx_hash'] for tx in txs])}
+        block['block_hash'] = previous_hash = hashing.hash_block(block)
+        chain.append(block)
+    return chain
+
+
+def measure(name, encode, decode, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        body = encode()
+    encoded = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(rounds):
+        decode(body)
+    decoded = time.perf_counter() - started
+    print(f"{name:<8} {len(body):>12,} bytes  encode {encoded * 1000 / rounds:8.2f} ms  "
+          f"decode {decoded * 1000 / rounds:8.2f} ms")
+    return len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=200, help='Blocks in the chain')
+    parser.add_argument('--transactions', type=int, default=50, help='Transactions per block')
+    parser.add_argument('--accounts', type=int, default=100, help='Distinct account names')
+    parser.add_argument('--rounds', type=int, default=5, help='Encode/decode rounds to average')
+    args = parser.parse_args()
+
+    chain = synthetic_chain(args.blocks, args.transactions, args.accounts)
+    length = len(chain)
+    assert wire.decode(wire.encode_chain(chain, length, 1, length))['chain'] == chain
+
+    json_size = measure('json', lambda: chain_responses.dumps({'chain': chain, 'length': length,
+                                                               'from': 1, 'to': length}),
+                        json.loads, args.rounds)
+    wire_size = measure('wire', lambda: wire.encode_chain(chain, length, 1, length),
+                        wire.decode, args.rounds)
+    print(f"size: {wire_size / json_size:.1%} of JSON")
+
+
+if __name__ == '__main__':
+    main()
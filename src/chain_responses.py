@@ -0,0 +1,155 @@
+"""
+Serialized /chain responses.
+
+Blocks never change once mined, so each block is serialized once and its
+bytes are kept, keyed by block hash. Whole responses are cached too, keyed by
+the chain tip they were built from. Responses for older tips are dropped as
+soon as one for a newer tip is stored, and the total size of the cached
+responses is bounded, so full-chain bodies do not pile up in memory while
+clients poll a growing chain. Concurrent requests for the same response share
+one build.
+"""
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import hashing
+
+DEFAULT_MAX_BLOCKS = 10000
+DEFAULT_MAX_RESPONSES = 32
+DEFAULT_MAX_RESPONSE_BYTES = 64 * 1024 * 1024
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = 64 * 1024
+GZIP_LEVEL = 6
+
+
+def header_view(block):
+    """Header fields, hash and transaction count, without the transactions"""
+    header = hashing.block_header(block)
+    header['block_hash'] = block['block_hash']
+    header['transaction_count'] = len(block['transactions'])
+    return header
+
+
+def dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+
+
+class ChainResponseCache:
+    def __init__(self, max_blocks=DEFAULT_MAX_BLOCKS, max_responses=DEFAULT_MAX_RESPONSES,
+                 max_response_bytes=DEFAULT_MAX_RESPONSE_BYTES):
+        self.max_blocks = max_blocks
+        self.max_responses = max_responses
+        self.max_response_bytes = max_response_bytes
+        self._blocks = OrderedDict()
+        self._responses = OrderedDict()
+        self._response_bytes = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.block_hits = 0
+        self.block_misses = 0
+        self.response_hits = 0
+        self.response_misses = 0
+        self.shared_builds = 0
+
+    def block_bytes(self, block, headers_only=False):
+        """The serialized block (or its header view)"""
+        key = (block['block_hash'], headers_only)
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self.block_hits += 1
+                self._blocks.move_to_end(key)
+                return data
+            self.block_misses += 1
+
+        data = dumps(header_view(block) if headers_only else block)
+        with self._lock:
+            self._blocks[key] = data
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return data
+
+    def chain_body(self, blocks, length, first, last, headers_only=False):
+        """A /chain JSON body: {"chain": [...], "from", "length", "to"}"""
+        parts = [self.block_bytes(block, headers_only) for block in blocks]
+        return b''.join((b'{"chain":[', b','.join(parts),
+                         b'],"from":%d,"length":%d,"to":%d}' % (first, length, last)))
+
+    def render(self, key, build):
+        """
+        The cached response for key, or build() it. Callers asking for the same
+        key while it is being built wait for that build instead of repeating it.
+        key is a tuple starting with the (tip_hash, length) it was built from.
+        """
+        with self._lock:
+            body = self._responses.get(key)
+            if body is not None:
+                self.response_hits += 1
+                self._responses.move_to_end(key)
+                return body
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                self.response_misses += 1
+                flight = self._in_flight[key] = Future()
+            else:
+                self.shared_builds += 1
+
+        if not leader:
+            return flight.result()
+
+        try:
+            body = build()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            self._store(key, body)
+        flight.set_result(body)
+        return body
+
+    def _store(self, key, body):
+        # Called with the lock held
+        if len(body) > self.max_response_bytes:
+            return
+        tip_hash, length = key[:2]
+        # A build that started before a block was appended must not evict
+        # responses for the newer tip, hence only tips at most this long go
+        for old_key in [old_key for old_key in self._responses
+                        if old_key[0] != tip_hash and old_key[1] <= length]:
+            self._response_bytes -= len(self._responses.pop(old_key))
+        self._responses[key] = body
+        self._response_bytes += len(body)
+        while (len(self._responses) > self.max_responses
+               or self._response_bytes > self.max_response_bytes):
+            self._response_bytes -= len(self._responses.popitem(last=False)[1])
+
+    def gzipped(self, key, body):
+        """gzip of body, cached under key alongside the plain response"""
+        return self.render(key + ('gzip',), lambda: gzip.compress(body, GZIP_LEVEL))
+
+    def stats(self):
+        with self._lock:
+            block_lookups = self.block_hits + self.block_misses
+            response_lookups = self.response_hits + self.response_misses
+            return {
+                'cached_blocks': len(self._blocks),
+                'max_blocks': self.max_blocks,
+                'block_hits': self.block_hits,
+                'block_misses': self.block_misses,
+                'block_hit_rate': self.block_hits / block_lookups if block_lookups else 0.0,
+                'cached_responses': len(self._responses),
+                'cached_response_bytes': self._response_bytes,
+                'max_response_bytes': self.max_response_bytes,
+                'response_hits': self.response_hits,
+                'response_misses': self.response_misses,
+                'response_hit_rate': self.response_hits / response_lookups if response_lookups else 0.0,
+                'shared_builds': self.shared_builds,
+            }
@@ -0,0 +1,119 @@
+"""
+Bounded in-memory view of the chain.
+
+ChainWindow behaves like the list Blockchain.chain normally is, but keeps only
+the most recent blocks resident. Older blocks are read from SQLite on demand
+and kept in an LRU cache.
+"""
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+
+DEFAULT_BLOCK_CACHE_SIZE = 1024
+
+# Blocks fetched per query when iterating over the non-resident part
+ITER_BATCH_SIZE = 1000
+
+
+class ChainWindow(Sequence):
+    def __init__(self, fetch_range, length, resident_blocks, max_resident,
+                 cache_size=DEFAULT_BLOCK_CACHE_SIZE):
+        """
+        fetch_range(start, stop) returns the stored blocks at chain positions
+        [start, stop) (0-based). length is the full chain length and
+        resident_blocks the last blocks of the chain, already loaded.
+        """
+        self._fetch_range = fetch_range
+        self._length = length
+        self.max_resident = max(1, max_resident)
+        self._resident = deque(resident_blocks, maxlen=self.max_resident)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def _first_resident(self):
+        return self._length - len(self._resident)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self._get_slice(position)
+        with self._lock:
+            if position < 0:
+                position += self._length
+            if not 0 <= position < self._length:
+                raise IndexError('chain index out of range')
+            if position >= self._first_resident:
+                return self._resident[position - self._first_resident]
+            return self._get_cached(position)
+
+    def _get_cached(self, position):
+        with self._lock:
+            block = self._cache.get(position)
+            if block is not None:
+                self.hits += 1
+                self._cache.move_to_end(position)
+                return block
+
+            self.misses += 1
+            block = self._fetch_range(position, position + 1)[0]
+            if self.cache_size > 0:
+                self._cache[position] = block
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+            return block
+
+    def _get_slice(self, index):
+        start, stop, step = index.indices(self._length)
+        if step != 1:
+            return [self[position] for position in range(start, stop, step)]
+        if start >= stop:
+            return []
+
+        with self._lock:
+            first_resident = self._first_resident
+            resident = list(self._resident)
+            blocks = []
+            if start < first_resident:
+                # Ranges go straight to the database and do not churn the cache
+                blocks = list(self._fetch_range(start, min(stop, first_resident)))
+        if stop > first_resident:
+            blocks.extend(resident[max(start, first_resident) - first_resident:stop - first_resident])
+        return blocks
+
+    def __iter__(self):
+        with self._lock:
+            first_resident = self._first_resident
+            resident = list(self._resident)
+        for start in range(0, first_resident, ITER_BATCH_SIZE):
+            with self._lock:
+                batch = self._fetch_range(start, min(start + ITER_BATCH_SIZE, first_resident))
+            yield from batch
+        yield from resident
+
+    def append(self, block):
+        """Append a block that has already been stored"""
+        with self._lock:
+            self._resident.append(block)
+            self._length += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'length': self._length,
+            'resident_blocks': len(self._resident),
+            'max_resident_blocks': self.max_resident,
+            'cached_blocks': len(self._cache),
+            'cache_size': self.cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
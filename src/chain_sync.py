@@ -0,0 +1,76 @@
+"""
+Fork-point chain sync with a peer.
+
+Rather than downloading a peer's whole chain, compare block hashes from the
+tip downwards to find the last block both chains share (the fork point), then
+fetch only the peer's blocks after it. Since blocks are hash-linked, the first
+matching hash from the top means everything below it matches too.
+"""
+
+# Headers compared in the first round of the fork-point search; doubles each round
+HEADER_WINDOW = 64
+
+# Blocks fetched per request after the fork point
+BLOCK_BATCH = 500
+
+
+class PeerChain:
+    def __init__(self, get):
+        """get(params) returns the JSON body of the peer's GET /chain with params"""
+        self._get = get
+        self.requests = 0
+        self.blocks_received = 0
+
+    def _range(self, first, last, headers_only):
+        params = {'from': first, 'to': last}
+        if headers_only:
+            params['headers'] = 1
+        self.requests += 1
+        data = self._get(params)
+        blocks = data['chain']
+        if 'from' not in data:
+            # Older peers ignore the range and send their whole chain
+            blocks = blocks[first - 1:last]
+        self.blocks_received += len(blocks)
+        return data['length'], blocks
+
+    def height(self):
+        """The peer's chain height"""
+        length, _ = self._range(1, 1, headers_only=True)
+        return length
+
+    def headers(self, first, last):
+        """Headers (with block_hash) at heights first..last, 1-based and inclusive"""
+        return self._range(first, last, headers_only=True)[1]
+
+    def blocks(self, first, last):
+        """Full blocks at heights first..last, fetched BLOCK_BATCH at a time"""
+        blocks = []
+        for start in range(first, last + 1, BLOCK_BATCH):
+            batch = self._range(start, min(start + BLOCK_BATCH - 1, last), headers_only=False)[1]
+            if not batch:
+                break
+            blocks.extend(batch)
+        return blocks
+
+
+def find_fork_point(local_hash_at, local_height, peer, peer_height):
+    """
+    Height of the last block our chain shares with the peer, 0 if none.
+
+    local_hash_at(height) is our block hash at a 1-based height. Headers are
+    compared from the lower of the two tips downwards, in windows that double
+    each round, so the cost grows with the depth of the fork.
+    """
+    top = min(local_height, peer_height)
+    window = HEADER_WINDOW
+    while top > 0:
+        first = max(1, top - window + 1)
+        headers = peer.headers(first, top)
+        for offset in range(len(headers) - 1, -1, -1):
+            height = first + offset
+            if headers[offset].get('block_hash') == local_hash_at(height):
+                return height
+        top = first - 1
+        window *= 2
+    return 0
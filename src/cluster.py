@@ -0,0 +1,365 @@
+"""
+Local multi-node cluster for consensus and propagation benchmarks.
+
+Starts N nodes (main.py) as subprocesses on localhost ports, each with its own
+database file, registers every node with every other, creates the same funded
+accounts on all of them, then runs rounds of synthetic trades and mining. In
+each round, --miners-per-round random nodes mine at once (more than one makes
+competing blocks). It reports:
+
+- block propagation: seconds from a block being mined until each other node
+  has it in its chain (gossip, or /nodes/resolve once a round times out), one
+  sample per block and node, so blocks that only some nodes adopt still count;
+  full propagation is the time until the last node had it
+- fork rate: share of rounds in which competing blocks were mined
+- resolve latency: seconds per /nodes/resolve call
+- convergence: seconds from the end of mining until all nodes share a tip;
+  when competing blocks leave equally long branches that gossip and resolve
+  cannot choose between, one node mines the next block to break the tie
+
+Everything runs on 127.0.0.1, with no outside network access.
+
+    python cluster.py --nodes 4 --rounds 10 --miners-per-round 2
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+# Seconds to wait for a node to start answering
+STARTUP_TIMEOUT = 60
+
+# Seconds between tip polls while waiting for propagation
+POLL_INTERVAL = 0.02
+
+
+class Node:
+    def __init__(self, index, port, workdir, fanout, extra_args=()):
+        self.index = index
+        self.address = f'127.0.0.1:{port}'
+        self.url = f'http://{self.address}'
+        self.db = os.path.join(workdir, f'node{index}.db')
+        self.log_path = os.path.join(workdir, f'node{index}.log')
+        self.command = [sys.executable, MAIN, '--host', '127.0.0.1', '--port', str(port),
+                        '--db', self.db, '--advertise-address', self.address,
+                        '--gossip-fanout', str(fanout), '--key-pool-size', '0',
+                        '--mining-workers', '1', *extra_args]
+        self.workdir = workdir
+        self.process = None
+        self._log = None
+
+    def start(self):
+        self._log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(self.command, cwd=self.workdir, stdout=self._log,
+                                        stderr=subprocess.STDOUT)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log is not None:
+            self._log.close()
+
+
+class Cluster:
+    def __init__(self, nodes, base_port, workdir, fanout, extra_args=()):
+        self.workdir = workdir
+        self.nodes = [Node(i, base_port + i, workdir, fanout, extra_args) for i in range(nodes)]
+        self.http = requests.Session()
+
+    def __enter__(self):
+        for node in self.nodes:
+            node.start()
+        return self
+
+    def __exit__(self, *exc):
+        for node in self.nodes:
+            node.stop()
+        self.http.close()
+
+    def get(self, node, path, **params):
+        response = self.http.get(node.url + path, params=params, timeout=60)
+        response.raise_for_status()
+        return response
+
+    def post(self, node, path, payload):
+        response = self.http.post(node.url + path, json=payload, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def wait_ready(self, timeout=STARTUP_TIMEOUT):
+        deadline = time.time() + timeout
+        for node in self.nodes:
+            while True:
+                if node.process.poll() is not None:
+                    raise RuntimeError(f"Node {node.address} exited, see {node.log_path}")
+                try:
+                    self.get(node, '/metrics')
+                    break
+                except requests.exceptions.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError(f"Node {node.address} did not start, see {node.log_path}")
+                    time.sleep(0.2)
+
+    def connect(self):
+        for node in self.nodes:
+            peers = [f'http://{other.address}' for other in self.nodes if other is not node]
+            self.post(node, '/nodes/register', {'nodes': peers})
+
+    def create_accounts(self, names, funds):
+        # Same accounts and balances everywhere, so every node's ledger agrees
+        for node in self.nodes:
+            self.post(node, '/accounts/bulk', {'names': names})
+            for name in names:
+                self.post(node, '/add_balance', {'account_name': name, 'amount': funds})
+                self.post(node, '/add_power', {'account_name': name, 'amount': funds})
+
+    def tip(self, node):
+        """(length, tip block hash) of a node's chain"""
+        length = int(self.get(node, '/chain', headers=1, limit=1).headers['X-Chain-Length'])
+        header = self.get(node, '/chain', headers=1, **{'from': length, 'to': length}).json()['chain'][0]
+        return length, header['block_hash']
+
+    def tips(self):
+        return [self.tip(node) for node in self.nodes]
+
+    def chain_since(self, node, first):
+        """(length, tip block hash, hashes of the blocks from height `first` on) of a node's chain"""
+        response = self.get(node, '/chain', headers=1, **{'from': first})
+        headers = response.json()['chain']
+        if not headers:
+            # Shorter than `first`: the tip is below the range asked for
+            length, tip_hash = self.tip(node)
+            return length, tip_hash, set()
+        return (int(response.headers['X-Chain-Length']), headers[-1]['block_hash'],
+                {header['block_hash'] for header in headers})
+
+    def trade(self, names, count, power=1.0, price=0.01):
+        """Submit `count` random trades, spread over random nodes"""
+        batches = {}
+        for _ in range(count):
+            seller, buyer = random.sample(names, 2)
+            batches.setdefault(random.choice(self.nodes), []).append(
+                {'sender': seller, 'receiver': buyer, 'power': power, 'price': price, 'role': 'seller'})
+        for node, trades in batches.items():
+            self.post(node, '/add_transactions', {'transactions': trades})
+
+    def mine(self, miners):
+        """Mine on each of `miners` at once; returns [(node, block, finished_at)] for the blocks mined"""
+        results = []
+        lock = threading.Lock()
+
+        def run(node):
+            try:
+                response = self.http.get(node.url + '/mine', timeout=600)
+                block = response.json() if response.status_code == 200 else None
+            except requests.exceptions.RequestException:
+                block = None
+            if block is not None:
+                with lock:
+                    results.append((node, block, time.time()))
+
+        threads = [threading.Thread(target=run, args=(node,)) for node in miners]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def resolve_all(self):
+        """Latency of /nodes/resolve on every node"""
+        latencies = []
+        for node in self.nodes:
+            started = time.time()
+            self.get(node, '/nodes/resolve')
+            latencies.append(time.time() - started)
+        return latencies
+
+    def wait_converged(self, mined, timeout, arrivals=None):
+        """
+        Poll chains until all nodes share a tip or timeout, recording when each
+        node first has each mined block in its chain. Returns (time they agreed
+        or None, {block_hash: {node address: seconds after mining}}); pass the
+        arrivals back in to keep polling the same blocks.
+        """
+        deadline = time.time() + timeout
+        arrivals = {} if arrivals is None else arrivals
+        for miner, block, _ in mined:
+            arrivals.setdefault(block['block_hash'], {})[miner.address] = 0.0
+        first = min((block['index'] for _, block, _ in mined), default=None)
+        while True:
+            tip_hashes = set()
+            for node in self.nodes:
+                if first is None:
+                    tip_hashes.add(self.tip(node)[1])
+                    continue
+                _, tip_hash, hashes = self.chain_since(node, first)
+                now = time.time()
+                tip_hashes.add(tip_hash)
+                for _, block, finished_at in mined:
+                    arrived = arrivals[block['block_hash']]
+                    if node.address not in arrived and block['block_hash'] in hashes:
+                        arrived[node.address] = now - finished_at
+            now = time.time()
+            if len(tip_hashes) == 1:
+                return now, arrivals
+            if now > deadline:
+                return None, arrivals
+            time.sleep(POLL_INTERVAL)
+
+    def propagation(self, mined, arrivals):
+        """
+        ([seconds until each other node had a block], [seconds until the last
+        node had it, for blocks every node got])
+        """
+        per_node, full = [], []
+        for miner, block, _ in mined:
+            arrived = arrivals.get(block['block_hash'], {})
+            per_node.extend(seconds for address, seconds in arrived.items() if address != miner.address)
+            if len(arrived) == len(self.nodes):
+                full.append(max(arrived.values()))
+        return per_node, full
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'samples': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='p2p-cluster-')
+    os.makedirs(workdir, exist_ok=True)
+    random.seed(args.seed)
+    names = [f'trader-{i}' for i in range(args.accounts)]
+
+    rounds = []
+    propagation = []
+    full_propagation = []
+    convergence = []
+    resolve_latency = []
+    try:
+        with Cluster(args.nodes, args.base_port, workdir, args.gossip_fanout, args.node_args) as cluster:
+            cluster.wait_ready()
+            cluster.connect()
+            cluster.create_accounts(names, args.funds)
+
+            for number in range(args.rounds):
+                cluster.trade(names, args.trades_per_round)
+                miners = random.sample(cluster.nodes, min(args.miners_per_round, len(cluster.nodes)))
+                mined = cluster.mine(miners)
+                heights = {}
+                for _, block, _ in mined:
+                    heights.setdefault(block['index'], set()).add(block['block_hash'])
+                forked = any(len(hashes) > 1 for hashes in heights.values())
+
+                mining_done = time.time()
+                converged_at, arrivals = cluster.wait_converged(mined, args.round_timeout)
+                resolved = tie_broken = False
+                if converged_at is None:
+                    # Gossip did not settle it: fall back to pulling from peers
+                    resolve_latency.extend(cluster.resolve_all())
+                    converged_at, arrivals = cluster.wait_converged(mined, args.round_timeout, arrivals)
+                    resolved = True
+                if converged_at is None:
+                    # Equally long branches are both valid; as on a real network the
+                    # next block decides, so one node mines it
+                    mined += cluster.mine([random.choice(cluster.nodes)])
+                    converged_at, arrivals = cluster.wait_converged(mined, args.round_timeout, arrivals)
+                    tie_broken = True
+                seconds = converged_at - mining_done if converged_at is not None else None
+                if seconds is not None:
+                    convergence.append(seconds)
+                per_node, full = cluster.propagation(mined, arrivals)
+                propagation.extend(per_node)
+                full_propagation.extend(full)
+                rounds.append({'round': number + 1, 'mined': len(mined), 'forked': forked,
+                               'converged': seconds is not None, 'resolved': resolved,
+                               'tie_broken': tie_broken,
+                               'convergence_seconds': seconds,
+                               'propagation_seconds': sorted(per_node)})
+                print(f"round {number + 1}: mined {len(mined)}, forked {forked}, "
+                      f"converged {'%.3fs' % seconds if seconds is not None else 'no'}"
+                      f"{' after resolve' if resolved else ''}"
+                      f"{' and a tie-breaking block' if tie_broken else ''}", file=sys.stderr)
+
+            resolve_latency.extend(cluster.resolve_all())
+            tips = cluster.tips()
+            node_metrics = [cluster.get(node, '/metrics').json().get('gossip') for node in cluster.nodes]
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    forks = sum(1 for result in rounds if result['forked'])
+    return {
+        'nodes': args.nodes,
+        'rounds': len(rounds),
+        'miners_per_round': args.miners_per_round,
+        'fork_rate': forks / len(rounds) if rounds else 0.0,
+        'converged_rounds': sum(1 for result in rounds if result['converged']),
+        'block_propagation_seconds': summarize(propagation),
+        'full_propagation_seconds': summarize(full_propagation),
+        'convergence_seconds': summarize(convergence),
+        'resolve_latency_seconds': summarize(resolve_latency),
+        'final_tips': [{'length': length, 'block_hash': block_hash} for length, block_hash in tips],
+        'gossip': node_metrics,
+        'round_details': rounds,
+        'workdir': workdir if args.workdir or args.keep else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local multi-node cluster benchmark')
+    parser.add_argument('--nodes', type=int, default=3, help='Nodes to start')
+    parser.add_argument('--base-port', type=int, default=5100, help='Port of the first node; the rest follow')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds of trading and mining')
+    parser.add_argument('--miners-per-round', type=int, default=1,
+                        help='Nodes mining at once each round (2 or more makes forks likely)')
+    parser.add_argument('--trades-per-round', type=int, default=10, help='Trades submitted before each round')
+    parser.add_argument('--accounts', type=int, default=5, help='Accounts created on every node')
+    parser.add_argument('--funds', type=float, default=1000.0, help='ETH and kWh given to each account')
+    parser.add_argument('--gossip-fanout', type=int, default=8, help='Gossip fanout of each node (0 disables)')
+    parser.add_argument('--round-timeout', type=float, default=10.0,
+                        help='Seconds to wait for gossip to converge before resolving')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for the workload')
+    parser.add_argument('--workdir', default=None, help='Directory for node databases and logs (kept)')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    parser.add_argument('--output', default=None, help='Also write the JSON report to this file')
+    parser.add_argument('node_args', nargs=argparse.REMAINDER,
+                        help='Extra main.py options for every node, after --')
+    args = parser.parse_args(argv)
+    if args.node_args and args.node_args[0] == '--':
+        args.node_args = args.node_args[1:]
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    return 0 if report['converged_rounds'] == report['rounds'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
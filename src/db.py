@@ -0,0 +1,250 @@
+"""
+SQLite connection management shared by every module.
+
+Each thread gets one pooled connection per database file, opened in WAL mode
+with tuned pragmas and a prepared-statement cache. The schema (tables,
+migrations, indexes) is checked once per database file per process, when the
+first connection to it is opened, instead of on every call.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+
+# Database file, relative to the working directory like before
+DB_PATH = 'p2p_energy_trading.db'
+
+# Seconds a connection waits for a lock held by another writer
+BUSY_TIMEOUT = 10
+
+# Prepared statements cached per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Page cache per connection, in KiB
+PAGE_CACHE_KIB = 8192
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # Safe with WAL: a crash can lose the last commits, never corrupt the file
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA cache_size=-{PAGE_CACHE_KIB}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+# Re-entrant: a thread pool finalizer may run while this thread holds it
+_lock = threading.RLock()
+# Database paths whose schema has been checked in this process
+_schema_ready = set()
+# Bumped per path by close_all so threads drop their pooled connections
+_generations = {}
+# Pooled connections of live threads, as {id(conn): (path, conn)}
+_open_connections = {}
+
+
+class _ThreadPool:
+    """One thread's connections; closed when the thread ends and drops its locals"""
+    def __init__(self):
+        self.connections = {}
+        weakref.finalize(self, _close_pool, self.connections)
+
+
+def _close_pool(connections):
+    with _lock:
+        for _, conn in connections.values():
+            _open_connections.pop(id(conn), None)
+    for _, conn in connections.values():
+        conn.close()
+
+
+def db_path(path=None):
+    return os.path.abspath(path or DB_PATH)
+
+
+def connect(path=None):
+    """
+    Open a new configured connection.
+
+    Use this for connections with their own lifetime (Blockchain keeps one);
+    short-lived work should use get_connection().
+    """
+    path = db_path(path)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    ensure_schema(conn, path)
+    return conn
+
+
+def get_connection(path=None):
+    """This thread's pooled connection to the database"""
+    path = db_path(path)
+    thread_pool = getattr(_local, 'pool', None)
+    if thread_pool is None:
+        thread_pool = _local.pool = _ThreadPool()
+    pool = thread_pool.connections
+
+    generation = _generations.get(path, 0)
+    entry = pool.get(path)
+    if entry is None or entry[0] != generation:
+        conn = connect(path)
+        pool[path] = (generation, conn)
+        with _lock:
+            _open_connections[id(conn)] = (path, conn)
+        return conn
+    return entry[1]
+
+
+@contextmanager
+def transaction(path=None, immediate=False):
+    """
+    Cursor on the pooled connection inside one transaction: committed on
+    success, rolled back on any exception. immediate=True takes the write
+    lock up front, for read-modify-write sequences.
+    """
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    if immediate:
+        cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def close_all(path=None):
+    """
+    Close every pooled connection to a database and forget its schema check,
+    e.g. before the file is deleted. Threads reconnect on their next use.
+    """
+    path = db_path(path)
+    with _lock:
+        _generations[path] = _generations.get(path, 0) + 1
+        _schema_ready.discard(path)
+        for key, (conn_path, conn) in list(_open_connections.items()):
+            if conn_path == path:
+                conn.close()
+                del _open_connections[key]
+
+
+def ensure_schema(conn, path=None, force=False):
+    """Create missing tables, columns and indexes, once per database file"""
+    path = db_path(path)
+    if path in _schema_ready and not force:
+        return
+    with _lock:
+        if path in _schema_ready and not force:
+            return
+        _apply_schema(conn)
+        _schema_ready.add(path)
+
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def _apply_schema(conn):
+    cursor = conn.cursor()
+
+    # Create tables for blocks, transactions, blockchain logs and accounts
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Blockchain (
+                        block_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        block_index INTEGER,
+                        timestamp TEXT,
+                        proof INTEGER,
+                        previous_hash TEXT,
+                        block_hash TEXT,
+                        difficulty INTEGER,
+                        merkle_root TEXT
+                    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Transactions (
+                        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        block_id INTEGER,
+                        Seller TEXT,
+                        Buyer TEXT,
+                        Power REAL,
+                        Price REAL,
+                        transaction_timestamp TEXT,
+                        tx_hash TEXT
+                    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS BlockchainLogs (
+                        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        timestamp TEXT,
+                        operation_type TEXT,
+                        details TEXT
+                    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS accounts (
+                        id TEXT PRIMARY KEY,
+                        name TEXT UNIQUE,
+                        public_key TEXT,
+                        private_key TEXT,
+                        balance REAL DEFAULT 0.0,
+                        power_balance REAL DEFAULT 0.0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )''')
+    # Height and hash of the last block validate_chain fully verified
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ValidationCheckpoint (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        height INTEGER,
+                        block_hash TEXT,
+                        verified_at TEXT
+                    )''')
+    # Known peers and their health, see peers.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Peers (
+                        address TEXT PRIMARY KEY,
+                        latency REAL,
+                        successes INTEGER DEFAULT 0,
+                        failures INTEGER DEFAULT 0,
+                        consecutive_failures INTEGER DEFAULT 0,
+                        height INTEGER,
+                        last_seen REAL,
+                        last_failure REAL,
+                        backoff_until REAL DEFAULT 0,
+                        added_at REAL
+                    )''')
+
+    # Columns added after the tables were first created
+    columns = _columns(cursor, 'Transactions')
+    if 'transaction_timestamp' not in columns:
+        cursor.execute("ALTER TABLE Transactions ADD COLUMN transaction_timestamp TEXT")
+        # Update existing records with current timestamp
+        cursor.execute("UPDATE Transactions SET transaction_timestamp = ? WHERE transaction_timestamp IS NULL",
+                       (str(datetime.now()),))
+        print("Added transaction_timestamp column to Transactions table")
+    if 'tx_hash' not in columns:
+        # Cached hash per transaction; NULL for older rows
+        cursor.execute("ALTER TABLE Transactions ADD COLUMN tx_hash TEXT")
+        print("Added 'tx_hash' column to the Transactions table.")
+
+    columns = _columns(cursor, 'Blockchain')
+    if 'block_hash' not in columns:
+        cursor.execute("ALTER TABLE Blockchain ADD COLUMN block_hash TEXT")
+        print("Added 'block_hash' column to the Blockchain table.")
+    if 'difficulty' not in columns:
+        # Difficulty (leading zero bits) each block was mined at; NULL for older blocks
+        cursor.execute("ALTER TABLE Blockchain ADD COLUMN difficulty INTEGER")
+        print("Added 'difficulty' column to the Blockchain table.")
+    if 'merkle_root' not in columns:
+        # Merkle root per block; NULL for older blocks
+        cursor.execute("ALTER TABLE Blockchain ADD COLUMN merkle_root TEXT")
+        print("Added 'merkle_root' column to the Blockchain table.")
+
+    if 'power_balance' not in _columns(cursor, 'accounts'):
+        cursor.execute("ALTER TABLE accounts ADD COLUMN power_balance REAL DEFAULT 0.0")
+        print("Added power_balance column to accounts table")
+
+    # Indexes for transaction lookups and the chain loader's ordered join
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_tx_hash ON Transactions (tx_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_blockchain_block_index ON Blockchain (block_index)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_block_id ON Transactions (block_id)")
+
+    conn.commit()
+    cursor.close()
@@ -0,0 +1,324 @@
+"""
+Push gossip of new blocks and transactions between nodes.
+
+New block headers and transaction hashes are queued and sent in batches to a
+random subset of peers (POST /gossip). A receiver ignores hashes it has seen
+before, fetches only what it is missing (blocks after the fork point via
+Blockchain.sync_from, transactions via GET /transactions/pending) and relays
+what it accepted, so an announcement floods the network once.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import peers
+
+# Peers each batch is sent to
+DEFAULT_FANOUT = 8
+
+# Seconds announcements are held to be batched together
+FLUSH_INTERVAL = 0.05
+
+# Hashes per announcement message
+MAX_BATCH = 500
+
+# Block and transaction hashes remembered to drop repeated announcements
+SEEN_CACHE_SIZE = 100000
+
+# Propagation latencies kept for the percentiles in stats()
+LATENCY_SAMPLES = 1000
+
+GOSSIP_ERRORS = (requests.exceptions.RequestException, ValueError, KeyError, TypeError)
+
+
+class UnknownSender(ValueError):
+    """Raised for announcements from a node that is not a registered peer"""
+
+
+class SeenCache:
+    """Bounded set of recently seen hashes"""
+    def __init__(self, max_size=SEEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        """Remember value; returns False if it was already there"""
+        with self._lock:
+            if value in self._hashes:
+                self._hashes.move_to_end(value)
+                return False
+            self._hashes[value] = None
+            if len(self._hashes) > self.max_size:
+                self._hashes.popitem(last=False)
+            return True
+
+    def discard(self, values):
+        """Forget values, so their next announcement counts as new"""
+        with self._lock:
+            for value in values:
+                self._hashes.pop(value, None)
+
+    def __contains__(self, value):
+        with self._lock:
+            return value in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class Gossip:
+    def __init__(self, blockchain, address, fanout=DEFAULT_FANOUT, flush_interval=FLUSH_INTERVAL):
+        """
+        address is how peers reach this node (host:port); announcements carry
+        it so receivers know where to fetch from.
+        """
+        self.blockchain = blockchain
+        self.address = address
+        self.fanout = fanout
+        self.flush_interval = flush_interval
+        self.seen = SeenCache()
+        self._blocks = []
+        self._transactions = []
+        self._incoming = deque()
+        self._changed = threading.Condition()
+        self._closed = False
+        self._threads = []
+        self._senders = None
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.messages_sent = 0
+        self.send_failures = 0
+        self.messages_received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.blocks_adopted = 0
+        self.transactions_added = 0
+
+    def start(self):
+        with self._changed:
+            if self._threads or self._closed:
+                return self
+            self._senders = ThreadPoolExecutor(max_workers=max(1, self.fanout))
+            for target in (self._flush_loop, self._receive_loop):
+                thread = threading.Thread(target=target, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        if self._senders is not None:
+            self._senders.shutdown(wait=False)
+
+    # Outgoing
+
+    def announce_block(self, block, announced_at=None):
+        """Queue a block header; called by Blockchain.new_block"""
+        self.seen.add(block['block_hash'])
+        header = {'index': block['index'], 'block_hash': block['block_hash'],
+                  'announced_at': announced_at or time.time()}
+        with self._changed:
+            self._blocks.append(header)
+            self._changed.notify_all()
+
+    def announce_transactions(self, transactions, announced_at=None):
+        """Queue transaction hashes; called when transactions join the mempool"""
+        announced_at = announced_at or time.time()
+        hashes = []
+        for tx in transactions:
+            self.seen.add(tx['tx_hash'])
+            hashes.append({'tx_hash': tx['tx_hash'], 'announced_at': announced_at})
+        with self._changed:
+            self._transactions.extend(hashes)
+            self._changed.notify_all()
+
+    def _take_batch(self):
+        # Called with the lock held
+        blocks, self._blocks = self._blocks, []
+        transactions = self._transactions[:MAX_BATCH]
+        del self._transactions[:MAX_BATCH]
+        # Only the highest header matters: receivers sync everything up to it
+        if blocks:
+            blocks = [max(blocks, key=lambda header: header['index'])]
+        return blocks, transactions
+
+    def _flush_loop(self):
+        while True:
+            with self._changed:
+                while not (self._blocks or self._transactions or self._closed):
+                    self._changed.wait()
+                if self._closed:
+                    return
+            # Let announcements made meanwhile join this batch
+            time.sleep(self.flush_interval)
+            with self._changed:
+                blocks, transactions = self._take_batch()
+            if blocks or transactions:
+                try:
+                    self.flush(blocks, transactions)
+                except Exception:
+                    logging.exception("Sending gossip failed")
+
+    def flush(self, blocks, transactions, exclude=()):
+        """Send one announcement to at most `fanout` random peers"""
+        if self._closed:
+            return []
+        message = {'sender': self.address, 'blocks': blocks, 'transactions': transactions}
+        # Peers backed off after failures are left out until their backoff passes
+        peers = [node for node in self.blockchain.nodes.available()
+                 if node not in exclude and node != self.address]
+        peers = random.sample(peers, min(self.fanout, len(peers)))
+        for node in peers:
+            if self._senders is None:
+                self._send(node, message)
+            else:
+                self._senders.submit(self._send, node, message)
+        return peers
+
+    def _send(self, node, message):
+        started = time.perf_counter()
+        try:
+            response = self.blockchain._session().post(f'http://{node}/gossip', json=message,
+                                                       timeout=self.blockchain.peer_timeout)
+            response.raise_for_status()
+            self.blockchain.nodes.record_success(node, time.perf_counter() - started)
+            with self._changed:
+                self.messages_sent += 1
+        except GOSSIP_ERRORS as e:
+            self.blockchain.nodes.record_failure(node)
+            with self._changed:
+                self.send_failures += 1
+            logging.debug(f"Gossip to {node} failed: {e}")
+
+    # Incoming
+
+    def receive(self, message):
+        """
+        Accept an announcement from POST /gossip. Unseen hashes are handled on
+        a background thread so the sender is not kept waiting. Returns how
+        many were new. Raises UnknownSender unless the sender is a registered
+        peer, since its data would be fetched from the address it gives.
+        """
+        sender = message['sender']
+        if sender not in self.blockchain.nodes:
+            with self._changed:
+                self.rejected += 1
+            raise UnknownSender(f"{sender!r} is not a registered peer")
+        sender = peers.normalize_address(sender)
+        if message.get('blocks'):
+            self.blockchain.nodes.record_height(sender, max(header['index'] for header in message['blocks']))
+        blocks = [header for header in message.get('blocks', []) if self.seen.add(header['block_hash'])]
+        transactions = [item for item in message.get('transactions', []) if self.seen.add(item['tx_hash'])]
+        with self._changed:
+            self.messages_received += 1
+            self.duplicates += len(message.get('blocks', [])) + len(message.get('transactions', [])) \
+                - len(blocks) - len(transactions)
+            if blocks or transactions:
+                self._incoming.append((sender, blocks, transactions))
+                self._changed.notify_all()
+        if not self._threads:
+            self.process_incoming()
+        return len(blocks) + len(transactions)
+
+    def _receive_loop(self):
+        while True:
+            with self._changed:
+                while not (self._incoming or self._closed):
+                    self._changed.wait()
+                if self._closed:
+                    return
+            self.process_incoming()
+
+    def process_incoming(self):
+        while True:
+            with self._changed:
+                if not self._incoming:
+                    return
+                sender, blocks, transactions = self._incoming.popleft()
+            if transactions:
+                self._fetch(sender, self._fetch_transactions, transactions,
+                            [item['tx_hash'] for item in transactions])
+            if blocks:
+                self._fetch(sender, self._fetch_blocks, max(blocks, key=lambda header: header['index']),
+                            [header['block_hash'] for header in blocks])
+
+    def _fetch(self, sender, fetch, announced, hashes):
+        # Hashes are marked seen on arrival so concurrent announcements are not
+        # fetched twice; a failed fetch unmarks them so the next announcement,
+        # from this peer or any other, is fetched again
+        try:
+            fetch(sender, announced)
+        except GOSSIP_ERRORS as e:
+            logging.error(f"Fetching gossiped data from {sender} failed: {e}")
+            self.seen.discard(hashes)
+        except Exception:
+            # Anything else is a bug, but must not stop the receiver thread
+            logging.exception(f"Handling gossip from {sender} failed")
+            self.seen.discard(hashes)
+
+    def _fetch_transactions(self, sender, items):
+        announced = {item['tx_hash']: item.get('announced_at') for item in items}
+        pending = self.blockchain._peer_get(sender, {'hash': list(announced)}, '/transactions/pending')
+        # Ones the sender no longer has may still come from another peer
+        returned = {tx.get('tx_hash') for tx in pending['transactions']}
+        self.seen.discard([tx_hash for tx_hash in announced if tx_hash not in returned])
+        added = self.blockchain.receive_transactions(pending['transactions'])
+        if added:
+            now = time.time()
+            with self._changed:
+                self.transactions_added += len(added)
+                for tx in added:
+                    if announced.get(tx['tx_hash']):
+                        self._latencies.append(('transaction', now - announced[tx['tx_hash']]))
+            items = [{'tx_hash': tx['tx_hash'], 'announced_at': announced[tx['tx_hash']]} for tx in added]
+            self.flush([], items, exclude=(sender,))
+
+    def _fetch_blocks(self, sender, header):
+        if header['index'] <= len(self.blockchain.chain):
+            return
+        if self.blockchain.sync_from(sender, header['index']) is None:
+            return
+        with self._changed:
+            self.blocks_adopted += 1
+            if header.get('announced_at'):
+                self._latencies.append(('block', time.time() - header['announced_at']))
+        self.flush([header], [], exclude=(sender,))
+
+    def stats(self):
+        with self._changed:
+            pending = len(self._blocks) + len(self._transactions)
+            latencies = list(self._latencies)
+        
+        def summary(kind):
+            values = sorted(latency for latency_kind, latency in latencies if latency_kind == kind)
+            if not values:
+                return None
+            return {
+                'samples': len(values),
+                'mean': sum(values) / len(values),
+                'p50': values[len(values) // 2],
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'max': values[-1],
+            }
+        return {
+            'address': self.address,
+            'fanout': self.fanout,
+            'pending_announcements': pending,
+            'seen_hashes': len(self.seen),
+            'messages_sent': self.messages_sent,
+            'send_failures': self.send_failures,
+            'messages_received': self.messages_received,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'blocks_adopted': self.blocks_adopted,
+            'transactions_added': self.transactions_added,
+            'block_latency': summary('block'),
+            'transaction_latency': summary('transaction'),
+        }
@@ -0,0 +1,111 @@
+"""
+Transaction, Merkle tree and block header hashing.
+
+Blocks carry the Merkle root of their transaction hashes, and the block hash
+covers a fixed set of header fields only, so hashing a block does not depend
+on how many transactions it holds. Blocks mined before Merkle roots existed
+keep their original full-body hash.
+"""
+import hashlib
+import json
+
+# Fields of a transaction covered by its hash
+TRANSACTION_FIELDS = ('Seller', 'Buyer', 'Power', 'Price', 'transaction_timestamp')
+
+# Fields of a block covered by its hash
+HEADER_FIELDS = ('index', 'timestamp', 'proof', 'previous_hash', 'merkle_root', 'difficulty')
+
+# Domain-separation prefixes so a leaf can never be mistaken for an inner node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_transaction(transaction):
+    """Hex SHA-256 of a transaction's canonical fields"""
+    fields = {key: transaction[key] for key in TRANSACTION_FIELDS if key in transaction}
+    return hashlib.sha256(LEAF_PREFIX + json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def transaction_hashes(transactions):
+    """Cached transaction hashes, computing any that are missing"""
+    return [tx.get('tx_hash') or hash_transaction(tx) for tx in transactions]
+
+
+def _hash_pair(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _next_level(level):
+    # An odd node at the end of a level is promoted unchanged
+    return [_hash_pair(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)]
+
+
+def merkle_root(tx_hashes):
+    """Merkle root (hex) of a list of hex transaction hashes"""
+    if not tx_hashes:
+        return hashlib.sha256(b'').hexdigest()
+    level = [bytes.fromhex(tx_hash) for tx_hash in tx_hashes]
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(tx_hashes, position):
+    """
+    Sibling hashes linking tx_hashes[position] to the Merkle root.
+
+    Each step is {'hash': hex, 'side': 'left' | 'right'}, the side the sibling
+    sits on. Levels where the node is promoted without a sibling are skipped.
+    """
+    level = [bytes.fromhex(tx_hash) for tx_hash in tx_hashes]
+    siblings = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            siblings.append({'hash': level[sibling].hex(),
+                             'side': 'left' if sibling < position else 'right'})
+        level = _next_level(level)
+        position //= 2
+    return siblings
+
+
+def verify_merkle_proof(tx_hash, siblings, root):
+    """Check that tx_hash and its sibling path hash up to root"""
+    try:
+        node = bytes.fromhex(tx_hash)
+        for step in siblings:
+            sibling = bytes.fromhex(step['hash'])
+            if step['side'] == 'left':
+                node = _hash_pair(sibling, node)
+            elif step['side'] == 'right':
+                node = _hash_pair(node, sibling)
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return node.hex() == root
+
+
+def block_header(block):
+    """The fields of a block covered by its hash"""
+    return {key: block[key] for key in HEADER_FIELDS if key in block}
+
+
+def hash_block(block):
+    """Hex SHA-256 identifying a block"""
+    if 'merkle_root' in block:
+        header_string = json.dumps(block_header(block), sort_keys=True).encode()
+        return hashlib.sha256(header_string).hexdigest()
+
+    # Blocks without a Merkle root hash their whole body, as they were mined.
+    # Cached tx_hash values were added later and are not part of that hash.
+    block_copy = block.copy()
+    block_copy.pop('block_hash', None)
+    if 'transactions' in block_copy:
+        block_copy['transactions'] = [
+            {key: value for key, value in tx.items() if key != 'tx_hash'}
+            for tx in block_copy['transactions']
+        ]
+    block_string = json.dumps(block_copy, sort_keys=True).encode()
+    return hashlib.sha256(block_string).hexdigest()
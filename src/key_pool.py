@@ -0,0 +1,180 @@
+"""
+RSA key pair generation and a background pool of pre-generated pairs.
+
+Generating a 2048-bit key takes tens to hundreds of milliseconds. KeyPool keeps
+a stock of key pairs generated ahead of time in worker processes, so
+create_account can take one instead of generating it in the request.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+import mining
+
+DEFAULT_LOW_WATER = 32
+
+# Seconds over which the refill rate is measured
+REFILL_RATE_WINDOW = 60
+
+
+def generate_key_pair():
+    """A new RSA key pair as (private_key_pem, public_key_pem) strings"""
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend()
+    )
+    public_key = private_key.public_key()
+
+    # Serialize keys to store them as strings in the database
+    private_key_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode('utf-8')
+
+    public_key_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+    return private_key_pem, public_key_pem
+
+
+def _generate_indexed(_):
+    return generate_key_pair()
+
+
+def generate_key_pairs(count, workers=None):
+    """`count` new key pairs, generated across `workers` processes"""
+    workers = min(workers or os.cpu_count() or 1, count)
+    if workers <= 1:
+        return [generate_key_pair() for _ in range(count)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mining.mp_context()) as executor:
+            return list(executor.map(_generate_indexed, range(count),
+                                     chunksize=max(1, count // (workers * 4))))
+    except (OSError, BrokenProcessPool) as e:
+        # A worker that died takes the whole map down with it
+        logging.error(f"Parallel key generation unavailable, generating inline: {e}")
+        return [generate_key_pair() for _ in range(count)]
+
+
+class KeyPool:
+    def __init__(self, low_water=DEFAULT_LOW_WATER, workers=None):
+        """
+        Keeps at least `low_water` key pairs ready (or being generated) once
+        started, using `workers` processes (default: up to 4 cores).
+        """
+        self.low_water = low_water
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._keys = deque()
+        self._pending = 0
+        # Reentrant: a future that is already done runs its callback on add_done_callback
+        self._lock = threading.RLock()
+        self._executor = None
+        self._closed = False
+        self._generated_at = deque()
+        self.generated = 0
+        self.taken = 0
+        self.empty = 0
+        self.failures = 0
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and not self._closed:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=mining.mp_context())
+                except OSError as e:
+                    logging.error(f"Key pool unavailable, keys will be generated inline: {e}")
+                    self._closed = True
+                    return self
+            self._refill()
+        return self
+
+    def take(self):
+        """A pre-generated (private_key_pem, public_key_pem), or None if none is ready"""
+        with self._lock:
+            if self._keys:
+                keys = self._keys.popleft()
+                self.taken += 1
+            else:
+                keys = None
+                self.empty += 1
+            self._refill()
+        return keys
+
+    def _refill(self):
+        # Called with the lock held
+        if self._executor is None or self._closed:
+            return
+        for _ in range(self.low_water - len(self._keys) - self._pending):
+            try:
+                future = self._executor.submit(generate_key_pair)
+            except RuntimeError as e:
+                # The pool broke or was shut down
+                logging.error(f"Key pool stopped, keys will be generated inline: {e}")
+                self._closed = True
+                return
+            self._pending += 1
+            future.add_done_callback(self._generated)
+
+    def _generated(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                self.failures += 1
+                logging.error(f"Key pool worker failed: {error}")
+                return
+            if self._closed:
+                return
+            self._keys.append(future.result())
+            self.generated += 1
+            self._generated_at.append(time.monotonic())
+            self._refill()
+
+    def refill_rate(self):
+        """Key pairs generated per second over the last REFILL_RATE_WINDOW seconds"""
+        with self._lock:
+            cutoff = time.monotonic() - REFILL_RATE_WINDOW
+            while self._generated_at and self._generated_at[0] < cutoff:
+                self._generated_at.popleft()
+            return len(self._generated_at) / REFILL_RATE_WINDOW
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            try:
+                executor.shutdown(wait=False, cancel_futures=True)
+            except TypeError:
+                # Python < 3.9 cannot cancel queued work
+                executor.shutdown(wait=False)
+
+    def stats(self):
+        refill_rate = self.refill_rate()
+        with self._lock:
+            return {
+                'depth': len(self._keys),
+                'pending': self._pending,
+                'low_water': self.low_water,
+                'workers': self.workers,
+                'running': self._executor is not None and not self._closed,
+                'generated': self.generated,
+                'taken': self.taken,
+                'empty': self.empty,
+                'failures': self.failures,
+                'refill_rate': refill_rate,
+            }
@@ -4,48 +4,123 @@ import sqlite3
 from datetime import datetime
 from uuid import uuid4
 from urllib.parse import urlparse
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, Response, jsonify, request, render_template_string, url_for
 import logging
 import requests
 import random
 import string
 import argparse
+import atexit
 from reset_db import reset_database, clear_tables
 
 # Import our modules
 import account_manager
+import chain_responses
+import db
+import gossip
+import peers
+import wire
 from Blockchain import Blockchain
 from Blockchain import log_change
-
-# Ensure database is migrated
-account_manager.migrate_database()
+from mining_jobs import MiningJobManager
+from provision_accounts import read_names
 
 # Create Flask app
 app = Flask(__name__)
 
-# Parse command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('--reset', action='store_true', help='Reset the blockchain and database')
-parser.add_argument('--clear', action='store_true', help='Clear all tables but keep database structure')
-args = parser.parse_args()
-
-# Initialize blockchain
-if args.reset:
-    if reset_database():
-        print("Database reset successful. Starting fresh blockchain...")
-        blockchain = Blockchain(reset_chain=True)
-    else:
-        print("Failed to reset database. Exiting...")
-        exit(1)
-elif args.clear:
-    if clear_tables():
-        print("Tables cleared successfully. Starting fresh blockchain...")
-        blockchain = Blockchain(reset_chain=True)
+# Set up by init() from the command line before the app serves requests, so
+# importing this module has no side effects
+args = None
+blockchain = None
+chain_cache = None
+mining_jobs = None
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+    parser.add_argument('--db', default=db.DB_PATH, help='Database file')
+    parser.add_argument('--reset', action='store_true', help='Reset the blockchain and database')
+    parser.add_argument('--clear', action='store_true', help='Clear all tables but keep database structure')
+    parser.add_argument('--mining-workers', type=int, default=None,
+                        help='Processes used for proof of work (default: all cores, 1 disables the pool)')
+    parser.add_argument('--target-block-interval', type=float, default=None,
+                        help='Seconds between blocks that difficulty retargeting aims for (default: fixed difficulty)')
+    parser.add_argument('--retarget-window', type=int, default=10,
+                        help='Blocks between difficulty retargets')
+    parser.add_argument('--max-resident-blocks', type=int, default=None,
+                        help='Keep only the newest N blocks in memory and read older ones from the database')
+    parser.add_argument('--block-cache-size', type=int, default=1024,
+                        help='Older blocks kept in the LRU cache when --max-resident-blocks is set')
+    parser.add_argument('--account-cache-size', type=int, default=10000,
+                        help='Accounts kept in the in-process account cache (0 disables it)')
+    parser.add_argument('--key-pool-size', type=int, default=32,
+                        help='RSA key pairs kept pre-generated for new accounts (0 generates them per request)')
+    parser.add_argument('--key-pool-workers', type=int, default=None,
+                        help='Processes generating pooled key pairs (default: up to 4 cores)')
+    parser.add_argument('--advertise-address', default=None,
+                        help='host:port peers use to reach this node, sent with gossip announcements '
+                             '(default: localhost:PORT)')
+    parser.add_argument('--gossip-fanout', type=int, default=gossip.DEFAULT_FANOUT,
+                        help='Peers each gossip announcement is pushed to (0 disables gossip)')
+    return parser
+
+def init(options):
+    """Open the database and blockchain and start the background services"""
+    global args, blockchain, chain_cache, mining_jobs
+    args = options
+    db.DB_PATH = args.db
+    
+    # Ensure database is migrated
+    account_manager.migrate_database()
+    
+    # Bound the write-through account cache
+    account_manager.account_cache.resize(args.account_cache_size)
+    
+    # Consensus and mining settings shared by every way of opening the chain
+    blockchain_options = {
+        'mining_workers': args.mining_workers,
+        'target_block_interval': args.target_block_interval,
+        'retarget_window': args.retarget_window,
+        'max_resident_blocks': args.max_resident_blocks,
+        'block_cache_size': args.block_cache_size,
+    }
+    
+    # Initialize blockchain
+    if args.reset:
+        if reset_database():
+            print("Database reset successful. Starting fresh blockchain...")
+            blockchain = Blockchain(reset_chain=True, **blockchain_options)
+        else:
+            print("Failed to reset database. Exiting...")
+            exit(1)
+    elif args.clear:
+        if clear_tables():
+            print("Tables cleared successfully. Starting fresh blockchain...")
+            blockchain = Blockchain(reset_chain=True, **blockchain_options)
+        else:
+            print("Failed to clear tables. Exiting...")
+            exit(1)
     else:
-        print("Failed to clear tables. Exiting...")
-        exit(1)
-else:
-    blockchain = Blockchain()
+        blockchain = Blockchain(**blockchain_options)
+    
+    # Pre-generate key pairs so /add_account does not wait on RSA key generation
+    account_manager.start_key_pool(args.key_pool_size, args.key_pool_workers)
+    
+    # Serialized blocks and /chain responses
+    chain_cache = chain_responses.ChainResponseCache()
+    
+    # Background mining jobs against the blockchain tip
+    mining_jobs = MiningJobManager(blockchain)
+    
+    # Latency and height updates are saved in batches; keep the last ones on exit
+    atexit.register(blockchain.nodes.save)
+    
+    # Push new blocks and transactions to peers as they happen
+    if args.gossip_fanout > 0:
+        address = args.advertise_address or f'localhost:{args.port}'
+        blockchain.gossip = gossip.Gossip(blockchain, address, args.gossip_fanout).start()
+    return app
 
 # HTML template for the interface
 HTML_TEMPLATE = '''
@@ -461,10 +536,20 @@ HTML_TEMPLATE = '''
 
         async function viewAccounts() {
             try {
-                const response = await fetch('/accounts');
-                const data = await response.json();
+                // Follow the cursor through every page
+                let accounts = [];
+                let cursor = null;
+                let response;
+                let data;
+                do {
+                    response = await fetch('/accounts' + (cursor ? `?after=${encodeURIComponent(cursor)}` : ''));
+                    data = await response.json();
+                    if (!response.ok) break;
+                    accounts = accounts.concat(data.accounts);
+                    cursor = data.next_cursor;
+                } while (cursor);
                 if (response.ok) {
-                    const accountsHtml = data.accounts.map(account => `
+                    const accountsHtml = accounts.map(account => `
                         <div class="account-card">
                             <h3>${account.name}</h3>
                             <div class="account-details">
@@ -737,34 +822,137 @@ def add_account():
         logging.error(f"Error creating account: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Most names accepted by one /accounts/bulk request
+MAX_BULK_ACCOUNTS = 10000
+
+@app.route('/accounts/bulk', methods=['POST'])
+def add_accounts_bulk():
+    # Body: {"names": [...]}, a JSON list, or NDJSON (one name or {"name": ...} per line)
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            names = read_names(request.get_data(as_text=True).splitlines())
+        else:
+            data = request.get_json(silent=True)
+            names = data.get('names') if isinstance(data, dict) else data
+            if not isinstance(names, list):
+                return jsonify({"error": "Expected a list of names"}), 400
+        
+        if len(names) > MAX_BULK_ACCOUNTS:
+            return jsonify({"error": f"At most {MAX_BULK_ACCOUNTS} names per request"}), 413
+        
+        results = account_manager.create_accounts(names)
+        created = [result for result in results if result['status'] == 'created']
+        if created:
+            log_change("Accounts Created", {"count": len(created)})
+        
+        return jsonify({
+            "created": len(created),
+            "failed": len(results) - len(created),
+            "results": results
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Error creating accounts: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/mine')
 def mine():
+    # Blocking wrapper around the job API: joins the job mining the current tip
     try:
-        last_block = blockchain.last_block
-        last_proof = last_block['proof']
-        proof = blockchain.proof_of_work(last_proof)
+        job, _ = mining_jobs.start()
+        status = job.status
+        while not job.finished:
+            status = job.wait(last_status=status)
         
-        previous_hash = blockchain.hash(last_block)
-        block = blockchain.new_block(proof, previous_hash)
+        if job.status != 'completed':
+            return jsonify({'error': job.error or f"Mining job {job.status}", 'job_id': job.id}), 409
         
+        block = job.block
         response = {
             'message': 'New block created',
             'index': block['index'],
             'transactions': block['transactions'],
             'proof': block['proof'],
             'previous_hash': block['previous_hash'],
-            'block_hash': block['block_hash']
+            'block_hash': block['block_hash'],
+            'difficulty': block['difficulty']
         }
         return jsonify(response), 200
     except Exception as e:
         logging.error(f"Error mining block: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/mine/jobs', methods=['POST'])
+def start_mining_job():
+    try:
+        job, created = mining_jobs.start()
+        response = job.to_dict()
+        response['status_url'] = url_for('get_mining_job', job_id=job.id)
+        response['stream_url'] = url_for('stream_mining_job', job_id=job.id)
+        return jsonify(response), 202 if created else 200
+    except Exception as e:
+        logging.error(f"Error starting mining job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/mine/jobs/<job_id>')
+def get_mining_job(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Mining job '{job_id}' not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/mine/jobs/<job_id>/stream')
+def stream_mining_job(job_id):
+    # NDJSON stream: one status line per change, plus a heartbeat while mining
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Mining job '{job_id}' not found"}), 404
+    
+    def generate():
+        status = job.status
+        yield json.dumps(job.to_dict()) + '\n'
+        while not job.finished:
+            status = job.wait(timeout=1.0, last_status=status)
+            yield json.dumps(job.to_dict()) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/mine/jobs/<job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id):
+    job = mining_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f"Mining job '{job_id}' not found"}), 404
+    job.wait(timeout=5.0, last_status=job.status)
+    return jsonify(job.to_dict()), 200
+
 @app.route('/accounts')
 def get_accounts():
+    # Keyset pagination: ?order_by=name|id&after=<next_cursor>&limit=N&fields=id,name,...
+    # With ?format=ndjson (or Accept: application/x-ndjson) every account after
+    # `after` is streamed, one JSON object per line.
     try:
-        accounts = account_manager.get_all_accounts()
-        return jsonify({"accounts": accounts}), 200
+        order_by = request.args.get('order_by', 'name')
+        after = request.args.get('after')
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        try:
+            limit = int(request.args.get('limit', account_manager.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        
+        ndjson = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == 'application/x-ndjson')
+        if ndjson:
+            # Check the parameters before the stream starts
+            account_manager.get_accounts_page(order_by, after, 1, fields)
+            accounts = account_manager.iter_accounts(order_by, after, fields)
+            return Response((json.dumps(account) + '\n' for account in accounts),
+                            mimetype='application/x-ndjson')
+        
+        accounts, next_cursor = account_manager.get_accounts_page(order_by, after, limit, fields)
+        return jsonify({"accounts": accounts, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting accounts: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -797,72 +985,19 @@ def add_transaction():
             print(f"ERROR: Price value: {values.get('price')} ({type(values.get('price'))})")
             return jsonify({"error": "Invalid numeric values for power or price"}), 400
         
-        # Get initial balances
-        print(f"DEBUG: Getting sender account: {values['sender']}")
-        sender_account = account_manager.get_account(values["sender"])
-        print(f"DEBUG: Sender account: {sender_account}")
-        
-        print(f"DEBUG: Getting receiver account: {values['receiver']}")
-        receiver_account = account_manager.get_account(values["receiver"])
-        print(f"DEBUG: Receiver account: {receiver_account}")
-        
-        if not sender_account:
-            return jsonify({"error": f"Sender account '{values['sender']}' does not exist"}), 400
-        if not receiver_account:
-            return jsonify({"error": f"Receiver account '{values['receiver']}' does not exist"}), 400
-        
-        # Store initial balances
-        initial_balances = {
-            "sender": {
-                "eth_balance": sender_account["balance"],
-                "power_balance": sender_account["power_balance"]
-            },
-            "receiver": {
-                "eth_balance": receiver_account["balance"],
-                "power_balance": receiver_account["power_balance"]
-            }
-        }
-        
-        # Get balances - they should already be float from get_account
-        print(f"DEBUG: Getting balances")
-        print(f"DEBUG: Sender balance: {sender_account['balance']} ({type(sender_account['balance'])})")
-        print(f"DEBUG: Sender power balance: {sender_account['power_balance']} ({type(sender_account['power_balance'])})")
-        
-        sender_eth_balance = sender_account["balance"]
-        sender_power_balance = sender_account["power_balance"]
-        receiver_eth_balance = receiver_account["balance"]
-        receiver_power_balance = receiver_account["power_balance"]
-        
         # Determine actual buyer and seller based on role
         if values["role"] == "seller":
             seller_name = values["sender"]
             buyer_name = values["receiver"]
-            seller_power_bal = sender_power_balance
-            buyer_eth_bal = receiver_eth_balance
         else:  # role == "buyer"
             buyer_name = values["sender"]
             seller_name = values["receiver"]
-            seller_power_bal = receiver_power_balance
-            buyer_eth_bal = sender_eth_balance
-
-        # Check buyer has enough ETH
-        if buyer_eth_bal < total_cost:
-            return jsonify({"error": f"Insufficient ETH balance for buyer {buyer_name}"}), 400
-
-        # Check seller has enough power
-        if seller_power_bal < power_amount:
-            return jsonify({"error": f"Insufficient power balance for seller {seller_name}"}), 400
             
         try:
-            print("DEBUG: Updating balances")
-            # Update ETH balances: buyer pays seller
-            account_manager.update_balance(buyer_name, -total_cost)
-            account_manager.update_balance(seller_name, total_cost)
-
-            # Update power balances: seller transfers power to buyer
-            account_manager.update_power_balance(seller_name, -power_amount)
-            account_manager.update_power_balance(buyer_name, power_amount)
-                
+            # Buyer pays seller and seller transfers power to buyer, all in one
+            # database transaction that returns the balances before and after
+            print("DEBUG: Settling trade")
+            settlement = account_manager.settle_trade(seller_name, buyer_name, power_amount, total_cost)
         except ValueError as e:
             print(f"ERROR: Failed to update balances: {str(e)}")
             return jsonify({"error": str(e)}), 400
@@ -870,11 +1005,11 @@ def add_transaction():
         # Add transaction to blockchain
         print("DEBUG: Adding transaction to blockchain")
         blockchain.new_transaction_seller(seller_name, buyer_name, power_amount, price_per_kwh)
-            
-        # Get updated account balances
-        print("DEBUG: Getting updated balances")
-        updated_sender = account_manager.get_account(values["sender"])
-        updated_receiver = account_manager.get_account(values["receiver"])
+        
+        if values["role"] == "seller":
+            sender, receiver = settlement["seller"], settlement["buyer"]
+        else:
+            sender, receiver = settlement["buyer"], settlement["seller"]
             
         return jsonify({
             "message": "Transaction will be processed",
@@ -883,23 +1018,23 @@ def add_transaction():
             "sender": {
                 "name": values["sender"],
                 "initial_balances": {
-                    "eth_balance": initial_balances["sender"]["eth_balance"],
-                    "power_balance": initial_balances["sender"]["power_balance"]
+                    "eth_balance": sender["before"]["balance"],
+                    "power_balance": sender["before"]["power_balance"]
                 },
                 "final_balances": {
-                    "eth_balance": updated_sender["balance"],
-                    "power_balance": updated_sender["power_balance"]
+                    "eth_balance": sender["after"]["balance"],
+                    "power_balance": sender["after"]["power_balance"]
                 }
             },
             "receiver": {
                 "name": values["receiver"],
                 "initial_balances": {
-                    "eth_balance": initial_balances["receiver"]["eth_balance"],
-                    "power_balance": initial_balances["receiver"]["power_balance"]
+                    "eth_balance": receiver["before"]["balance"],
+                    "power_balance": receiver["before"]["power_balance"]
                 },
                 "final_balances": {
-                    "eth_balance": updated_receiver["balance"],
-                    "power_balance": updated_receiver["power_balance"]
+                    "eth_balance": receiver["after"]["balance"],
+                    "power_balance": receiver["after"]["power_balance"]
                 }
             }
         }), 201
@@ -912,13 +1047,196 @@ def add_transaction():
         logging.error(f"Error adding transaction: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def _parse_trade(item):
+    """(seller, buyer, power, price) for one /add_transactions item; raises ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError("Trade must be an object")
+    missing = [k for k in ("sender", "receiver", "power", "price", "role") if k not in item]
+    if missing:
+        raise ValueError(f"Missing values: {', '.join(missing)}")
+    try:
+        power = float(item["power"])
+        price = float(item["price"])
+    except (ValueError, TypeError):
+        raise ValueError("Invalid numeric values for power or price")
+    if power <= 0 or price < 0:
+        raise ValueError("Power must be positive and price must not be negative")
+    if item["role"] == "seller":
+        return item["sender"], item["receiver"], power, price
+    if item["role"] == "buyer":
+        return item["receiver"], item["sender"], power, price
+    raise ValueError("Role must be 'seller' or 'buyer'")
+
+@app.route('/add_transactions', methods=['POST'])
+def add_transactions():
+    # Batch of /add_transaction trades. Items are validated first; the valid
+    # ones settle in request order inside one database transaction, each
+    # against the balances left by the earlier ones. An item that fails
+    # (invalid, unknown account, insufficient ETH or power) is skipped without
+    # affecting the others. Settled trades join the pending transactions in
+    # request order. Results come back in request order.
+    try:
+        values = request.get_json(silent=True)
+        items = values.get('transactions') if isinstance(values, dict) else values
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a list of transactions"}), 400
+        if len(items) > account_manager.MAX_TRADE_BATCH:
+            return jsonify({"error": f"At most {account_manager.MAX_TRADE_BATCH} transactions per batch"}), 413
+        
+        results = []
+        valid = []
+        for index, item in enumerate(items):
+            try:
+                trade = _parse_trade(item)
+            except ValueError as e:
+                results.append({"index": index, "status": "failed", "error": str(e)})
+                continue
+            result = {"index": index}
+            results.append(result)
+            valid.append((result, trade))
+        
+        try:
+            settlements = account_manager.settle_trades(
+                [(seller, buyer, power, power * price) for _, (seller, buyer, power, price) in valid])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 500
+        
+        settled = []
+        for (result, trade), settlement in zip(valid, settlements):
+            if "error" in settlement:
+                result.update(status="failed", error=settlement["error"])
+                continue
+            seller, buyer, power, price = trade
+            result.update(status="settled", power_amount=power, total_cost=power * price,
+                          seller=settlement["seller"], buyer=settlement["buyer"])
+            settled.append((result, trade))
+        
+        transactions = blockchain.new_transactions([trade for _, trade in settled])
+        for (result, _), transaction in zip(settled, transactions):
+            result["tx_hash"] = transaction["tx_hash"]
+        
+        return jsonify({
+            "settled": len(settled),
+            "failed": len(results) - len(settled),
+            "results": results
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Error adding transactions: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Blocks read from the chain at a time while streaming /chain
+CHAIN_STREAM_BATCH = 500
+
+# Request headers every /chain response depends on, including 304s
+CHAIN_VARY = 'Accept, Accept-Encoding'
+
+def _chain_range(length):
+    """0-based [start, stop) for the from/to (1-based, inclusive) and limit query parameters"""
+    try:
+        first = int(request.args.get('from', 1))
+        last = int(request.args.get('to', length))
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        raise ValueError("from, to and limit must be integers")
+    if first < 1 or (limit is not None and limit < 1):
+        raise ValueError("from and limit must be at least 1")
+    start, stop = first - 1, min(last, length)
+    if limit is not None:
+        stop = min(stop, start + limit)
+    return start, max(start, stop)
+
+def _iter_chain(chain, start, stop):
+    # Slices are read a batch at a time, so a ChainWindow never loads the whole range
+    for batch_start in range(start, stop, CHAIN_STREAM_BATCH):
+        yield from chain[batch_start:min(batch_start + CHAIN_STREAM_BATCH, stop)]
+
 @app.route('/chain')
 def full_chain():
-    response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain),
-    }
-    return jsonify(response), 200
+    # ?from=&to= (1-based heights, inclusive) and ?limit= select a range; without
+    # them the whole chain is returned. ?headers=1 leaves out the transactions.
+    # ?format=ndjson (or Accept: application/x-ndjson) streams one block per line.
+    with blockchain.lock:
+        chain = blockchain.chain
+        length = len(chain)
+        tip_hash = chain[-1]['block_hash'] if length else ''
+    try:
+        start, stop = _chain_range(length)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    headers_only = request.args.get('headers') in ('1', 'true')
+    ndjson = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    # Peers that ask for it get the compact binary format; JSON stays the default
+    binary = not ndjson and request.accept_mimetypes.best == wire.CONTENT_TYPE
+    
+    # The same tip, height and query always produce the same bytes
+    key = (tip_hash, length, start, stop, headers_only, ndjson, binary)
+    etag = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+    # Weak: the gzipped and plain bodies are the same representation
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Vary'] = CHAIN_VARY
+        return response
+    
+    if ndjson:
+        blocks = _iter_chain(chain, start, stop)
+        response = Response((chain_cache.block_bytes(block, headers_only) + b'\n' for block in blocks),
+                            mimetype='application/x-ndjson')
+    else:
+        if binary:
+            mimetype = wire.CONTENT_TYPE
+            body = chain_cache.render(key, lambda: wire.encode_chain(
+                (chain_responses.header_view(block) if headers_only else block
+                 for block in _iter_chain(chain, start, stop)),
+                length, start + 1, stop, headers_only))
+        else:
+            mimetype = 'application/json'
+            body = chain_cache.render(key, lambda: chain_cache.chain_body(
+                _iter_chain(chain, start, stop), length, start + 1, stop, headers_only))
+        if len(body) >= chain_responses.GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+            body = chain_cache.gzipped(key, body)
+            response = Response(body, mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype=mimetype)
+    
+    response.headers['Vary'] = CHAIN_VARY
+    response.set_etag(etag, weak=True)
+    response.headers['X-Chain-Length'] = str(length)
+    return response
+
+@app.route('/transactions/<tx_hash>/proof')
+def transaction_proof(tx_hash):
+    # Merkle inclusion proof for light clients: block header plus sibling hashes
+    try:
+        proof = blockchain.get_inclusion_proof(tx_hash)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+    if proof is None:
+        return jsonify({"error": f"Transaction '{tx_hash}' is not in a mined block"}), 404
+    return jsonify(proof), 200
+
+@app.route('/metrics')
+def metrics():
+    # Cache and storage counters for this node
+    return jsonify({
+        'chain': {
+            'length': len(blockchain.chain),
+            'load': blockchain.load_stats,
+            'block_cache': blockchain.cache_stats(),
+            'responses': chain_cache.stats(),
+        },
+        'accounts': {
+            'cache': account_manager.account_cache.stats(),
+            'key_pool': account_manager.key_pool_stats(),
+        },
+        'gossip': blockchain.gossip.stats() if blockchain.gossip is not None else None,
+        'peers': blockchain.nodes.stats(),
+    }), 200
 
 @app.route('/nodes/register', methods=['POST'])
 def register_node():
@@ -927,8 +1245,13 @@ def register_node():
     if nodes is None:
         return "Error: Please supply a valid list of nodes", 400
 
-    for node in nodes:
-        blockchain.register_node(node)
+    # Spellings of one address (http://Node:5000/, node:5000) register one peer
+    try:
+        addresses = [peers.normalize_address(node) for node in nodes]
+    except ValueError as e:
+        return f"Error: {e}", 400
+    for address in addresses:
+        blockchain.register_node(address)
         
     response = {
         'message': 'New nodes have been added',
@@ -936,21 +1259,48 @@ def register_node():
     }
     return jsonify(response), 201
 
+@app.route('/nodes', methods=['GET'])
+def list_nodes():
+    # Peer table: latency, failures, last tip and backoff per peer
+    return jsonify({'nodes': blockchain.nodes.snapshot(), 'total': len(blockchain.nodes)}), 200
+
 @app.route('/nodes/resolve')
 def consensus():
+    # Reports the resulting tip; fetch blocks with GET /chain
     replaced = blockchain.resolve_conflicts()
-    if replaced:
-        response = {
-            'message': 'Our chain was replaced',
-            'new_chain': blockchain.chain
-        }
-    else:
-        response = {
-            'message': 'Our chain is authoritative',
-            'new_chain': blockchain.chain
-        }
+    with blockchain.lock:
+        last_block = blockchain.last_block
+        length = len(blockchain.chain)
+    response = {
+        'message': 'Our chain was replaced' if replaced else 'Our chain is authoritative',
+        'replaced': replaced,
+        'length': length,
+        'tip': {'index': last_block['index'], 'block_hash': last_block['block_hash']},
+    }
     return jsonify(response), 200
 
+@app.route('/gossip', methods=['POST'])
+def receive_gossip():
+    # Announcement from a peer: {"sender", "blocks": [headers], "transactions": [{"tx_hash"}]}
+    if blockchain.gossip is None:
+        return jsonify({"error": "Gossip is disabled on this node"}), 404
+    values = request.get_json(silent=True)
+    try:
+        new = blockchain.gossip.receive(values)
+    except gossip.UnknownSender as e:
+        return jsonify({"error": str(e)}), 403
+    except (KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid announcement: {e}"}), 400
+    return jsonify({"new": new}), 202
+
+@app.route('/transactions/pending')
+def pending_transactions():
+    # Mempool transactions by ?hash= (repeatable), as fetched by gossiping peers
+    transactions = blockchain.pending_transactions(request.args.getlist('hash'))
+    if request.accept_mimetypes.best == wire.CONTENT_TYPE:
+        return Response(wire.encode_transactions(transactions), mimetype=wire.CONTENT_TYPE)
+    return jsonify({"transactions": transactions}), 200
+
 @app.route('/add_balance', methods=['POST'])
 def add_balance():
     try:
@@ -1092,4 +1442,5 @@ def transfer_power():
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    init(build_parser().parse_args())
+    app.run(host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Proof-of-work search engine.
+
+This module has no database side effects so that worker processes can import
+it cheaply. Blockchain.proof_of_work delegates to it.
+"""
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+from functools import lru_cache
+
+# Number of nonces a worker claims at a time. Small enough that workers notice
+# a found proof quickly, large enough that claiming a chunk is negligible.
+DEFAULT_CHUNK_SIZE = 4096
+
+# Difficulty is the number of leading zero bits a proof's SHA-256 digest must
+# have. 16 bits is the original '0000' hex prefix and applies to blocks that
+# predate recorded difficulty.
+DEFAULT_DIFFICULTY = 16
+MIN_DIFFICULTY = 8
+MAX_DIFFICULTY = 32
+
+# Blocks between retargets, and the largest change (in bits) of one retarget
+DEFAULT_RETARGET_WINDOW = 10
+MAX_RETARGET_STEP = 2
+
+# How often (in seconds) a parallel search checks its should_stop callback
+STOP_POLL_INTERVAL = 0.05
+
+# Shared state of the current search, installed in each worker by _init_worker
+_next_start = None
+_best_proof = None
+_stop = None
+
+
+@lru_cache(maxsize=None)
+def difficulty_target(difficulty):
+    """
+    Digest threshold for a difficulty.
+
+    A digest has `difficulty` leading zero bits exactly when, read as a 32-byte
+    big-endian number, it is below 2 ** (256 - difficulty). Comparing raw bytes
+    against this target avoids building hex text.
+    """
+    return (1 << (256 - difficulty)).to_bytes(32, 'big')
+
+
+def valid_proof(last_proof, proof, difficulty=DEFAULT_DIFFICULTY):
+    # Check if the proof of work is valid
+    this_proof = f'{proof}{last_proof}'.encode()
+    return hashlib.sha256(this_proof).digest() < difficulty_target(difficulty)
+
+
+def search_range(last_proof, start, stop, difficulty=DEFAULT_DIFFICULTY):
+    """
+    Return the first valid proof in [start, stop), or None.
+
+    The inner loop only formats the nonce: the last_proof suffix, the hash
+    constructor and the target are bound once, and the digest is compared as
+    raw bytes. It accepts exactly the proofs valid_proof accepts.
+    """
+    suffix = str(last_proof).encode()
+    sha256 = hashlib.sha256
+    target = difficulty_target(difficulty)
+    proof = start
+    while proof < stop:
+        if sha256(b'%d%s' % (proof, suffix)).digest() < target:
+            return proof
+        proof += 1
+    return None
+
+
+def proof_of_work(last_proof, should_stop=None, difficulty=DEFAULT_DIFFICULTY):
+    """
+    Single-process search, returns the smallest valid proof.
+
+    should_stop is polled between chunks; the search returns None once it
+    returns True.
+    """
+    start = 0
+    while True:
+        if should_stop is not None and should_stop():
+            return None
+        proof = search_range(last_proof, start, start + DEFAULT_CHUNK_SIZE, difficulty)
+        if proof is not None:
+            return proof
+        start += DEFAULT_CHUNK_SIZE
+
+
+def mp_context():
+    # Prefer fork: spawn/forkserver would re-import the Flask app in every worker
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _init_worker(next_start, best_proof, stop):
+    global _next_start, _best_proof, _stop
+    _next_start = next_start
+    _best_proof = best_proof
+    _stop = stop
+
+
+def _search_worker(last_proof, chunk_size, difficulty):
+    # Claim chunks in increasing order until a proof at or below our chunk is known
+    while not _stop.value:
+        with _next_start.get_lock():
+            start = _next_start.value
+            _next_start.value += chunk_size
+
+        best = _best_proof.value
+        if best != -1 and start > best:
+            return
+
+        proof = search_range(last_proof, start, start + chunk_size, difficulty)
+        if proof is not None:
+            with _best_proof.get_lock():
+                if _best_proof.value == -1 or proof < _best_proof.value:
+                    _best_proof.value = proof
+            return
+
+
+class ParallelMiner:
+    """
+    Splits the nonce space across a process pool.
+
+    Workers claim fixed-size chunks from a shared counter, so every chunk below
+    the winning one is fully searched and the result is the same smallest proof
+    the single-process loop finds. Workers stop claiming chunks as soon as a
+    proof below their next chunk has been found.
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._next_start = None
+        self._best_proof = None
+        self._stop = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            ctx = mp_context()
+            self._next_start = ctx.Value('q', 0)
+            self._best_proof = ctx.Value('q', -1)
+            self._stop = ctx.Value('b', 0)
+            self._pool = ctx.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(self._next_start, self._best_proof, self._stop))
+        return self._pool
+
+    def search(self, last_proof, should_stop=None, difficulty=DEFAULT_DIFFICULTY):
+        """
+        Return the smallest valid proof, or None if should_stop returned True
+        before the search finished.
+        """
+        pool = self._get_pool()
+        # Tasks of the previous search have all returned, so resetting is safe
+        self._next_start.value = 0
+        self._best_proof.value = -1
+        self._stop.value = 0
+
+        results = [pool.apply_async(_search_worker, (last_proof, self.chunk_size, difficulty))
+                   for _ in range(self.workers)]
+        for result in results:
+            while not result.ready():
+                if should_stop is not None and should_stop():
+                    self._stop.value = 1
+                result.wait(STOP_POLL_INTERVAL)
+            result.get()
+
+        if self._stop.value:
+            return None
+        return self._best_proof.value
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def parallel_proof_of_work(last_proof, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                           difficulty=DEFAULT_DIFFICULTY):
+    """One-off parallel search; falls back to a single process if workers <= 1"""
+    if workers is not None and workers <= 1:
+        return proof_of_work(last_proof, difficulty=difficulty)
+    miner = ParallelMiner(workers, chunk_size)
+    try:
+        return miner.search(last_proof, difficulty=difficulty)
+    except OSError as e:
+        logging.error(f"Parallel mining unavailable, falling back to a single process: {e}")
+        return proof_of_work(last_proof, difficulty=difficulty)
+    finally:
+        miner.close()
+
+
+def retarget(height, parent_difficulty, timestamps, target_interval,
+             window=DEFAULT_RETARGET_WINDOW):
+    """
+    Difficulty for the block at `height` (1-based).
+
+    Difficulty only changes on every `window`-th block. It is then moved by
+    log2(target / observed) bits, where observed is the mean interval between
+    `timestamps` (seconds, oldest first, the last `window` blocks before
+    `height`). The step is capped at MAX_RETARGET_STEP bits and the result is
+    kept within [MIN_DIFFICULTY, MAX_DIFFICULTY]. With no target_interval the
+    difficulty never changes.
+    """
+    if not target_interval or height <= window or (height - 1) % window != 0:
+        return parent_difficulty
+    if len(timestamps) < 2:
+        return parent_difficulty
+
+    observed = max((timestamps[-1] - timestamps[0]) / (len(timestamps) - 1), 1e-6)
+    step = round(math.log2(target_interval / observed))
+    step = max(-MAX_RETARGET_STEP, min(MAX_RETARGET_STEP, step))
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, parent_difficulty + step))
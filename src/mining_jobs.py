@@ -0,0 +1,173 @@
+"""
+Background mining jobs.
+
+A job searches for the next proof of work in its own thread so that request
+threads are not blocked. Only one job runs against a given chain tip at a
+time, and a job abandons its search when the tip it started from changes.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from Blockchain import log_change
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+ABANDONED = 'abandoned'
+FAILED = 'failed'
+
+FINISHED_STATES = (COMPLETED, CANCELLED, ABANDONED, FAILED)
+
+
+class MiningJob:
+    def __init__(self, tip_index, tip_hash, tip_proof, difficulty):
+        self.id = str(uuid4())
+        self.status = PENDING
+        self.tip_index = tip_index
+        self.tip_hash = tip_hash
+        self.tip_proof = tip_proof
+        self.difficulty = difficulty
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.block = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        # Notified on every status change, used by wait()
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def set_status(self, status, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED_STATES:
+                self.finished_at = time.time()
+            self.changed.notify_all()
+
+    def wait(self, timeout=None, last_status=None):
+        """Block until the status differs from last_status or the job finishes"""
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.finished or self.status != last_status, timeout)
+            return self.status
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        job = {
+            'job_id': self.id,
+            'status': self.status,
+            'tip_index': self.tip_index,
+            'tip_hash': self.tip_hash,
+            'difficulty': self.difficulty,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed': round(end - (self.started_at or self.created_at), 3),
+        }
+        if self.block is not None:
+            job['block'] = {
+                'index': self.block['index'],
+                'transactions': self.block['transactions'],
+                'proof': self.block['proof'],
+                'previous_hash': self.block['previous_hash'],
+                'block_hash': self.block['block_hash'],
+                'difficulty': self.block.get('difficulty'),
+            }
+        if self.error is not None:
+            job['error'] = self.error
+        return job
+
+
+class MiningJobManager:
+    def __init__(self, blockchain, max_finished_jobs=100):
+        self.blockchain = blockchain
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.active_job = None
+
+    def _tip(self):
+        last_block = self.blockchain.last_block
+        return last_block['index'], last_block['block_hash'], last_block['proof']
+
+    def start(self):
+        """
+        Start a job against the current tip.
+
+        Returns (job, created). If a job is already mining the current tip it is
+        returned instead of starting a second one.
+        """
+        with self.lock:
+            tip_index, tip_hash, tip_proof = self._tip()
+            active = self.active_job
+            if active is not None and not active.finished:
+                if active.tip_hash == tip_hash:
+                    return active, False
+                # Mining a stale tip, it would abandon itself on its next check
+                active.cancel_event.set()
+
+            job = MiningJob(tip_index, tip_hash, tip_proof, self.blockchain.next_difficulty())
+            self.jobs[job.id] = job
+            self.active_job = job
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True,
+                                  name=f"mining-job-{job.id}")
+        thread.start()
+        return job, True
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+        return job
+
+    def _tip_changed(self, job):
+        return self.blockchain.last_block['block_hash'] != job.tip_hash
+
+    def _run(self, job):
+        job.set_status(RUNNING)
+        try:
+            proof = self.blockchain.proof_of_work(
+                job.tip_proof,
+                should_stop=lambda: job.cancel_event.is_set() or self._tip_changed(job),
+                difficulty=job.difficulty)
+
+            if job.cancel_event.is_set() and not self._tip_changed(job):
+                job.set_status(CANCELLED)
+                return
+
+            with self.blockchain.lock:
+                # The tip may have moved after the last should_stop check
+                if proof is None or self._tip_changed(job):
+                    job.set_status(ABANDONED, error='Chain tip changed while mining')
+                    return
+                block = self.blockchain.new_block(proof, job.tip_hash, job.difficulty)
+
+            log_change("Block Mined", {"index": block['index'], "block_hash": block['block_hash'],
+                                       "job_id": job.id})
+            job.set_status(COMPLETED, block=block)
+        except Exception as e:
+            logging.error(f"Error in mining job {job.id}: {str(e)}")
+            job.set_status(FAILED, error=str(e))
+
+    def _prune(self):
+        # Keep the history bounded; unfinished jobs are never dropped
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
@@ -0,0 +1,208 @@
+"""
+Known peers and how healthy each one is, kept in the Peers table.
+
+Every request to a peer records its outcome: round-trip latency (a moving
+average), the tip height it reported and its failures. A peer that fails is
+backed off for exponentially longer after each consecutive failure, up to
+MAX_BACKOFF, and is only tried again once that passes, so dead peers are
+probed less and less often instead of on every resolve and gossip round.
+One success clears the backoff.
+
+Addresses are normalized to host:port, so http://Node:5000/, node:5000 and
+NODE:5000 are one peer.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import db
+
+# Weight of the newest sample in the latency moving average
+LATENCY_WEIGHT = 0.3
+
+# Seconds a peer is skipped after its first failure; doubles per failure in a row
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+
+# Seconds between writes of latency and height updates; added peers, first
+# contact and changes of backoff state are written at once
+SAVE_INTERVAL = 5.0
+
+FIELDS = ('address', 'latency', 'successes', 'failures', 'consecutive_failures',
+          'height', 'last_seen', 'last_failure', 'backoff_until', 'added_at')
+
+
+def normalize_address(address):
+    """host:port for a node URL or bare address; raises ValueError without a host"""
+    text = str(address).strip()
+    parsed = urlparse(text if '://' in text else '//' + text)
+    host = parsed.hostname
+    if not host:
+        raise ValueError(f"Invalid node address {address!r}")
+    port = parsed.port
+    if ':' in host:
+        host = f'[{host}]'
+    # Peers are reached over http://, where no port means 80
+    return host if port in (None, 80) else f'{host}:{port}'
+
+
+class PeerTable:
+    """
+    Set-like collection of peer addresses with a health record per peer.
+    Iterating yields every known address; available() leaves out the ones
+    backed off.
+    """
+    def __init__(self, path=None):
+        self.path = db.db_path(path)
+        self._peers = {}
+        self._dirty = set()
+        self._last_save = time.time()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with db.transaction(self.path) as cursor:
+                cursor.execute(f"SELECT {', '.join(FIELDS)} FROM Peers")
+                rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Could not load peers: {e}")
+            return
+        for row in rows:
+            peer = dict(zip(FIELDS, row))
+            self._peers[peer['address']] = peer
+
+    def add(self, address):
+        """Register a peer; returns its normalized address"""
+        address = normalize_address(address)
+        with self._lock:
+            if address in self._peers:
+                return address
+            self._peers[address] = {'address': address, 'latency': None, 'successes': 0, 'failures': 0,
+                                    'consecutive_failures': 0, 'height': None, 'last_seen': None,
+                                    'last_failure': None, 'backoff_until': 0.0, 'added_at': time.time()}
+            self._dirty.add(address)
+        self.save()
+        return address
+
+    def __contains__(self, address):
+        try:
+            address = normalize_address(address)
+        except ValueError:
+            return False
+        with self._lock:
+            return address in self._peers
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._peers))
+
+    def __len__(self):
+        return len(self._peers)
+
+    def available(self, now=None):
+        """Addresses of the peers not backed off"""
+        now = now or time.time()
+        with self._lock:
+            return [address for address, peer in self._peers.items() if peer['backoff_until'] <= now]
+
+    def _find(self, address):
+        # Called with the lock held; gossip senders may spell an address differently
+        peer = self._peers.get(address)
+        if peer is None:
+            try:
+                peer = self._peers.get(normalize_address(address))
+            except ValueError:
+                return None
+        return peer
+
+    def latency(self, address):
+        """Average latency in seconds; infinite for peers never reached"""
+        with self._lock:
+            peer = self._find(address)
+            if peer is None or peer['latency'] is None:
+                return float('inf')
+            return peer['latency']
+
+    def record_success(self, address, latency, height=None):
+        now = time.time()
+        with self._lock:
+            peer = self._find(address)
+            if peer is None:
+                return
+            # First contact and recovery change the state worth keeping at once
+            changed = peer['last_seen'] is None or peer['consecutive_failures'] > 0
+            peer['latency'] = latency if peer['latency'] is None \
+                else (1 - LATENCY_WEIGHT) * peer['latency'] + LATENCY_WEIGHT * latency
+            peer['successes'] += 1
+            peer['consecutive_failures'] = 0
+            peer['backoff_until'] = 0.0
+            peer['last_seen'] = now
+            if height is not None:
+                peer['height'] = height
+            self._dirty.add(peer['address'])
+        self._save_later(force=changed)
+
+    def record_failure(self, address):
+        now = time.time()
+        with self._lock:
+            peer = self._find(address)
+            if peer is None:
+                return
+            peer['failures'] += 1
+            peer['consecutive_failures'] += 1
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (peer['consecutive_failures'] - 1))
+            peer['backoff_until'] = now + backoff
+            peer['last_failure'] = now
+            self._dirty.add(peer['address'])
+        self._save_later(force=True)
+
+    def record_height(self, address, height):
+        """Tip height a peer announced by gossip"""
+        with self._lock:
+            peer = self._find(address)
+            if peer is None:
+                return
+            peer['height'] = max(height, peer['height'] or 0)
+            self._dirty.add(peer['address'])
+        self._save_later()
+
+    def _save_later(self, force=False):
+        if force or time.time() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Write changed peers to the Peers table"""
+        with self._lock:
+            rows = [tuple(self._peers[address][field] for field in FIELDS)
+                    for address in self._dirty if address in self._peers]
+            self._dirty.clear()
+            self._last_save = time.time()
+        if not rows:
+            return
+        try:
+            with db.transaction(self.path) as cursor:
+                cursor.executemany(f"INSERT OR REPLACE INTO Peers ({', '.join(FIELDS)}) "
+                                   f"VALUES ({', '.join('?' * len(FIELDS))})", rows)
+        except sqlite3.Error as e:
+            logging.error(f"Could not save peers: {e}")
+
+    def snapshot(self, now=None):
+        """Every peer's record, fastest of the available ones first"""
+        now = now or time.time()
+        with self._lock:
+            peers = [dict(peer) for peer in self._peers.values()]
+        for peer in peers:
+            peer['available'] = peer['backoff_until'] <= now
+            peer['backoff_seconds'] = max(0.0, peer['backoff_until'] - now)
+        peers.sort(key=lambda peer: (not peer['available'],
+                                     peer['latency'] if peer['latency'] is not None else float('inf'),
+                                     peer['address']))
+        return peers
+
+    def stats(self):
+        with self._lock:
+            known = len(self._peers)
+        return {'known': known, 'available': len(self.available())}
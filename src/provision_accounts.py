@@ -0,0 +1,62 @@
+"""
+Bulk account provisioning from the command line.
+
+Reads names one per line, either plain or NDJSON ("alice" or {"name": "alice"}),
+creates the accounts with account_manager.create_accounts and prints one
+NDJSON result per name.
+
+    python provision_accounts.py meters.txt
+    cat meters.ndjson | python provision_accounts.py - --workers 8
+"""
+import argparse
+import json
+import sys
+
+import account_manager
+import db
+
+
+def read_names(lines):
+    """Names from NDJSON or plain lines; blank lines are skipped"""
+    names = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            # Not JSON: the line is the name
+            item = line
+        names.append(item.get('name') if isinstance(item, dict) else item)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create many accounts at once')
+    parser.add_argument('file', help="File with one name per line, or '-' for stdin")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes generating key pairs (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=account_manager.BULK_INSERT_BATCH_SIZE,
+                        help='Accounts inserted per database transaction')
+    parser.add_argument('--db', default=db.DB_PATH, help='Database file')
+    args = parser.parse_args(argv)
+
+    db.DB_PATH = args.db
+    if args.file == '-':
+        names = read_names(sys.stdin)
+    else:
+        with open(args.file) as f:
+            names = read_names(f)
+
+    results = account_manager.create_accounts(names, args.workers, args.batch_size)
+    for result in results:
+        print(json.dumps(result))
+
+    created = sum(1 for result in results if result['status'] == 'created')
+    print(f"Created {created} of {len(results)} accounts", file=sys.stderr)
+    return 0 if created == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Balance accounting for chain reorganizations.
+
+Trades are settled against account balances when they are submitted, so the
+balances reflect every transaction this node knows of: those in its chain and
+those in its mempool. When a peer's branch replaces our blocks after the fork
+point:
+
+- transactions in both branches, or already in our mempool, change nothing;
+- new-branch transactions we never saw are applied;
+- orphaned transactions missing from the new branch go back to the mempool
+  and keep their effect;
+- if that leaves a local account below zero, because the new branch spent
+  the same funds, returned and pending transactions are dropped and undone,
+  newest first;
+- if the new branch overdraws an account even then, the reorg is rejected.
+
+Only the net change per account is written, so the cost grows with the depth
+of the fork rather than the length of the chain.
+"""
+from collections import namedtuple
+
+import hashing
+
+# Rounding slack when checking that balances stay non-negative
+EPSILON = 1e-9
+
+ReorgPlan = namedtuple('ReorgPlan', 'deltas mempool applied returned dropped')
+
+
+class Overdraft(ValueError):
+    """Raised when a branch would leave local accounts below zero"""
+
+
+def tx_hash(tx):
+    return tx.get('tx_hash') or hashing.hash_transaction(tx)
+
+
+def add_effect(deltas, tx, sign=1):
+    """
+    Add (sign times) a trade's effect to deltas, {name: [balance, power_balance]}:
+    the seller gains Power * Price ETH and gives Power kWh, the buyer the reverse.
+    """
+    power = float(tx['Power'])
+    cost = power * float(tx['Price'])
+    seller = deltas.setdefault(str(tx['Seller']), [0.0, 0.0])
+    seller[0] += sign * cost
+    seller[1] -= sign * power
+    buyer = deltas.setdefault(str(tx['Buyer']), [0.0, 0.0])
+    buyer[0] -= sign * cost
+    buyer[1] += sign * power
+
+
+def plan_reorg(orphaned, branch, mempool, balances):
+    """
+    The net balance changes and new mempool for replacing the `orphaned` blocks
+    with the `branch` blocks.
+
+    mempool is our pending transactions. balances(names) returns
+    {name: (balance, power_balance)} for those names that have accounts here;
+    trades with parties who have no local account only move the balances of
+    the parties who do.
+    """
+    branch_txs = [tx for block in branch for tx in block['transactions']]
+    orphaned_txs = [tx for block in orphaned for tx in block['transactions']]
+    branch_hashes = {tx_hash(tx) for tx in branch_txs}
+    mempool_hashes = {tx_hash(tx) for tx in mempool}
+    known = mempool_hashes | {tx_hash(tx) for tx in orphaned_txs}
+
+    deltas = {}
+    applied = []
+    for tx in branch_txs:
+        if tx_hash(tx) not in known:
+            add_effect(deltas, tx)
+            applied.append(tx)
+
+    returned = []
+    seen = set(branch_hashes | mempool_hashes)
+    for tx in orphaned_txs:
+        h = tx_hash(tx)
+        if h not in seen:
+            seen.add(h)
+            returned.append(tx)
+
+    # Drop returned and pending transactions whose funds the new branch spent
+    pending = [tx for tx in mempool if tx_hash(tx) not in branch_hashes]
+    names = set(deltas)
+    for tx in returned + pending:
+        names.update((str(tx['Seller']), str(tx['Buyer'])))
+    current = balances(names)
+
+    def negative(name):
+        if name not in current:
+            return False
+        delta = deltas.get(name, (0.0, 0.0))
+        return (current[name][0] + delta[0] < -EPSILON
+                or current[name][1] + delta[1] < -EPSILON)
+
+    dropped = []
+    for tx in reversed(returned + pending):
+        if negative(str(tx['Seller'])) or negative(str(tx['Buyer'])):
+            add_effect(deltas, tx, -1)
+            dropped.append(tx)
+    overdrawn = sorted(name for name in deltas if negative(name))
+    if overdrawn:
+        raise Overdraft(f"The new branch overdraws {', '.join(overdrawn)}")
+    dropped_hashes = {tx_hash(tx) for tx in dropped}
+    returned = [tx for tx in returned if tx_hash(tx) not in dropped_hashes]
+    pending = [tx for tx in pending if tx_hash(tx) not in dropped_hashes]
+
+    deltas = {name: tuple(delta) for name, delta in deltas.items()
+              if name in current and (abs(delta[0]) > EPSILON or abs(delta[1]) > EPSILON)}
+    return ReorgPlan(deltas, returned + pending, applied, returned, dropped[::-1])
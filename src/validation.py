@@ -0,0 +1,162 @@
+"""
+Block and chain validation.
+
+Recomputes every block's hash, Merkle root, difficulty and proof of work. Like
+mining.py it has no database side effects, so segments of a chain can be
+checked in worker processes.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import hashing
+import mining
+
+# Full re-verification splits the chain into segments of at least this many
+# blocks; shorter chains are checked in-process.
+MIN_SEGMENT_SIZE = 256
+
+
+def parse_timestamp(timestamp):
+    """Seconds since the epoch for a block timestamp (str(datetime.now()))"""
+    return datetime.fromisoformat(str(timestamp)).timestamp()
+
+
+def difficulty_activation(blocks, offset=0):
+    """
+    Height of the first of blocks to record its difficulty, or None.
+
+    blocks[i] is at chain position offset + i. Blocks before that height were
+    mined before difficulty was recorded, at the default.
+    """
+    for i, block in enumerate(blocks):
+        if 'difficulty' in block:
+            return offset + i + 1
+    return None
+
+
+def expected_difficulty(blocks, position, target_interval=None,
+                        window=mining.DEFAULT_RETARGET_WINDOW, height=None, activation=None):
+    """
+    Difficulty the retarget rule assigns to blocks[position].
+
+    height is the block's 1-based height in the chain and defaults to
+    position + 1; pass it when blocks is a slice of a longer chain. The slice
+    must include the `window` blocks before position (or start at genesis).
+    activation is the chain's difficulty_activation(): blocks up to it expect
+    the default, since the rule did not exist when they were mined.
+    """
+    if height is None:
+        height = position + 1
+    if activation is None or height <= activation:
+        return mining.DEFAULT_DIFFICULTY
+    parent = blocks[position - 1]
+    window_blocks = blocks[max(0, position - window):position]
+    return mining.retarget(height,
+                           parent.get('difficulty', mining.DEFAULT_DIFFICULTY),
+                           [parse_timestamp(block['timestamp']) for block in window_blocks],
+                           target_interval,
+                           window)
+
+
+def check_block(block, previous_block, difficulty=None):
+    """
+    Return None if block is valid on top of previous_block, else the reason.
+
+    previous_block is None for the genesis block, which only has its hash and
+    Merkle root checked. difficulty is what the retarget rule expects; a block
+    without a recorded difficulty counts as the default, so it is only valid
+    where the rule expects the default.
+    """
+    if hashing.hash_block(block) != block.get('block_hash'):
+        return f"Block {block.get('index')} hash does not match its contents"
+
+    if 'merkle_root' in block:
+        tx_hashes = [hashing.hash_transaction(tx) for tx in block.get('transactions', [])]
+        for tx, tx_hash in zip(block.get('transactions', []), tx_hashes):
+            if tx.get('tx_hash', tx_hash) != tx_hash:
+                return f"Block {block['index']} has a transaction with a wrong tx_hash"
+        if hashing.merkle_root(tx_hashes) != block['merkle_root']:
+            return f"Block {block['index']} Merkle root does not match its transactions"
+
+    if previous_block is None:
+        return None
+
+    if block['previous_hash'] != previous_block['block_hash']:
+        return f"Validation failed: {block['previous_hash']} != {previous_block['block_hash']}"
+    if block['index'] != previous_block['index'] + 1:
+        return f"Block {block['index']} does not follow block {previous_block['index']}"
+
+    # Leaving the field out must not dodge the check: the proof below is
+    # verified at whatever difficulty the block stands for
+    block_difficulty = block.get('difficulty', mining.DEFAULT_DIFFICULTY)
+    if difficulty is not None and block_difficulty != difficulty:
+        return f"Difficulty validation failed for block {block['index']}"
+
+    if not mining.valid_proof(previous_block['proof'], block['proof'], block_difficulty):
+        return f"Proof of work validation failed for block {block['index']}"
+    return None
+
+
+def validate_range(blocks, start, stop, target_interval=None,
+                   window=mining.DEFAULT_RETARGET_WINDOW, offset=0, activation=None):
+    """
+    Check blocks[start:stop], where blocks[i] is at chain position offset + i.
+
+    activation is the whole chain's difficulty_activation(); when blocks
+    starts at genesis it defaults to that of blocks. Returns None if they are
+    all valid, else (position, reason) for the first invalid block, with
+    position relative to the whole chain.
+    """
+    if activation is None and offset == 0:
+        activation = difficulty_activation(blocks)
+    for i in range(start, stop):
+        if offset + i == 0:
+            error = check_block(blocks[i], None)
+        else:
+            difficulty = expected_difficulty(blocks, i, target_interval, window,
+                                             height=offset + i + 1, activation=activation)
+            error = check_block(blocks[i], blocks[i - 1], difficulty)
+        if error:
+            return offset + i, error
+    return None
+
+
+def _validate_segment(args):
+    blocks, start, stop, target_interval, window, offset, activation = args
+    return validate_range(blocks, start, stop, target_interval, window, offset, activation)
+
+
+def _segment_args(chain, start, stop, target_interval, window, segments, activation):
+    """Split chain[start:stop] into slices that carry their own retarget context"""
+    size = -(-(stop - start) // segments)
+    args = []
+    for seg_start in range(start, stop, size):
+        seg_stop = min(seg_start + size, stop)
+        context_start = max(0, seg_start - max(window, 1))
+        blocks = list(chain[context_start:seg_stop])
+        args.append((blocks, seg_start - context_start, seg_stop - context_start,
+                     target_interval, window, context_start, activation))
+    return args
+
+
+def validate_chain_parallel(chain, target_interval=None, window=mining.DEFAULT_RETARGET_WINDOW,
+                            workers=None, start=0, activation=None):
+    """
+    Check chain[start:] split into segments across a process pool.
+
+    Returns None or (position, reason) for the earliest invalid block. Chains
+    too short to be worth splitting are checked in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    stop = len(chain)
+    if activation is None:
+        activation = difficulty_activation(chain)
+    segments = min(workers, max(1, (stop - start) // MIN_SEGMENT_SIZE))
+    if segments <= 1:
+        return validate_range(chain, start, stop, target_interval, window, activation=activation)
+
+    args = _segment_args(chain, start, stop, target_interval, window, segments, activation)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mining.mp_context()) as executor:
+        failures = [result for result in executor.map(_validate_segment, args) if result]
+    return min(failures) if failures else None
@@ -0,0 +1,307 @@
+"""
+Compact binary encoding of blocks, headers and transactions for peers.
+
+JSON repeats every account name, hash and timestamp as text. This format uses
+fixed-width numbers, 32 raw bytes per hex hash, timestamps as microseconds and
+a per-message string table, so each account name is sent once per message.
+Decoding gives back exactly the dicts that were encoded, so hashes still match.
+
+Peers ask for it with `Accept: application/vnd.p2p-energy.blocks`; JSON stays
+the default.
+
+    message      := magic "PW" | version u8 | kind u8 | string table | body
+    string table := count u32 | (length u32 | utf-8 bytes)*
+    chain body   := length u32 | from u32 | to u32 | headers_only u8 | count u32 | block*
+    txs body     := count u32 | transaction*
+"""
+import struct
+from datetime import datetime, timedelta
+
+CONTENT_TYPE = 'application/vnd.p2p-energy.blocks'
+
+# Accept header for peer requests: binary if the peer speaks it, else JSON
+ACCEPT = f'{CONTENT_TYPE}, application/json;q=0.9'
+
+MAGIC = b'PW'
+VERSION = 1
+
+CHAIN = 1
+TRANSACTIONS = 2
+
+BLOCK_FIELDS = {'index', 'timestamp', 'proof', 'previous_hash', 'block_hash',
+                'difficulty', 'merkle_root', 'transactions', 'transaction_count'}
+TRANSACTION_FIELDS = {'Seller', 'Buyer', 'Power', 'Price', 'transaction_timestamp', 'tx_hash'}
+
+# Block flags
+HAS_DIFFICULTY = 1
+HAS_MERKLE_ROOT = 2
+BLOCK_TIMESTAMP_STRING = 4
+PREVIOUS_HASH_STRING = 8
+BLOCK_HASH_STRING = 16
+MERKLE_ROOT_STRING = 32
+
+# Transaction flags
+HAS_TIMESTAMP = 1
+HAS_TX_HASH = 2
+POWER_INT = 4
+PRICE_INT = 8
+TX_TIMESTAMP_STRING = 16
+TX_HASH_STRING = 32
+
+# Integers a float64 holds exactly
+MAX_EXACT_INT = 2 ** 53
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NO_HASH = bytes(32)
+
+_U32 = struct.Struct('<I')
+_PREAMBLE = struct.Struct('<2sBB')
+_CHAIN_HEAD = struct.Struct('<IIIBI')
+# index, proof, difficulty, flags, timestamp, previous_hash, block_hash, merkle_root, transaction count
+_BLOCK = struct.Struct('<QqHBq32s32s32sI')
+# Seller, Buyer, Power, Price, flags, timestamp, tx_hash
+_TRANSACTION = struct.Struct('<IIddBq32s')
+
+
+class WireError(ValueError):
+    """Raised for values this format cannot carry and for malformed messages"""
+
+
+class _Writer:
+    """
+    Each block and transaction is one fixed-size record. Hashes that are not
+    64 lowercase hex digits and timestamps that are not str(datetime) go to
+    the string table instead, flagged, with their reference in the slot.
+    """
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+
+    def ref(self, value):
+        if not isinstance(value, str):
+            raise WireError(f"Expected a string, got {type(value).__name__}")
+        ref = self.strings.get(value)
+        if ref is None:
+            ref = self.strings[value] = len(self.strings)
+        return ref
+
+    def hash(self, value):
+        """(32-byte slot, stored as a string)"""
+        if isinstance(value, str) and len(value) == 64:
+            try:
+                raw = bytes.fromhex(value)
+            except ValueError:
+                raw = None
+            # Only lowercase hex comes back unchanged from bytes.hex()
+            if raw is not None and raw.hex() == value:
+                return raw, False
+        return _U32.pack(self.ref(value)) + bytes(28), True
+
+    def timestamp(self, value):
+        """(int64 slot, stored as a string)"""
+        try:
+            moment = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            moment = None
+        if moment is not None and moment.tzinfo is None and str(moment) == value:
+            return (moment - _EPOCH) // _MICROSECOND, False
+        return self.ref(value), True
+
+    @staticmethod
+    def number(value):
+        """(float64, was an int)"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise WireError(f"Expected a number, got {value!r}")
+        if isinstance(value, float):
+            return value, False
+        if abs(value) > MAX_EXACT_INT:
+            raise WireError(f"{value} does not fit a float64 exactly")
+        return float(value), True
+
+    def transactions(self, transactions):
+        # The common case (float amounts, known names) is inlined: this loop
+        # dominates encoding time
+        strings, out, pack = self.strings, self.out, _TRANSACTION.pack
+        for tx in transactions:
+            if not TRANSACTION_FIELDS.issuperset(tx):
+                extra = set(tx) - TRANSACTION_FIELDS
+                raise WireError(f"Transaction fields {sorted(extra)} cannot be encoded")
+            seller = strings.get(tx['Seller'])
+            if seller is None:
+                seller = self.ref(tx['Seller'])
+            buyer = strings.get(tx['Buyer'])
+            if buyer is None:
+                buyer = self.ref(tx['Buyer'])
+            power, price, flags = tx['Power'], tx['Price'], 0
+            if type(power) is not float:
+                power, as_int = self.number(power)
+                flags |= POWER_INT if as_int else 0
+            if type(price) is not float:
+                price, as_int = self.number(price)
+                flags |= PRICE_INT if as_int else 0
+            timestamp, tx_hash = 0, _NO_HASH
+            if 'transaction_timestamp' in tx:
+                timestamp, as_string = self.timestamp(tx['transaction_timestamp'])
+                flags |= HAS_TIMESTAMP | (TX_TIMESTAMP_STRING if as_string else 0)
+            if 'tx_hash' in tx:
+                tx_hash, as_string = self.hash(tx['tx_hash'])
+                flags |= HAS_TX_HASH | (TX_HASH_STRING if as_string else 0)
+            out += pack(seller, buyer, power, price, flags, timestamp, tx_hash)
+
+    def block(self, block, headers_only):
+        extra = set(block) - BLOCK_FIELDS
+        if extra:
+            raise WireError(f"Block fields {sorted(extra)} cannot be encoded")
+        timestamp, timestamp_string = self.timestamp(block['timestamp'])
+        previous_hash, previous_string = self.hash(block['previous_hash'])
+        block_hash, block_hash_string = self.hash(block['block_hash'])
+        flags = ((BLOCK_TIMESTAMP_STRING if timestamp_string else 0)
+                 | (PREVIOUS_HASH_STRING if previous_string else 0)
+                 | (BLOCK_HASH_STRING if block_hash_string else 0))
+        merkle_root = _NO_HASH
+        if 'merkle_root' in block:
+            merkle_root, as_string = self.hash(block['merkle_root'])
+            flags |= HAS_MERKLE_ROOT | (MERKLE_ROOT_STRING if as_string else 0)
+        if 'difficulty' in block:
+            flags |= HAS_DIFFICULTY
+        count = block['transaction_count'] if headers_only else len(block['transactions'])
+        self.out += _BLOCK.pack(block['index'], block['proof'], block.get('difficulty', 0), flags,
+                                timestamp, previous_hash, block_hash, merkle_root, count)
+        if not headers_only:
+            self.transactions(block['transactions'])
+
+    def message(self, kind, head=b''):
+        table = bytearray(_U32.pack(len(self.strings)))
+        for value in self.strings:
+            data = value.encode()
+            table += _U32.pack(len(data)) + data
+        return _PREAMBLE.pack(MAGIC, VERSION, kind) + bytes(table) + head + bytes(self.out)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+        magic, version, self.kind = self.unpack(_PREAMBLE)
+        if magic != MAGIC or version != VERSION:
+            raise WireError("Not a version 1 wire message")
+        count = self.unpack(_U32)[0]
+        self.strings = []
+        for _ in range(count):
+            size = self.unpack(_U32)[0]
+            if self.pos + size > len(self.data):
+                raise WireError("Truncated wire message")
+            try:
+                self.strings.append(bytes(self.data[self.pos:self.pos + size]).decode())
+            except UnicodeDecodeError as e:
+                raise WireError(f"String {len(self.strings)} is not valid UTF-8: {e}")
+            self.pos += size
+
+    def unpack(self, layout):
+        try:
+            values = layout.unpack_from(self.data, self.pos)
+        except struct.error as e:
+            raise WireError(f"Truncated wire message: {e}")
+        self.pos += layout.size
+        return values
+
+    def string(self, ref):
+        # Timestamp slots are signed; a negative ref must not index from the end
+        if not 0 <= ref < len(self.strings):
+            raise WireError(f"String {ref} is not in the message's table")
+        return self.strings[ref]
+
+    def hash(self, slot, as_string):
+        if as_string:
+            return self.string(_U32.unpack_from(slot)[0])
+        return slot.hex()
+
+    def timestamp(self, slot, as_string):
+        if as_string:
+            return self.string(slot)
+        try:
+            return str(_EPOCH + slot * _MICROSECOND)
+        except OverflowError:
+            raise WireError(f"Timestamp {slot} is out of range")
+
+    def transactions(self, count):
+        transactions = []
+        strings = self.strings
+        epoch, microsecond = _EPOCH, _MICROSECOND
+        try:
+            records = _TRANSACTION.iter_unpack(self.data[self.pos:self.pos + count * _TRANSACTION.size])
+            for seller, buyer, power, price, flags, timestamp, tx_hash in records:
+                tx = {'Seller': strings[seller], 'Buyer': strings[buyer],
+                      'Power': int(power) if flags & POWER_INT else power,
+                      'Price': int(price) if flags & PRICE_INT else price}
+                if flags & HAS_TIMESTAMP:
+                    tx['transaction_timestamp'] = (self.string(timestamp) if flags & TX_TIMESTAMP_STRING
+                                                   else str(epoch + timestamp * microsecond))
+                if flags & HAS_TX_HASH:
+                    tx['tx_hash'] = self.hash(tx_hash, True) if flags & TX_HASH_STRING else tx_hash.hex()
+                transactions.append(tx)
+        except struct.error as e:
+            raise WireError(f"Truncated wire message: {e}")
+        except IndexError:
+            raise WireError("Transaction refers to a string not in the message's table")
+        except OverflowError:
+            raise WireError("Transaction timestamp is out of range")
+        if len(transactions) != count:
+            raise WireError("Truncated wire message")
+        self.pos += count * _TRANSACTION.size
+        return transactions
+
+    def block(self, headers_only):
+        (index, proof, difficulty, flags, timestamp, previous_hash, block_hash,
+         merkle_root, count) = self.unpack(_BLOCK)
+        block = {'index': index, 'proof': proof,
+                 'timestamp': self.timestamp(timestamp, flags & BLOCK_TIMESTAMP_STRING),
+                 'previous_hash': self.hash(previous_hash, flags & PREVIOUS_HASH_STRING),
+                 'block_hash': self.hash(block_hash, flags & BLOCK_HASH_STRING)}
+        if flags & HAS_DIFFICULTY:
+            block['difficulty'] = difficulty
+        if flags & HAS_MERKLE_ROOT:
+            block['merkle_root'] = self.hash(merkle_root, flags & MERKLE_ROOT_STRING)
+        if headers_only:
+            block['transaction_count'] = count
+        else:
+            block['transactions'] = self.transactions(count)
+        return block
+
+
+def encode_chain(blocks, length, first, last, headers_only=False):
+    """A /chain body ({"chain", "length", "from", "to"}) in the wire format"""
+    writer = _Writer()
+    count = 0
+    try:
+        for block in blocks:
+            writer.block(block, headers_only)
+            count += 1
+    except (KeyError, TypeError, struct.error) as e:
+        raise WireError(f"Block cannot be encoded: {e!r}")
+    return writer.message(CHAIN, _CHAIN_HEAD.pack(length, first, last, int(headers_only), count))
+
+
+def encode_transactions(transactions):
+    """A {"transactions": [...]} body in the wire format"""
+    writer = _Writer()
+    try:
+        transactions = list(transactions)
+        writer.transactions(transactions)
+        count = len(transactions)
+    except (KeyError, TypeError, struct.error) as e:
+        raise WireError(f"Transaction cannot be encoded: {e!r}")
+    return writer.message(TRANSACTIONS, _U32.pack(count))
+
+
+def decode(data):
+    """The dict a wire message encodes, as its JSON counterpart would parse"""
+    reader = _Reader(data)
+    if reader.kind == CHAIN:
+        length, first, last, headers_only, count = reader.unpack(_CHAIN_HEAD)
+        chain = [reader.block(headers_only) for _ in range(count)]
+        return {'chain': chain, 'length': length, 'from': first, 'to': last}
+    if reader.kind == TRANSACTIONS:
+        return {'transactions': reader.transactions(reader.unpack(_U32)[0])}
+    raise WireError(f"Unknown wire message kind {reader.kind}")
@@ -4,18 +4,39 @@ Tests core blockchain functionality including block creation, validation, and tr
 """
 
 import unittest
+import json
 import sys
 import os
 import tempfile
 import shutil
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from Blockchain import Blockchain, log_change
+import account_cache
+import chain_responses
+import chain_sync
 import account_manager
+import cluster
+import db
+import gossip
+import hashing
+import key_pool
+import main
+import mining
+import peers
+import provision_accounts
+import reorg
+import validation
+import wire
+from mining_jobs import MiningJobManager
+from unittest import mock
+import requests
 
 def create_test_tables():
     """Helper function to create database tables for testing"""
@@ -138,6 +159,137 @@ class TestBlockchain(unittest.TestCase):
         this_proof_hash = __import__('hashlib').sha256(proof_hash).hexdigest()
         self.assertEqual(this_proof_hash[:4], '0000')
     
+    def test_byte_level_proof_check_matches_hex_check(self):
+        """Test that the mining kernel accepts exactly the hex-prefix proofs"""
+        import hashlib
+        for last_proof in (100, 1000, 35293):
+            hex_valid = [proof for proof in range(200000)
+                         if hashlib.sha256(f'{proof}{last_proof}'.encode()).hexdigest()[:4] == '0000']
+            kernel_valid = []
+            start = 0
+            while True:
+                proof = mining.search_range(last_proof, start, 200000)
+                if proof is None:
+                    break
+                kernel_valid.append(proof)
+                start = proof + 1
+            
+            self.assertTrue(hex_valid)
+            self.assertEqual(kernel_valid, hex_valid)
+            self.assertTrue(all(Blockchain.valid_proof(last_proof, p) for p in hex_valid))
+    
+    def test_parallel_proof_of_work(self):
+        """Test that the process pool finds the same proof as a single process"""
+        last_proof = self.blockchain.last_block['proof']
+        expected = mining.proof_of_work(last_proof)
+        
+        miner = mining.ParallelMiner(workers=2, chunk_size=512)
+        try:
+            self.assertEqual(miner.search(last_proof), expected)
+            # The pool is reused across searches
+            self.assertEqual(miner.search(expected), mining.proof_of_work(expected))
+        finally:
+            miner.close()
+    
+    def test_proof_of_work_single_process_fallback(self):
+        """Test that one worker mines without a process pool"""
+        last_proof = self.blockchain.last_block['proof']
+        proof = mining.parallel_proof_of_work(last_proof, workers=1)
+        
+        self.assertTrue(Blockchain.valid_proof(last_proof, proof))
+        self.assertEqual(self.blockchain.proof_of_work(last_proof), proof)
+        self.assertIsNone(self.blockchain._miner)
+    
+    def test_retarget_rule(self):
+        """Test that difficulty moves toward the target interval on window boundaries"""
+        fast = [0.0, 0.1, 0.2, 0.3]
+        slow = [0.0, 40.0, 80.0, 120.0]
+        
+        # Blocks 10x faster than the target: +2 bits (capped step)
+        self.assertEqual(mining.retarget(5, 16, fast, target_interval=1.0, window=4), 18)
+        # Blocks 4x slower than the target: -2 bits
+        self.assertEqual(mining.retarget(5, 16, slow, target_interval=10.0, window=4), 14)
+        # Only every window-th block retargets
+        self.assertEqual(mining.retarget(6, 16, fast, target_interval=1.0, window=4), 16)
+        # No target interval keeps the difficulty fixed
+        self.assertEqual(mining.retarget(5, 16, fast, target_interval=None, window=4), 16)
+        # Results stay within bounds
+        self.assertEqual(mining.retarget(5, mining.MAX_DIFFICULTY, fast, 1.0, window=4),
+                         mining.MAX_DIFFICULTY)
+        self.assertEqual(mining.retarget(5, mining.MIN_DIFFICULTY, slow, 10.0, window=4),
+                         mining.MIN_DIFFICULTY)
+    
+    def test_difficulty_retargeting(self):
+        """Test that fast blocks raise the recorded difficulty and validation enforces it"""
+        self.blockchain.conn.close()
+        self.blockchain = Blockchain(reset_chain=True, target_block_interval=60.0, retarget_window=2)
+        for _ in range(3):
+            last_block = self.blockchain.last_block
+            proof = self.blockchain.proof_of_work(last_block['proof'])
+            self.blockchain.new_block(proof, last_block['block_hash'])
+        
+        difficulties = [block['difficulty'] for block in self.blockchain.chain]
+        self.assertEqual(difficulties, [16, 16, 18, 18])
+        self.assertTrue(self.blockchain.validate_chain())
+        
+        # Difficulty is persisted with each block
+        reloaded = Blockchain(target_block_interval=60.0, retarget_window=2)
+        self.assertEqual([block['difficulty'] for block in reloaded.chain], difficulties)
+        self.assertTrue(reloaded.validate_chain())
+        reloaded.conn.close()
+        
+        # A block claiming a lower difficulty than the rule assigns is rejected
+        block = dict(self.blockchain.chain[3], difficulty=16)
+        block['block_hash'] = self.blockchain.hash(block)
+        self.blockchain.chain[3] = block
+        self.assertFalse(self.blockchain.validate_chain(full=True))
+
+        # So is one that leaves the difficulty out and only meets the default
+        forged = {key: value for key, value in self.blockchain.chain[3].items() if key != 'difficulty'}
+        forged['proof'] = mining.proof_of_work(self.blockchain.chain[2]['proof'],
+                                               difficulty=mining.DEFAULT_DIFFICULTY)
+        forged['block_hash'] = self.blockchain.hash(forged)
+        self.assertFalse(self.blockchain.valid_chain(self.blockchain.chain[:3] + [forged]))
+
+    def test_retargeting_accepts_legacy_chain(self):
+        """Test that blocks mined before difficulty was recorded validate with retargeting enabled"""
+        # Twelve blocks a second apart, hashed and mined the way the baseline did
+        self.blockchain.cursor.execute("DELETE FROM Blockchain")
+        self.blockchain.conn.commit()
+        started = datetime(2024, 1, 1)
+        legacy = []
+        previous_hash, proof = '1', 1000
+        for i in range(12):
+            if legacy:
+                proof = mining.proof_of_work(proof, difficulty=mining.DEFAULT_DIFFICULTY)
+            block = {'index': i + 1, 'timestamp': str(started + timedelta(seconds=i)), 'transactions': [],
+                     'proof': proof, 'previous_hash': previous_hash}
+            block['block_hash'] = previous_hash = hashing.hash_block(block)
+            Blockchain._insert_block(self.blockchain.cursor, block)
+            legacy.append(block)
+        self.blockchain.conn.commit()
+        self.blockchain.conn.close()
+        
+        self.blockchain = Blockchain(target_block_interval=60.0, retarget_window=2)
+        self.assertEqual(list(self.blockchain.chain), legacy)
+        self.assertTrue(self.blockchain.validate_chain(full=True))
+        self.assertTrue(self.blockchain.valid_chain(legacy))
+        
+        # Retargeting starts from the first block that records its difficulty
+        for _ in range(3):
+            last_block = self.blockchain.last_block
+            self.blockchain.new_block(self.blockchain.proof_of_work(last_block['proof']))
+        self.assertEqual([block['difficulty'] for block in self.blockchain.chain[12:]],
+                         [mining.DEFAULT_DIFFICULTY, mining.DEFAULT_DIFFICULTY, mining.DEFAULT_DIFFICULTY + 2])
+        self.assertTrue(self.blockchain.validate_chain(full=True))
+        
+        # After that, a block leaving its difficulty out is still checked against the rule
+        forged = {key: value for key, value in self.blockchain.chain[14].items() if key != 'difficulty'}
+        forged['proof'] = mining.proof_of_work(self.blockchain.chain[13]['proof'],
+                                               difficulty=mining.DEFAULT_DIFFICULTY)
+        forged['block_hash'] = self.blockchain.hash(forged)
+        self.assertFalse(self.blockchain.valid_chain(list(self.blockchain.chain[:14]) + [forged]))
+    
     def test_blockchain_validation_valid_chain(self):
         """Test validation of a valid blockchain"""
         # Mine two more blocks
@@ -150,6 +302,617 @@ class TestBlockchain(unittest.TestCase):
         # Validate the chain
         self.assertTrue(self.blockchain.validate_chain())
     
+    def mine_blocks(self, count):
+        for i in range(count):
+            self.blockchain.new_transaction_seller("Alice", "Bob", 10.0 + i, 0.001)
+            last_block = self.blockchain.last_block
+            self.blockchain.new_block(self.blockchain.proof_of_work(last_block['proof']))
+    
+    def test_validation_detects_tampered_body(self):
+        """Test that validation recomputes hashes and Merkle roots"""
+        self.mine_blocks(2)
+        self.blockchain.chain[1]['transactions'][0]['Power'] = 1000.0
+        self.assertFalse(self.blockchain.validate_chain())
+        
+        self.blockchain.chain[1]['transactions'][0]['Power'] = 10.0
+        self.blockchain.chain[2]['proof'] += 1
+        self.assertFalse(self.blockchain.validate_chain())
+    
+    def test_validation_checkpoint(self):
+        """Test that validation only re-checks blocks above the verified checkpoint"""
+        self.mine_blocks(3)
+        self.assertTrue(self.blockchain.validate_chain())
+        self.assertEqual(self.blockchain._checkpoint_height(self.blockchain.chain), 4)
+        
+        self.mine_blocks(1)
+        with mock.patch.object(validation, 'validate_range', wraps=validation.validate_range) as check:
+            self.assertTrue(self.blockchain.validate_chain())
+        self.assertEqual(check.call_args.args[1:3], (4, 5))
+        
+        # The checkpoint is kept in the database
+        reloaded = Blockchain()
+        self.assertEqual(reloaded._checkpoint_height(reloaded.chain), 5)
+        reloaded.conn.close()
+        
+        # Blocks below the checkpoint are trusted until a full re-verify
+        self.blockchain.chain[2]['transactions'][0]['Price'] = 0.0
+        self.assertTrue(self.blockchain.validate_chain())
+        self.assertFalse(self.blockchain.validate_chain(full=True))
+    
+    def test_parallel_full_validation(self):
+        """Test that a full re-verify checks chain segments in worker processes"""
+        self.mine_blocks(5)
+        with mock.patch.object(validation, 'MIN_SEGMENT_SIZE', 2):
+            self.assertTrue(self.blockchain.validate_chain(full=True, workers=2))
+            
+            self.blockchain.chain[4]['transactions'][0]['Seller'] = "Mallory"
+            self.blockchain.chain[1]['transactions'][0]['Seller'] = "Mallory"
+            failure = validation.validate_chain_parallel(self.blockchain.chain, workers=2)
+            self.assertEqual(failure[0], 1)
+            self.assertFalse(self.blockchain.validate_chain(full=True, workers=2))
+    
+    def test_streaming_loader(self):
+        """Test that the single-query loader rebuilds blocks with and without transactions"""
+        self.mine_blocks(2)
+        last_block = self.blockchain.last_block
+        self.blockchain.new_block(self.blockchain.proof_of_work(last_block['proof']))
+        for i in range(3):
+            self.blockchain.new_transaction_seller("Carol", "Dave", 1.0 + i, 0.002)
+        self.mine_blocks(1)
+        self.blockchain.new_transaction_seller("Erin", "Frank", 2.0, 0.003)
+        
+        reloaded = Blockchain()
+        self.assertEqual(reloaded.chain, self.blockchain.chain)
+        self.assertEqual([len(block['transactions']) for block in reloaded.chain], [0, 1, 1, 0, 4])
+        self.assertEqual(reloaded.current_transactions, [])
+        self.assertEqual(reloaded.load_stats['blocks'], 5)
+        self.assertTrue(reloaded.validate_chain(full=True))
+        reloaded.conn.close()
+    
+    def test_new_transactions_batch(self):
+        """Test that a batch of trades is queued in order with distinct hashes"""
+        trades = [("Alice", "Bob", 5.0, 0.1)] * 3 + [("Bob", "Carol", 1.0, 0.2)]
+        transactions = self.blockchain.new_transactions(trades)
+        
+        self.assertEqual(self.blockchain.current_transactions, transactions)
+        self.assertEqual([tx['Buyer'] for tx in transactions], ["Bob", "Bob", "Bob", "Carol"])
+        self.assertEqual(len({tx['tx_hash'] for tx in transactions}), 4)
+        
+        block = self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        self.assertEqual([tx['tx_hash'] for tx in block['transactions']],
+                         [tx['tx_hash'] for tx in transactions])
+    
+    def test_chain_response_cache(self):
+        """Test cached block serialization and shared response builds"""
+        self.mine_blocks(3)
+        cache = chain_responses.ChainResponseCache()
+        chain = list(self.blockchain.chain)
+        
+        body = cache.chain_body(chain, len(chain), 1, len(chain))
+        self.assertEqual(json.loads(body), {'chain': chain, 'length': 4, 'from': 1, 'to': 4})
+        headers = json.loads(cache.chain_body(chain, len(chain), 1, len(chain), headers_only=True))
+        self.assertNotIn('transactions', headers['chain'][0])
+        self.assertEqual(headers['chain'][0]['transaction_count'], 0)
+        cache.chain_body(chain, len(chain), 1, len(chain))
+        self.assertEqual(cache.block_hits, 4)
+        
+        # Concurrent renders of one key share a single build
+        started, release = threading.Event(), threading.Event()
+        builds = []
+        def build():
+            builds.append(1)
+            started.set()
+            release.wait(5)
+            return b'body'
+        results = []
+        key = ('tip-1', 1, 'query')
+        threads = [threading.Thread(target=lambda: results.append(cache.render(key, build)))
+                   for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [b'body'] * 3)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(cache.render(key, build), b'body')
+        self.assertEqual(len(builds), 1)
+        
+        # A response for a newer tip drops those for older tips, but a late
+        # build for an older tip does not drop the newer ones
+        cache.render(key + ('gzip',), lambda: b'zipped')
+        cache.render(('tip-2', 2, 'query'), lambda: b'newer')
+        cache.render(('tip-1', 1, 'other'), lambda: b'late')
+        self.assertEqual(list(cache._responses), [('tip-2', 2, 'query'), ('tip-1', 1, 'other')])
+        self.assertEqual(cache.stats()['cached_response_bytes'], len(b'newer') + len(b'late'))
+        
+        # Cached responses stay within the byte budget
+        cache = chain_responses.ChainResponseCache(max_response_bytes=10)
+        for query in ('a', 'b', 'c'):
+            cache.render(('tip', 1, query), lambda: b'x' * 4)
+        cache.render(('tip', 1, 'huge'), lambda: b'x' * 11)
+        self.assertEqual(list(cache._responses), [('tip', 1, 'b'), ('tip', 1, 'c')])
+        self.assertEqual(cache.stats()['cached_response_bytes'], 8)
+    
+    def peer_responses(self, chains, delay=0.0, requests_seen=None):
+        """Fake session.get serving each node's chain like GET /chain, or raising for unknown nodes"""
+        def get(url, params=None, timeout=None, headers=None):
+            time.sleep(delay)
+            node = url.split('/')[2]
+            if node not in chains:
+                raise requests.exceptions.ConnectionError(f"{node} unreachable")
+            if requests_seen is not None:
+                requests_seen.append(dict(params or {}))
+            chain = chains[node]
+            first = int((params or {}).get('from', 1))
+            last = min(int((params or {}).get('to', len(chain))), len(chain))
+            blocks = chain[first - 1:last]
+            if (params or {}).get('headers'):
+                blocks = [chain_responses.header_view(block) for block in blocks]
+            response = mock.Mock()
+            response.json.return_value = {'chain': blocks, 'length': len(chain), 'from': first, 'to': last}
+            return response
+        return get
+    
+    def test_resolve_conflicts(self):
+        """Test that the longest valid peer chain wins and bad peers are skipped"""
+        self.mine_blocks(3)
+        longest = list(self.blockchain.chain)
+        tampered = [dict(block) for block in longest] + [dict(longest[-1], index=5)]
+        self.blockchain.chain = longest[:2]
+        
+        for node in ('good:5000', 'bad:5000', 'down:5000'):
+            self.blockchain.register_node(f'http://{node}')
+        chains = {'good:5000': longest, 'bad:5000': tampered}
+        with mock.patch.object(self.blockchain._session(), 'get', self.peer_responses(chains)):
+            self.assertTrue(self.blockchain.resolve_conflicts())
+        self.assertEqual([block['block_hash'] for block in self.blockchain.chain],
+                         [block['block_hash'] for block in longest])
+    
+    def test_resolve_conflicts_queries_peers_concurrently(self):
+        """Test that resolution time does not grow with the number of peers"""
+        nodes = [f'peer{i}:5000' for i in range(4)]
+        for node in nodes:
+            self.blockchain.register_node(f'http://{node}')
+        chains = {node: list(self.blockchain.chain) for node in nodes}
+        
+        started = time.time()
+        with mock.patch.object(self.blockchain._session(), 'get', self.peer_responses(chains, delay=0.3)):
+            self.assertFalse(self.blockchain.resolve_conflicts())
+        self.assertLess(time.time() - started, 0.9)
+
+    def test_peer_table_backs_off_and_prefers_fast_peers(self):
+        """Test that failing peers are skipped, the fastest of the tallest is synced from, and health persists"""
+        self.mine_blocks(2)
+        longest = list(self.blockchain.chain)
+        self.blockchain.chain = longest[:1]
+        for node in ('http://Slow:5000/', 'slow:5000', 'fast:5000', 'down:5000', 'short:5000'):
+            self.blockchain.register_node(node)
+        self.assertEqual(sorted(self.blockchain.nodes), ['down:5000', 'fast:5000', 'short:5000', 'slow:5000'])
+        with self.assertRaises(ValueError):
+            self.blockchain.register_node('http://')
+        self.blockchain.nodes.record_success('slow:5000', 1.0)
+        self.blockchain.nodes.record_success('fast:5000', 0.01)
+
+        chains = {'slow:5000': longest, 'fast:5000': longest, 'short:5000': longest[:1]}
+        contacted = []
+        get = self.peer_responses(chains)
+        def tracking_get(url, params=None, timeout=None, headers=None):
+            contacted.append(url.split('/')[2])
+            return get(url, params, timeout, headers)
+        with mock.patch.object(self.blockchain._session(), 'get', tracking_get), \
+                mock.patch.object(self.blockchain, 'sync_from', wraps=self.blockchain.sync_from) as sync_from:
+            self.assertTrue(self.blockchain.resolve_conflicts())
+            self.assertEqual(sync_from.call_args_list[0].args[0], 'fast:5000')
+            contacted.clear()
+            self.assertFalse(self.blockchain.resolve_conflicts())
+        self.assertNotIn('down:5000', contacted)
+        self.assertNotIn('down:5000', self.blockchain.nodes.available())
+
+        self.blockchain.nodes.save()
+        restored = {peer['address']: peer for peer in peers.PeerTable().snapshot()}
+        self.assertEqual((restored['down:5000']['failures'], restored['down:5000']['available']), (1, False))
+        self.assertEqual(restored['fast:5000']['height'], 3)
+        self.assertLess(restored['fast:5000']['latency'], restored['slow:5000']['latency'])
+
+    def test_sync_from_fork_point(self):
+        """Test that only blocks after the fork are fetched and the new branch is persisted"""
+        self.mine_blocks(5)
+        peer_chain = list(self.blockchain.chain)
+        
+        # Fork our chain after height 3 with a different block
+        self.blockchain.cursor.execute("DELETE FROM Blockchain WHERE block_index > 3")
+        self.blockchain.conn.commit()
+        self.blockchain.chain = peer_chain[:3]
+        self.blockchain.new_transaction_seller("Carol", "Dave", 1.0, 0.001)
+        self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        self.assertNotEqual(self.blockchain.chain[3]['block_hash'], peer_chain[3]['block_hash'])
+        
+        seen = []
+        with mock.patch.object(self.blockchain._session(), 'get',
+                               self.peer_responses({'peer:5000': peer_chain}, requests_seen=seen)):
+            self.assertEqual(self.blockchain.sync_from('peer:5000'), 1)
+        self.assertEqual([block['block_hash'] for block in self.blockchain.chain],
+                         [block['block_hash'] for block in peer_chain])
+        full_requests = [params for params in seen if not params.get('headers')]
+        self.assertEqual(full_requests, [{'from': 4, 'to': 6}])
+        
+        # The branch survives a restart
+        reloaded = Blockchain()
+        self.assertEqual(list(reloaded.chain), list(self.blockchain.chain))
+        self.assertTrue(reloaded.validate_chain(full=True))
+        reloaded.conn.close()
+        
+        # Older peers that ignore ranges still work
+        legacy = chain_sync.PeerChain(lambda params: {'chain': peer_chain, 'length': len(peer_chain)})
+        self.assertEqual(legacy.blocks(5, 6), peer_chain[4:6])
+    
+    def test_reorg_moves_balances_and_mempool(self):
+        """Test that a reorg undoes orphaned trades the new branch conflicts with and applies unseen ones"""
+        def trade(seller, buyer, power):
+            tx = {'Seller': seller, 'Buyer': buyer, 'Power': power, 'Price': 0.5,
+                  'transaction_timestamp': str(datetime.now())}
+            tx['tx_hash'] = hashing.hash_transaction(tx)
+            time.sleep(0.001)
+            return tx
+        
+        def mine(transactions):
+            self.blockchain.current_transactions = list(transactions)
+            self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        
+        shared, ours, theirs = trade("Alice", "Bob", 1.0), trade("Alice", "Bob", 10.0), trade("Alice", "Bob", 20.0)
+        self.mine_blocks(1)
+        mine([shared, theirs])
+        mine([])
+        peer_chain = list(self.blockchain.chain)
+        
+        # Our branch mined `shared` and `ours`, both settled when submitted
+        self.blockchain.cursor.execute("DELETE FROM Blockchain WHERE block_index > 2")
+        self.blockchain.conn.commit()
+        self.blockchain.chain = peer_chain[:2]
+        mine([shared, ours])
+        with db.transaction() as cursor:
+            cursor.executemany("INSERT INTO accounts (id, name, balance, power_balance) VALUES (?, ?, ?, ?)",
+                               [('a', 'Alice', 5.5, 14.0), ('b', 'Bob', 94.5, 11.0)])
+        self.assertEqual(account_manager.get_account("Alice")['power_balance'], 14.0)
+        
+        # `theirs` spends power `ours` used, so `ours` is dropped rather than returned
+        with mock.patch.object(self.blockchain._session(), 'get',
+                               self.peer_responses({'peer:5000': peer_chain})):
+            self.assertEqual(self.blockchain.sync_from('peer:5000'), 1)
+        alice, bob = account_manager.get_account("Alice"), account_manager.get_account("Bob")
+        self.assertEqual((alice['balance'], alice['power_balance']), (10.5, 4.0))
+        self.assertEqual((bob['balance'], bob['power_balance']), (89.5, 21.0))
+        self.assertEqual(self.blockchain.current_transactions, [])
+        
+        # Without the conflict the orphaned trade goes back to the mempool
+        plan = reorg.plan_reorg([{'transactions': [shared, ours]}], [{'transactions': [shared]}], [],
+                                lambda names: {'Alice': (0.0, 100.0), 'Bob': (100.0, 0.0)})
+        self.assertEqual(plan.mempool, [ours])
+        self.assertEqual(plan.deltas, {})
+
+        # A pending trade the branch conflicts with is dropped too; one the
+        # branch overdraws on its own rejects the branch
+        pending = trade("Alice", "Bob", 10.0)
+        plan = reorg.plan_reorg([], [{'transactions': [theirs]}], [pending],
+                                lambda names: {'Alice': (10.0, 15.0), 'Bob': (90.0, 10.0)})
+        self.assertEqual((plan.dropped, plan.mempool), ([pending], []))
+        with self.assertRaises(reorg.Overdraft):
+            reorg.plan_reorg([], [{'transactions': [theirs]}], [],
+                             lambda names: {'Alice': (10.0, 15.0), 'Bob': (90.0, 10.0)})
+
+        # A longer branch that overdraws a local account is not adopted
+        mine([trade("Alice", "Bob", 50.0)])
+        overdrawing = list(self.blockchain.chain)
+        self.blockchain.cursor.execute("DELETE FROM Blockchain WHERE block_index > 4")
+        self.blockchain.conn.commit()
+        self.blockchain.chain = overdrawing[:4]
+        with mock.patch.object(self.blockchain._session(), 'get',
+                               self.peer_responses({'peer:5000': overdrawing})):
+            self.assertIsNone(self.blockchain.sync_from('peer:5000'))
+        self.assertEqual(len(self.blockchain.chain), 4)
+        self.assertEqual(account_manager.get_account("Alice")['power_balance'], 4.0)
+
+    def test_gossip_batches_announcements_with_bounded_fanout(self):
+        """Test that announcements made together go out as one message to at most `fanout` peers"""
+        for i in range(6):
+            self.blockchain.register_node(f'http://peer{i}:5000')
+        sent = []
+        def post(url, json=None, timeout=None):
+            sent.append((url.split('/')[2], json))
+            return mock.Mock()
+        
+        self.blockchain.gossip = gossip.Gossip(self.blockchain, 'me:5000', fanout=3, flush_interval=0.5)
+        with mock.patch.object(self.blockchain._session(), 'post', post):
+            self.blockchain.gossip.start()
+            self.mine_blocks(2)
+            deadline = time.time() + 5
+            while len(sent) < 3 and time.time() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.1)
+            self.blockchain.gossip.close()
+        
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(len({node for node, _ in sent}), 3)
+        message = sent[0][1]
+        self.assertEqual(message['sender'], 'me:5000')
+        self.assertEqual([header['block_hash'] for header in message['blocks']],
+                         [self.blockchain.last_block['block_hash']])
+        self.assertEqual(len(message['transactions']), 2)
+    
+    def test_gossip_fetches_only_unseen(self):
+        """Test that receivers fetch unseen transactions and blocks once, then relay them onwards"""
+        self.mine_blocks(2)
+        peer_chain = list(self.blockchain.chain)
+        self.blockchain.cursor.execute("DELETE FROM Blockchain WHERE block_index > 1")
+        self.blockchain.conn.commit()
+        self.blockchain.chain = peer_chain[:1]
+        for node in ('peer:5000', 'other:5000'):
+            self.blockchain.register_node(f'http://{node}')
+        with db.transaction() as cursor:
+            cursor.executemany("INSERT INTO accounts (id, name, balance, power_balance) VALUES (?, ?, ?, ?)",
+                               [('c', 'Carol', 0.0, 5.0), ('d', 'Dave', 1.0, 0.0)])
+        
+        tx = {'Seller': 'Carol', 'Buyer': 'Dave', 'Power': 2.0, 'Price': 0.1,
+              'transaction_timestamp': str(datetime.now())}
+        tx['tx_hash'] = hashing.hash_transaction(tx)
+        chain_get = self.peer_responses({'peer:5000': peer_chain})
+        fetched = []
+        def get(url, params=None, timeout=None, headers=None):
+            if url.endswith('/transactions/pending'):
+                fetched.append(params['hash'])
+                response = mock.Mock()
+                response.json.return_value = {'transactions': [tx]}
+                return response
+            return chain_get(url, params, timeout, headers)
+        relayed = []
+        def post(url, json=None, timeout=None):
+            relayed.append(url.split('/')[2])
+            return mock.Mock()
+        
+        node = gossip.Gossip(self.blockchain, 'me:5000')
+        node.seen.add('already-seen')
+        message = {'sender': 'peer:5000',
+                   'blocks': [{'index': 3, 'block_hash': peer_chain[-1]['block_hash'],
+                               'announced_at': time.time()}],
+                   'transactions': [{'tx_hash': tx['tx_hash']}, {'tx_hash': 'already-seen'}]}
+        session = self.blockchain._session()
+        with mock.patch.object(session, 'get', get), mock.patch.object(session, 'post', post):
+            self.assertEqual(node.receive(message), 2)
+            self.assertEqual(node.receive(message), 0)
+        
+        self.assertEqual(fetched, [[tx['tx_hash']]])
+        self.assertEqual(self.blockchain.current_transactions, [tx])
+        self.assertEqual(len(self.blockchain.chain), 3)
+        self.assertEqual(relayed, ['other:5000', 'other:5000'])
+        stats = node.stats()
+        self.assertEqual((stats['blocks_adopted'], stats['transactions_added'], stats['duplicates']), (1, 1, 4))
+        self.assertEqual(stats['block_latency']['samples'], 1)
+        # Relayed trades settle like local ones
+        self.assertAlmostEqual(account_manager.get_account("Dave")['balance'], 0.8)
+        self.assertEqual(account_manager.get_account("Carol")['power_balance'], 3.0)
+    
+    def test_gossip_rejects_unknown_senders_and_overdrafts(self):
+        """Test that only registered peers are fetched from, and relayed trades cannot overdraw"""
+        self.blockchain.register_node('http://peer:5000')
+        with db.transaction() as cursor:
+            cursor.executemany("INSERT INTO accounts (id, name, balance, power_balance) VALUES (?, ?, ?, ?)",
+                               [('v', 'Victim', 5.0, 0.0), ('m', 'Mallory', 0.0, 2000.0)])
+        def trade(power):
+            tx = {'Seller': 'Mallory', 'Buyer': 'Victim', 'Power': power, 'Price': 1.0,
+                  'transaction_timestamp': str(datetime.now())}
+            tx['tx_hash'] = hashing.hash_transaction(tx)
+            return tx
+        theft, fair = trade(1000.0), trade(2.0)
+        fetched = []
+        def get(url, params=None, timeout=None, headers=None):
+            fetched.append(url.split('/')[2])
+            response = mock.Mock()
+            response.json.return_value = {'transactions': [theft, fair]}
+            return response
+        
+        node = gossip.Gossip(self.blockchain, 'me:5000')
+        self.blockchain.gossip = node
+        message = {'sender': 'evil.example:80', 'transactions': [{'tx_hash': theft['tx_hash']}]}
+        main.blockchain = self.blockchain
+        try:
+            with mock.patch.object(self.blockchain._session(), 'get', get):
+                response = main.app.test_client().post('/gossip', json=message)
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(fetched, [])
+                
+                message = dict(message, sender='peer:5000',
+                               transactions=[{'tx_hash': tx['tx_hash']} for tx in (theft, fair)])
+                self.assertEqual(node.receive(message), 2)
+        finally:
+            main.blockchain = None
+        
+        self.assertEqual(fetched, ['peer:5000'])
+        self.assertEqual(self.blockchain.current_transactions, [fair])
+        victim = account_manager.get_account("Victim")
+        self.assertEqual((victim['balance'], victim['power_balance']), (3.0, 2.0))
+        self.assertEqual(account_manager.get_account("Mallory")['balance'], 2.0)
+        self.assertEqual(node.stats()['rejected'], 1)
+    
+    def test_gossip_refetches_after_a_failed_fetch(self):
+        """Test that a hash whose fetch failed is fetched again when announced again"""
+        for node in ('a:1', 'b:1', 'c:1'):
+            self.blockchain.register_node(f'http://{node}')
+        with db.transaction() as cursor:
+            cursor.executemany("INSERT INTO accounts (id, name, balance, power_balance) VALUES (?, ?, ?, ?)",
+                               [('c', 'Carol', 0.0, 5.0), ('d', 'Dave', 1.0, 0.0)])
+        tx = {'Seller': 'Carol', 'Buyer': 'Dave', 'Power': 2.0, 'Price': 0.1,
+              'transaction_timestamp': str(datetime.now())}
+        tx['tx_hash'] = hashing.hash_transaction(tx)
+        fetched = []
+        def get(url, params=None, timeout=None, headers=None):
+            node = url.split('/')[2]
+            fetched.append(node)
+            if node == 'a:1':
+                raise requests.exceptions.ConnectionError("connection reset")
+            response = mock.Mock()
+            # b:1 no longer has the transaction, c:1 does
+            response.json.return_value = {'transactions': [tx] if node == 'c:1' else []}
+            return response
+        
+        node = gossip.Gossip(self.blockchain, 'me:5000')
+        announcement = {'transactions': [{'tx_hash': tx['tx_hash']}]}
+        with mock.patch.object(self.blockchain._session(), 'get', get), \
+                mock.patch.object(self.blockchain._session(), 'post', return_value=mock.Mock()), \
+                self.assertLogs(level='ERROR'):
+            for sender in ('a:1', 'b:1', 'c:1', 'a:1'):
+                node.receive(dict(announcement, sender=sender))
+        
+        self.assertEqual(fetched, ['a:1', 'b:1', 'c:1'])
+        self.assertEqual(self.blockchain.current_transactions, [tx])
+        self.assertIn(tx['tx_hash'], node.seen)
+    
+    def test_gossip_receiver_survives_unexpected_errors(self):
+        """Test that an unexpected error handling one announcement does not stop the receiver thread"""
+        self.blockchain.register_node('http://peer:5000')
+        node = gossip.Gossip(self.blockchain, 'me:5000')
+        handled = []
+        def fetch(sender, items):
+            handled.append(items[0]['tx_hash'])
+            if len(handled) == 1:
+                raise RuntimeError("boom")
+        
+        with mock.patch.object(node, '_fetch_transactions', fetch), self.assertLogs(level='ERROR') as logs:
+            node.start()
+            try:
+                for tx_hash in ('first', 'second'):
+                    node.receive({'sender': 'peer:5000', 'transactions': [{'tx_hash': tx_hash}]})
+                deadline = time.time() + 5
+                while len(handled) < 2 and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertTrue(all(thread.is_alive() for thread in node._threads))
+            finally:
+                node.close()
+        
+        self.assertEqual(handled, ['first', 'second'])
+        self.assertIn("RuntimeError: boom", logs.output[0])
+    
+    def test_wire_format_round_trip(self):
+        """Test that the binary wire format decodes to exactly what was encoded, in fewer bytes than JSON"""
+        self.mine_blocks(3)
+        chain = list(self.blockchain.chain)
+        # Blocks and transactions from before tx hashes, Merkle roots and recorded difficulty
+        legacy = {'index': 5, 'timestamp': '2024-01-01T00:00:00Z', 'proof': 7, 'previous_hash': '1',
+                  'block_hash': 'ABC', 'transactions': [{'Seller': 'Ünïcode', 'Buyer': 'Bob', 'Power': 3,
+                                                         'Price': 0.5}]}
+        blocks = chain + [legacy]
+        
+        decoded = wire.decode(wire.encode_chain(blocks, 9, 1, 5))
+        self.assertEqual(decoded, {'chain': blocks, 'length': 9, 'from': 1, 'to': 5})
+        self.assertIsInstance(decoded['chain'][-1]['transactions'][0]['Power'], int)
+        self.assertTrue(self.blockchain.valid_chain(decoded['chain'][:4]))
+        
+        headers = [chain_responses.header_view(block) for block in chain]
+        self.assertEqual(wire.decode(wire.encode_chain(headers, 4, 1, 4, headers_only=True))['chain'], headers)
+        transactions = chain[-1]['transactions'] + legacy['transactions']
+        self.assertEqual(wire.decode(wire.encode_transactions(transactions)), {'transactions': transactions})
+        
+        body = wire.encode_chain(chain, 4, 1, 4)
+        self.assertLess(len(body), len(chain_responses.dumps({'chain': chain})) / 2)
+        with self.assertRaises(wire.WireError):
+            wire.decode(body[:-10])
+        with self.assertRaises(wire.WireError):
+            wire.encode_chain([dict(chain[0], extra=1)], 1, 1, 1)
+    
+    def test_wire_format_rejects_malformed_messages(self):
+        """Test that truncated and malformed wire messages raise WireError, never another exception"""
+        self.mine_blocks(2)
+        chain = list(self.blockchain.chain)
+        body = wire.encode_chain(chain, 3, 1, 3)
+        for size in range(len(body)):
+            with self.assertRaises(wire.WireError):
+                wire.decode(body[:size])
+        
+        def message(kind, strings, head, records):
+            table = wire._U32.pack(len(strings)) + b''.join(wire._U32.pack(len(value)) + value
+                                                            for value in strings)
+            return wire._PREAMBLE.pack(wire.MAGIC, wire.VERSION, kind) + table + head + b''.join(records)
+        def transaction(flags=0, timestamp=0, seller=0):
+            return wire._TRANSACTION.pack(seller, 0, 1.0, 0.1, flags, timestamp, bytes(32))
+        def block(flags=0, timestamp=0):
+            return wire._BLOCK.pack(1, 0, 0, flags, timestamp, bytes(32), bytes(32), bytes(32), 0)
+        one_block = wire._CHAIN_HEAD.pack(1, 1, 1, 1, 1)
+        malformed = {
+            'bad magic': b'XX' + body[2:],
+            'unknown kind': message(9, [], b'', []),
+            'invalid utf-8': message(wire.TRANSACTIONS, [b'\xff'], wire._U32.pack(0), []),
+            'transaction timestamp overflow': message(wire.TRANSACTIONS, [b'Alice'], wire._U32.pack(1),
+                                                      [transaction(wire.HAS_TIMESTAMP, 2 ** 62)]),
+            'block timestamp overflow': message(wire.CHAIN, [], one_block, [block(0, 2 ** 62)]),
+            'negative string ref': message(wire.CHAIN, [b'x'], one_block,
+                                           [block(wire.BLOCK_TIMESTAMP_STRING, -1)]),
+            'transaction string ref': message(wire.TRANSACTIONS, [b'Alice'], wire._U32.pack(1),
+                                              [transaction(seller=5)]),
+            'transaction count': message(wire.TRANSACTIONS, [b'Alice'], wire._U32.pack(2), [transaction()]),
+        }
+        for name, data in malformed.items():
+            with self.subTest(name), self.assertRaises(wire.WireError):
+                wire.decode(data)
+    
+    def test_sync_over_wire_format(self):
+        """Test that peers answering in the binary format are decoded transparently"""
+        self.mine_blocks(2)
+        peer_chain = list(self.blockchain.chain)
+        self.blockchain.cursor.execute("DELETE FROM Blockchain WHERE block_index > 1")
+        self.blockchain.conn.commit()
+        self.blockchain.chain = peer_chain[:1]
+        
+        json_get = self.peer_responses({'peer:5000': peer_chain})
+        accepts = []
+        def get(url, params=None, timeout=None, headers=None):
+            accepts.append(headers['Accept'])
+            data = json_get(url, params, timeout).json()
+            response = mock.Mock(headers={'Content-Type': wire.CONTENT_TYPE})
+            response.content = wire.encode_chain(data['chain'], data['length'], data['from'], data['to'],
+                                                 headers_only=bool(params.get('headers')))
+            return response
+        with mock.patch.object(self.blockchain._session(), 'get', get):
+            self.assertEqual(self.blockchain.sync_from('peer:5000'), 0)
+        self.assertEqual(list(self.blockchain.chain), peer_chain)
+        self.assertTrue(all(accept.startswith(wire.CONTENT_TYPE) for accept in accepts))
+    
+    def test_bounded_chain_window(self):
+        """Test that bounded-memory mode serves old blocks from the database through an LRU cache"""
+        self.mine_blocks(6)
+        full_chain = list(self.blockchain.chain)
+        
+        bounded = Blockchain(max_resident_blocks=2, block_cache_size=2)
+        self.assertEqual(len(bounded.chain), 7)
+        self.assertEqual(bounded.load_stats['blocks'], 2)
+        self.assertEqual(bounded.last_block, full_chain[-1])
+        self.assertEqual(list(bounded.chain), full_chain)
+        self.assertEqual(bounded.chain[1:4], full_chain[1:4])
+        self.assertEqual(bounded.chain[-3:], full_chain[-3:])
+        
+        # Older blocks come from the cache after the first read
+        self.assertEqual(bounded.chain[0], full_chain[0])
+        self.assertEqual(bounded.chain[0], full_chain[0])
+        stats = bounded.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        bounded.chain[1], bounded.chain[2]
+        self.assertEqual(bounded.cache_stats()['evictions'], 1)
+        self.assertEqual(bounded.cache_stats()['cached_blocks'], 2)
+        
+        # Validation and mining work unchanged on top of the window
+        self.assertTrue(bounded.validate_chain(full=True))
+        bounded.new_transaction_seller("Alice", "Bob", 1.0, 0.001)
+        block = bounded.new_block(bounded.proof_of_work(bounded.last_block['proof']))
+        self.assertEqual(len(bounded.chain), 8)
+        self.assertEqual(bounded.cache_stats()['resident_blocks'], 2)
+        self.assertEqual(bounded.chain[-1], block)
+        self.assertEqual(bounded.chain[5], full_chain[5])
+        self.assertTrue(bounded.validate_chain())
+        bounded.conn.close()
+        self.assertIsNone(self.blockchain.cache_stats())
+    
     def test_block_hash_calculation(self):
         """Test that block hashes are calculated correctly"""
         block = self.blockchain.last_block
@@ -159,6 +922,107 @@ class TestBlockchain(unittest.TestCase):
         self.assertEqual(len(calculated_hash), 64)
         self.assertIsInstance(calculated_hash, str)
     
+    def test_merkle_root_block_hash(self):
+        """Test that blocks hash their header and commit to transactions via a Merkle root"""
+        self.blockchain.new_transaction_seller("Alice", "Bob", 10.0, 0.001)
+        self.blockchain.new_transaction_seller("Charlie", "David", 20.0, 0.002)
+        self.blockchain.new_transaction_seller("Eve", "Frank", 15.0, 0.0015)
+        tx_hashes = [tx['tx_hash'] for tx in self.blockchain.current_transactions]
+        self.assertEqual(tx_hashes, [hashing.hash_transaction(tx) for tx in self.blockchain.current_transactions])
+        
+        last_block = self.blockchain.last_block
+        block = self.blockchain.new_block(self.blockchain.proof_of_work(last_block['proof']))
+        self.assertEqual(block['previous_hash'], last_block['block_hash'])
+        self.assertEqual(block['merkle_root'], hashing.merkle_root(tx_hashes))
+        self.assertEqual(block['block_hash'], self.blockchain.hash(hashing.block_header(block)))
+        
+        # The hash covers the header only; the transactions are bound through the root
+        self.assertEqual(self.blockchain.hash(dict(block, transactions=[])), block['block_hash'])
+        self.assertNotEqual(hashing.merkle_root(tx_hashes[:2]), block['merkle_root'])
+        self.assertEqual(hashing.merkle_root(tx_hashes[:1]), tx_hashes[0])
+        
+        # Roots and cached transaction hashes survive a reload
+        reloaded = Blockchain()
+        self.assertEqual(reloaded.chain[-1]['merkle_root'], block['merkle_root'])
+        self.assertEqual([tx['tx_hash'] for tx in reloaded.chain[-1]['transactions']], tx_hashes)
+        self.assertEqual(reloaded.hash(reloaded.chain[-1]), block['block_hash'])
+        reloaded.conn.close()
+    
+    def test_trades_queued_while_a_block_is_stored(self):
+        """Test that trades added while a block is being stored wait for the next block"""
+        self.blockchain.new_transaction_seller("Alice", "Bob", 1.0, 0.1)
+        insert_block = Blockchain._insert_block
+        threads = []
+        def insert_and_trade(cursor, block):
+            # One trade from another thread (blocked on the lock) and one from this one
+            thread = threading.Thread(target=self.blockchain.new_transaction_seller,
+                                      args=("Carol", "Dave", 2.0, 0.1))
+            thread.start()
+            thread.join(0.2)
+            threads.append(thread)
+            self.blockchain.new_transaction_seller("Eve", "Frank", 3.0, 0.1)
+            return insert_block(cursor, block)
+        
+        with mock.patch.object(Blockchain, '_insert_block', staticmethod(insert_and_trade)):
+            block = self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        threads[0].join()
+        
+        self.assertEqual([tx['Seller'] for tx in block['transactions']], ["Alice"])
+        self.assertEqual(sorted(tx['Seller'] for tx in self.blockchain.current_transactions), ["Carol", "Eve"])
+        self.assertTrue(self.blockchain.validate_chain(full=True))
+        reloaded = Blockchain()
+        self.assertEqual(reloaded.chain[-1]['transactions'], block['transactions'])
+        reloaded.conn.close()
+    
+    def test_inclusion_proofs(self):
+        """Test that every transaction in a block has a verifiable inclusion proof"""
+        for i in range(5):
+            self.blockchain.new_transaction_seller("Alice", "Bob", 10.0 + i, 0.001)
+        tx_hashes = [tx['tx_hash'] for tx in self.blockchain.current_transactions]
+        last_block = self.blockchain.last_block
+        block = self.blockchain.new_block(self.blockchain.proof_of_work(last_block['proof']))
+        
+        for position, tx_hash in enumerate(tx_hashes):
+            proof = self.blockchain.get_inclusion_proof(tx_hash)
+            self.assertEqual(proof['position'], position)
+            self.assertEqual(proof['header']['block_hash'], block['block_hash'])
+            self.assertNotIn('transactions', proof['header'])
+            self.assertTrue(Blockchain.verify_inclusion_proof(proof))
+        
+        # Tampering with any part of the proof is detected
+        proof = self.blockchain.get_inclusion_proof(tx_hashes[2])
+        forged = dict(proof, transaction=dict(proof['transaction'], Power=999.0))
+        self.assertFalse(Blockchain.verify_inclusion_proof(forged))
+        forged = dict(proof, tx_hash=tx_hashes[3])
+        self.assertFalse(Blockchain.verify_inclusion_proof(forged))
+        forged = dict(proof, siblings=proof['siblings'][::-1])
+        self.assertFalse(Blockchain.verify_inclusion_proof(forged))
+        forged = dict(proof, header=dict(proof['header'], merkle_root=hashing.merkle_root(tx_hashes[:2])))
+        self.assertFalse(Blockchain.verify_inclusion_proof(forged))
+        
+        # Pending and unknown transactions have no proof
+        self.blockchain.new_transaction_seller("Alice", "Bob", 1.0, 0.001)
+        self.assertIsNone(self.blockchain.get_inclusion_proof(self.blockchain.current_transactions[0]['tx_hash']))
+        self.assertIsNone(self.blockchain.get_inclusion_proof('00' * 32))
+    
+    def test_legacy_block_hash(self):
+        """Test that blocks without a Merkle root keep their full-body hash"""
+        import hashlib
+        import json
+        block = {
+            'index': 2,
+            'timestamp': '2024-01-01 00:00:00',
+            'transactions': [{'Seller': 'Alice', 'Buyer': 'Bob', 'Power': 1.0, 'Price': 0.5,
+                              'transaction_timestamp': '2024-01-01 00:00:00'}],
+            'proof': 35293,
+            'previous_hash': '1',
+        }
+        expected = hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+        
+        self.assertEqual(self.blockchain.hash(block), expected)
+        block['transactions'][0]['tx_hash'] = hashing.hash_transaction(block['transactions'][0])
+        self.assertEqual(self.blockchain.hash(dict(block, block_hash=expected)), expected)
+    
     def test_multiple_transactions(self):
         """Test adding multiple transactions"""
         # Add multiple transactions
@@ -180,6 +1044,74 @@ class TestBlockchain(unittest.TestCase):
         self.assertEqual(len(self.blockchain.nodes), 2)
 
 
+class TestMiningJobs(unittest.TestCase):
+    """Test suite for background mining jobs"""
+    
+    def setUp(self):
+        """Set up a blockchain in a temporary database"""
+        self.test_dir = tempfile.mkdtemp()
+        self.original_dir = os.getcwd()
+        os.chdir(self.test_dir)
+        create_test_tables()
+        self.blockchain = Blockchain(reset_chain=True)
+        self.jobs = MiningJobManager(self.blockchain)
+        
+    def tearDown(self):
+        """Clean up test fixtures"""
+        self.blockchain.conn.close()
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def wait_for(self, job):
+        status = job.status
+        while not job.finished:
+            status = job.wait(timeout=10, last_status=status)
+        return job.status
+    
+    def block_until_stopped(self):
+        """Replace proof_of_work with a search that only ends when told to stop"""
+        def proof_of_work(last_proof, should_stop=None, difficulty=None):
+            while not should_stop():
+                time.sleep(0.01)
+            return None
+        self.blockchain.proof_of_work = proof_of_work
+    
+    def test_job_mines_block(self):
+        """Test that a job mines the next block in the background"""
+        self.blockchain.new_transaction_seller("Alice", "Bob", 10.0, 0.001)
+        job, created = self.jobs.start()
+        
+        self.assertTrue(created)
+        self.assertEqual(self.wait_for(job), 'completed')
+        self.assertEqual(len(self.blockchain.chain), 2)
+        self.assertEqual(job.to_dict()['block']['index'], 2)
+        self.assertEqual(len(job.block['transactions']), 1)
+        self.assertTrue(self.blockchain.validate_chain())
+    
+    def test_one_job_per_tip(self):
+        """Test that a second start joins the job already mining the tip"""
+        self.block_until_stopped()
+        job, _ = self.jobs.start()
+        same_job, created = self.jobs.start()
+        
+        self.assertFalse(created)
+        self.assertIs(same_job, job)
+        self.jobs.cancel(job.id)
+        self.assertEqual(self.wait_for(job), 'cancelled')
+        self.assertEqual(len(self.blockchain.chain), 1)
+    
+    def test_job_abandoned_when_tip_changes(self):
+        """Test that a job stops once another block is appended to its tip"""
+        self.block_until_stopped()
+        job, _ = self.jobs.start()
+        
+        last_proof = self.blockchain.last_block['proof']
+        self.blockchain.new_block(mining.proof_of_work(last_proof))
+        
+        self.assertEqual(self.wait_for(job), 'abandoned')
+        self.assertEqual(len(self.blockchain.chain), 2)
+
+
 class TestAccountManager(unittest.TestCase):
     """Test suite for Account Manager module"""
     
@@ -191,6 +1123,7 @@ class TestAccountManager(unittest.TestCase):
         
     def tearDown(self):
         """Clean up test fixtures"""
+        db.close_all()
         if hasattr(self, 'original_dir'):
             os.chdir(self.original_dir)
         if hasattr(self, 'test_dir'):
@@ -200,6 +1133,58 @@ class TestAccountManager(unittest.TestCase):
                 # Windows file handle timing issue - ignore cleanup errors
                 pass
     
+    def test_pooled_connections(self):
+        """Test that each thread reuses one configured connection"""
+        conn = db.get_connection()
+        self.assertIs(db.get_connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        
+        # Other threads get their own connection
+        other = []
+        thread = threading.Thread(target=lambda: other.append(db.get_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+        
+        # Closing the pool hands out a fresh connection
+        db.close_all()
+        self.assertIsNot(db.get_connection(), conn)
+
+    def test_pooled_connections_closed_with_their_thread(self):
+        """Test that short-lived threads, like one per request, do not leak connections"""
+        db.get_connection()
+        opened = []
+        def work():
+            conn = db.get_connection()
+            conn.execute("SELECT 1")
+            opened.append(conn)
+        for _ in range(50):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        path = db.db_path()
+        self.assertEqual(len([conn for conn_path, conn in db._open_connections.values() if conn_path == path]), 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            opened[0].execute("SELECT 1")
+
+    def test_schema_checked_once(self):
+        """Test that account calls do not re-run schema checks"""
+        account_manager.create_account("TestUser")
+        with mock.patch.object(db, '_apply_schema') as apply_schema:
+            account_manager.update_balance("TestUser", 5.0)
+            account_manager.get_account("TestUser")
+            account_manager.get_all_accounts()
+        apply_schema.assert_not_called()
+    
+    def test_failed_update_rolls_back(self):
+        """Test that a failed balance update leaves nothing uncommitted"""
+        account_manager.create_account("TestUser")
+        with self.assertRaises(ValueError):
+            account_manager.update_balance("TestUser", -1.0)
+        self.assertFalse(db.get_connection().in_transaction)
+        self.assertEqual(account_manager.update_balance("TestUser", 2.0), 2.0)
+    
     def test_account_creation(self):
         """Test creating a new account"""
         account = account_manager.create_account("TestUser")
@@ -293,6 +1278,193 @@ class TestAccountManager(unittest.TestCase):
         with self.assertRaises(ValueError):
             account_manager.update_power_balance("TestUser", -10.0)
     
+    def test_settle_trade(self):
+        """Test that a trade moves ETH and power for both parties"""
+        account_manager.create_account("Seller")
+        account_manager.create_account("Buyer")
+        account_manager.update_power_balance("Seller", 50.0)
+        account_manager.update_balance("Buyer", 100.0)
+        
+        result = account_manager.settle_trade("Seller", "Buyer", 20.0, 30.0)
+        
+        self.assertEqual(result["seller"]["before"], {"balance": 0.0, "power_balance": 50.0})
+        self.assertEqual(result["seller"]["after"], {"balance": 30.0, "power_balance": 30.0})
+        self.assertEqual(result["buyer"]["before"], {"balance": 100.0, "power_balance": 0.0})
+        self.assertEqual(result["buyer"]["after"], {"balance": 70.0, "power_balance": 20.0})
+        self.assertEqual(account_manager.get_account("Buyer")["balance"], 70.0)
+    
+    def test_settle_trade_all_or_nothing(self):
+        """Test that a failed trade leaves both accounts unchanged"""
+        account_manager.create_account("Seller")
+        account_manager.create_account("Buyer")
+        account_manager.update_power_balance("Seller", 50.0)
+        account_manager.update_balance("Buyer", 10.0)
+        
+        # The seller's side would succeed, the buyer cannot pay
+        with self.assertRaises(ValueError):
+            account_manager.settle_trade("Seller", "Buyer", 20.0, 30.0)
+        with self.assertRaises(ValueError):
+            account_manager.settle_trade("Seller", "Nobody", 1.0, 1.0)
+        
+        seller = account_manager.get_account("Seller")
+        buyer = account_manager.get_account("Buyer")
+        self.assertEqual((seller["balance"], seller["power_balance"]), (0.0, 50.0))
+        self.assertEqual((buyer["balance"], buyer["power_balance"]), (10.0, 0.0))
+    
+    def test_account_cache_write_through(self):
+        """Test that cached accounts are served from memory and kept current"""
+        cache = account_manager.account_cache
+        account_manager.create_account("Seller")
+        account_manager.create_account("Buyer")
+        account_manager.get_account("Seller")
+        account_manager.get_account("Buyer")
+        hits = cache.hits
+        
+        account_manager.update_power_balance("Seller", 50.0)
+        account_manager.update_balance("Buyer", 100.0)
+        account_manager.settle_trade("Seller", "Buyer", 20.0, 30.0)
+        
+        # Served from the cache without going back to the database
+        with mock.patch.object(db, 'get_connection') as get_connection:
+            seller = account_manager.get_account("Seller")
+            buyer = account_manager.get_account("Buyer")
+        get_connection.assert_not_called()
+        self.assertEqual(cache.hits, hits + 2)
+        self.assertEqual((seller["balance"], seller["power_balance"]), (30.0, 30.0))
+        self.assertEqual((buyer["balance"], buyer["power_balance"]), (70.0, 20.0))
+    
+    def test_account_cache_eviction(self):
+        """Test that the account cache stays within its size bound"""
+        cache = account_cache.AccountCache(max_size=2)
+        for name in ("a", "b", "c"):
+            cache.fill(name, {"name": name}, cache.version)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), {"name": "c"})
+        self.assertEqual(cache.stats()["evictions"], 1)
+        
+        # A read that overlapped a write is not cached
+        version = cache.version
+        with cache.writing():
+            cache.update("b", balance=1.0)
+        cache.fill("d", {"name": "d"}, version)
+        self.assertIsNone(cache.get("d"))
+        
+        cache.clear()
+        self.assertIsNone(cache.get("c"))
+    
+    def test_key_pool(self):
+        """Test that accounts take pre-generated keys from the pool"""
+        pool = account_manager.start_key_pool(2, workers=1)
+        try:
+            deadline = time.time() + 30
+            while pool.stats()['depth'] < 2 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(pool.stats()['depth'], 2)
+            
+            account = account_manager.create_account("TestUser")
+            self.assertIn("BEGIN PUBLIC KEY", account['public_key'])
+            stats = pool.stats()
+            self.assertEqual(stats['taken'], 1)
+            self.assertGreater(stats['refill_rate'], 0)
+        finally:
+            account_manager.start_key_pool(0)
+        self.assertIsNone(account_manager.key_pool)
+    
+    def test_key_pool_empty_falls_back_inline(self):
+        """Test that an empty pool does not block account creation"""
+        pool = key_pool.KeyPool(low_water=2)  # never started, so always empty
+        with mock.patch.object(account_manager, 'key_pool', pool):
+            account = account_manager.create_account("TestUser")
+        self.assertIn("BEGIN PUBLIC KEY", account['public_key'])
+        self.assertEqual(pool.stats()['empty'], 1)
+    
+    def test_create_accounts_bulk(self):
+        """Test bulk creation with per-name results"""
+        account_manager.create_account("Existing")
+        
+        results = account_manager.create_accounts(
+            ["Alice", " Bob ", "Alice", "Existing", "", "Carol"], workers=2, batch_size=2)
+        
+        self.assertEqual([result['status'] for result in results],
+                         ["created", "created", "failed", "failed", "failed", "created"])
+        self.assertEqual(results[1]['name'], "Bob")
+        self.assertIn("Duplicate", results[2]['error'])
+        self.assertIn("already exists", results[3]['error'])
+        self.assertIn("BEGIN PUBLIC KEY", results[5]['public_key'])
+        self.assertEqual(account_manager.get_account("Carol")['id'], results[5]['id'])
+        self.assertEqual(len(account_manager.get_all_accounts()), 4)
+
+    def test_create_accounts_key_generation_failure(self):
+        """Test that a broken key generation pool fails names one by one instead of the request"""
+        from concurrent.futures.process import BrokenProcessPool
+        pool = mock.Mock()
+        pool.take.side_effect = [("private", "public"), None]
+        def broken(count, workers=None):
+            raise BrokenProcessPool("A worker died")
+        with mock.patch.object(account_manager, 'key_pool', pool), \
+                mock.patch.object(account_manager, 'generate_key_pairs', broken):
+            results = account_manager.create_accounts(["Alice", "Bob", "Carol"])
+        self.assertEqual([result['status'] for result in results], ["created", "failed", "failed"])
+        self.assertIn("key pair", results[1]['error'])
+        self.assertEqual([account['name'] for account in account_manager.get_all_accounts()], ["Alice"])
+
+        # The pool itself falls back to generating inline when a worker dies
+        executor = mock.MagicMock()
+        executor.__enter__.return_value.map.side_effect = BrokenProcessPool("A worker died")
+        with mock.patch.object(key_pool, 'ProcessPoolExecutor', return_value=executor):
+            self.assertEqual(len(key_pool.generate_key_pairs(2, workers=2)), 2)
+
+    def test_read_names(self):
+        """Test parsing NDJSON and plain name lists"""
+        lines = ['"Alice"', '{"name": "Bob"}', '', 'Carol', '  ']
+        self.assertEqual(provision_accounts.read_names(lines), ["Alice", "Bob", "Carol"])
+    
+    def test_accounts_keyset_pagination(self):
+        """Test paging through accounts with a cursor and field projection"""
+        names = [f"user{i:02d}" for i in range(7)]
+        with mock.patch.object(account_manager, 'generate_key_pairs',
+                               lambda count, workers=None: [("private", "public")] * count):
+            account_manager.create_accounts(names)
+        
+        pages, after = [], None
+        while True:
+            accounts, after = account_manager.get_accounts_page(after=after, limit=3, fields=["name"])
+            pages.append(accounts)
+            if after is None:
+                break
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([account for page in pages for account in page],
+                         [{"name": name} for name in names])
+        
+        by_id = [account['id'] for account in account_manager.iter_accounts('id', batch_size=2)]
+        self.assertEqual(by_id, sorted(by_id))
+        self.assertEqual(len(by_id), 7)
+        
+        with self.assertRaises(ValueError):
+            account_manager.get_accounts_page(fields=["private_key"])
+    
+    def test_settle_trades_batch(self):
+        """Test that a batch settles in order and failed trades roll back alone"""
+        account_manager.create_account("Seller")
+        account_manager.create_account("Buyer")
+        account_manager.update_power_balance("Seller", 10.0)
+        account_manager.update_balance("Buyer", 10.0)
+        
+        results = account_manager.settle_trades([
+            ("Seller", "Buyer", 4.0, 4.0),
+            ("Seller", "Buyer", 4.0, 8.0),   # buyer has only 6 ETH left
+            ("Seller", "Nobody", 1.0, 1.0),
+            ("Seller", "Buyer", 4.0, 6.0),
+        ])
+        
+        self.assertEqual(results[0]["buyer"]["after"], {"balance": 6.0, "power_balance": 4.0})
+        self.assertIn("Insufficient ETH", results[1]["error"])
+        self.assertIn("does not exist", results[2]["error"])
+        self.assertEqual(results[3]["seller"]["after"], {"balance": 10.0, "power_balance": 2.0})
+        # The failed trades' seller-side updates were rolled back
+        seller = account_manager.get_account("Seller")
+        self.assertEqual((seller["balance"], seller["power_balance"]), (10.0, 2.0))
+    
     def test_get_all_accounts(self):
         """Test retrieving all accounts"""
         account_manager.create_account("Alice")
@@ -309,6 +1481,119 @@ class TestAccountManager(unittest.TestCase):
         self.assertIn("Charlie", names)
 
 
+class TestChainEndpoint(unittest.TestCase):
+    """Tests for GET /chain through the Flask test client"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.original_dir = os.getcwd()
+        os.chdir(self.test_dir)
+        create_test_tables()
+        self.blockchain = Blockchain(reset_chain=True)
+        for i in range(3):
+            self.blockchain.new_transaction_seller("Alice", "Bob", 10.0 + i, 0.001)
+            self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        main.blockchain = self.blockchain
+        main.chain_cache = chain_responses.ChainResponseCache()
+        self.client = main.app.test_client()
+    
+    def tearDown(self):
+        main.blockchain = main.chain_cache = None
+        self.blockchain.conn.close()
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def get_chain(self, **params):
+        response = self.client.get('/chain', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+    
+    def test_chain_range_and_limit(self):
+        """Test that from/to select heights, and to and limit are clamped to the chain"""
+        body = self.get_chain(**{'from': 2, 'to': 3})
+        self.assertEqual([block['index'] for block in body['chain']], [2, 3])
+        self.assertEqual((body['length'], body['from'], body['to']), (4, 2, 3))
+        
+        body = self.get_chain(**{'from': 3, 'to': 99})
+        self.assertEqual([block['index'] for block in body['chain']], [3, 4])
+        self.assertEqual(body['to'], 4)
+        self.assertEqual([block['index'] for block in self.get_chain(limit=2)['chain']], [1, 2])
+        self.assertEqual([block['index'] for block in self.get_chain(**{'from': 2, 'limit': 100})['chain']],
+                         [2, 3, 4])
+        self.assertEqual(self.get_chain(**{'from': 9})['chain'], [])
+        self.assertEqual(len(self.get_chain()['chain']), 4)
+        
+        headers = self.get_chain(headers=1, **{'from': 2, 'to': 2})['chain'][0]
+        self.assertNotIn('transactions', headers)
+        self.assertEqual(headers['transaction_count'], 1)
+        self.assertEqual(headers['block_hash'], self.blockchain.chain[1]['block_hash'])
+    
+    def test_chain_invalid_params(self):
+        """Test that malformed or out-of-range parameters are rejected with 400"""
+        for params in ({'from': 'abc'}, {'to': '1.5'}, {'limit': 'x'}, {'from': 0}, {'limit': 0},
+                       {'from': -3}):
+            response = self.client.get('/chain', query_string=params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.get_json())
+    
+    def test_chain_ndjson(self):
+        """Test that NDJSON streams one block per line, by parameter or Accept header"""
+        response = self.client.get('/chain', query_string={'format': 'ndjson', 'from': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.headers['X-Chain-Length'], '4')
+        self.assertEqual(response.headers['Vary'], 'Accept, Accept-Encoding')
+        self.assertTrue(response.data.endswith(b'\n'))
+        lines = response.data.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], list(self.blockchain.chain[1:]))
+        
+        response = self.client.get('/chain', query_string={'headers': 1},
+                                   headers={'Accept': 'application/x-ndjson'})
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([block['index'] for block in lines], [1, 2, 3, 4])
+        self.assertTrue(all('transactions' not in block for block in lines))
+
+    def test_chain_etag_not_modified(self):
+        """Test that a matching If-None-Match gets 304 until the tip changes"""
+        first = self.client.get('/chain')
+        etag = first.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/chain', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Vary'], 'Accept, Accept-Encoding')
+        # Another range is another representation
+        other = self.client.get('/chain', query_string={'limit': 1}, headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+
+        self.blockchain.new_block(self.blockchain.proof_of_work(self.blockchain.last_block['proof']))
+        response = self.client.get('/chain', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.get_json()['length'], 5)
+
+    def test_chain_gzip_and_vary(self):
+        """Test that large bodies are gzipped only for clients that accept it, with Vary set"""
+        import gzip
+        with mock.patch.object(chain_responses, 'GZIP_MIN_BYTES', 0):
+            plain = self.client.get('/chain')
+            compressed = self.client.get('/chain', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        for response in (plain, compressed):
+            vary = {value.strip() for value in response.headers['Vary'].split(',')}
+            self.assertEqual(vary, {'Accept', 'Accept-Encoding'})
+        # Both encodings are the same representation
+        self.assertEqual(plain.headers['ETag'], compressed.headers['ETag'])
+
+        # Small bodies are not worth compressing
+        small = self.client.get('/chain', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+
+
 class TestTransactionFlow(unittest.TestCase):
     """Integration tests for complete transaction flow"""
     
@@ -379,6 +1664,29 @@ class TestTransactionFlow(unittest.TestCase):
         self.assertTrue(self.blockchain.validate_chain())
 
 
+
+@unittest.skipUnless(os.environ.get('RUN_CLUSTER_TESTS'), "starts node processes; set RUN_CLUSTER_TESTS=1")
+class TestCluster(unittest.TestCase):
+    """Smoke test of the local cluster benchmark"""
+    
+    def test_two_nodes_one_round(self):
+        """Test that a 2-node round converges and reports the block reaching the other node"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(test_dir, 'report.json')
+            code = cluster.main(['--nodes', '2', '--rounds', '1', '--base-port', '5400', '--seed', '1',
+                                 '--workdir', os.path.join(test_dir, 'nodes'), '--output', output])
+            with open(output) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        
+        self.assertEqual(code, 0)
+        self.assertEqual(report['converged_rounds'], 1)
+        self.assertEqual(len({tip['block_hash'] for tip in report['final_tips']}), 1)
+        self.assertEqual(len(report['round_details'][0]['propagation_seconds']), 1)
+        self.assertEqual(report['full_propagation_seconds']['samples'], 1)
+
 def run_tests():
     """Run all tests"""
     # Create test suite
@@ -387,8 +1695,11 @@ def run_tests():
     
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(TestBlockchain))
+    suite.addTests(loader.loadTestsFromTestCase(TestMiningJobs))
     suite.addTests(loader.loadTestsFromTestCase(TestAccountManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestChainEndpoint))
     suite.addTests(loader.loadTestsFromTestCase(TestTransactionFlow))
+    suite.addTests(loader.loadTestsFromTestCase(TestCluster))
     
     # Run tests
     runner = unittest.TextTestRunner(verbosity=2)